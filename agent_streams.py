@@ -0,0 +1,77 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+This file holds AgentStreams, which hands out random numbers that only depend on the seed, the time step, what they're
+for (the phase) and which agent they belong to. A single Generator gives different numbers to the same agent depending
+on how many draws came before it, so splitting the population up between threads or processes (or just drawing for
+fewer people) changes every result after that point. Here the agents are split into fixed blocks, and every
+(step, phase, block) gets its own Philox stream. Philox is counter based, so jumping straight to a stream is just a
+matter of setting its counter, and no state has to be kept (or saved in a checkpoint) between steps.
+
+The counter of a Philox stream is four 64 bit words. The first one counts the draws within a block, and the other three
+hold the step, the phase and the block, so no two streams ever overlap.
+"""
+
+# What the random numbers of a step are used for. Each one gets its own streams
+PHASE_POST = 0
+PHASE_POST_LEANING = 1
+PHASE_POST_INTEREST = 2
+PHASE_READ = 3
+PHASE_STAY_ONLINE = 4
+PHASE_CHECK_PHONE = 5
+
+
+class AgentStreams:
+    def __init__(self, seed=None, block_size=4096, num_threads=1):
+        """
+        @param seed: anything np.random.SeedSequence takes (including a SeedSequence, like the ones MCRunner spawns for
+        every realization). None picks a fresh one
+        @param block_size: how many agents share a stream. It has to stay the same for results to be reproducible
+        @param num_threads: how many threads fill in the blocks. Doesn't change the numbers that come out
+        """
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_seq = seed
+        self.key = seed.generate_state(2, np.uint64)
+        self.block_size = block_size
+        self.num_threads = num_threads
+
+    # Generator for the draws of one block. Its counter starts at [0, step, phase, block]
+    def _block_generator(self, step, phase, block):
+        counter = np.array([0, step, phase, block], dtype=np.uint64)
+        return np.random.Generator(np.random.Philox(key=self.key, counter=counter))
+
+    # Fills in the draws for every block that agents touches, and returns the ones that belong to agents
+    def _draw(self, step, phase, agents, draw):
+        agents = np.asarray(agents, dtype=np.int64)
+        if len(agents) == 0:
+            return np.zeros(0)
+        blocks = np.unique(agents // self.block_size)
+        values = np.zeros([len(blocks), self.block_size])
+
+        def fill(i):
+            values[i] = draw(self._block_generator(step, phase, int(blocks[i])), self.block_size)
+
+        if self.num_threads > 1 and len(blocks) > 1:
+            with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+                list(executor.map(fill, range(len(blocks))))
+        else:
+            for i in range(len(blocks)):
+                fill(i)
+        rows = np.searchsorted(blocks, agents // self.block_size)
+        return values[rows, agents % self.block_size]
+
+    # Uniform numbers in [0, 1), one for each agent in agents
+    def random(self, step, phase, agents):
+        return self._draw(step, phase, agents, lambda generator, size: generator.random(size))
+
+    # Normally distributed numbers, one for each agent in agents
+    def normal(self, step, phase, agents, loc=0.0, scale=1.0):
+        return self._draw(step, phase, agents, lambda generator, size: generator.normal(loc, scale, size))
+
+    # A Generator of an agent's own, for code that draws one number at a time (like Person). It only depends on the
+    # seed and the agent, so it doesn't matter which process the agent ends up in
+    def agent_generator(self, agent):
+        counter = np.array([0, 0, 2 ** 64 - 1, agent], dtype=np.uint64)
+        return np.random.Generator(np.random.Philox(key=self.key, counter=counter))
@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import subprocess
+
+"""
+Measures how long it takes a fresh python process to import the simulation core, which is what every worker process of
+MCRunner and Sweep pays before doing any work. Each module is imported in its own interpreter (so nothing is cached from
+an earlier import), a few times, and the best time is kept. It also checks that none of the plotting libraries were
+pulled in along the way.
+
+Run it from anywhere with: python benchmarks/import_time.py
+"""
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORE_MODULES = ['person', 'post_store', 'population', 'graph_funcs', 'mc_runner', 'sweep', 'social_media']
+PLOTTING_MODULES = ['matplotlib', 'netgraph', 'networkx_viewer', 'tkinter']
+
+# Code run in the fresh interpreter. Prints the import time and the plotting modules that ended up loaded
+_CHILD_CODE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = [name for name in {plotting} if name in sys.modules]
+print(elapsed, ','.join(loaded))
+"""
+
+
+# Imports module in a new interpreter and returns (seconds taken by the import, plotting modules that got loaded)
+def time_import(module):
+    code = _CHILD_CODE.format(module=module, plotting=PLOTTING_MODULES)
+    # No display is needed, and matplotlib shouldn't be loaded anyway
+    env = dict(os.environ, MPLBACKEND='Agg')
+    output = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, env=env, capture_output=True, text=True,
+                            check=True).stdout.split('\n')[-2]
+    elapsed, loaded = output.split(' ', 1)
+    return float(elapsed), [name for name in loaded.split(',') if name]
+
+
+# Best import time of each module over num_repeats fresh interpreters
+def run(modules=CORE_MODULES, num_repeats=5):
+    results = {}
+    for module in modules:
+        times = []
+        loaded = []
+        for _ in range(num_repeats):
+            elapsed, loaded = time_import(module)
+            times.append(elapsed)
+        results[module] = (min(times), loaded)
+    return results
+
+
+if __name__ == "__main__":
+    start = time.time()
+    for module, (elapsed, loaded) in run().items():
+        warning = f" (loaded {', '.join(loaded)})" if loaded else ""
+        print(f"import {module}: {elapsed * 1000:.1f} ms{warning}")
+    print(f"took {time.time() - start:.1f} s")
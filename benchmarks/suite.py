@@ -0,0 +1,313 @@
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import platform
+import resource
+import itertools
+import contextlib
+import subprocess
+import numpy as np
+
+"""
+Benchmarks for the pieces of the simulation loop, and for a whole step of both versions of it. Every benchmark is run
+over a grid of (number of users, number of time cycles, average degree), each case in a fresh python process so that
+its peak memory use (max RSS) isn't mixed up with the other cases. The results are written out as JSON, and can be
+compared against the JSON of an earlier run to catch slowdowns.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --quick --baseline results.json
+    python benchmarks/suite.py --only population_step --users 1000 10000 --cycles 50
+
+Each benchmark reports how long it took, how much work it did (what counts as one unit is in the comment above it), and
+the throughput in units per second. For the step benchmarks a unit is one agent going through one time step.
+"""
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+DEFAULT_USERS = [100, 1000]
+DEFAULT_CYCLES = [20]
+DEFAULT_DEGREES = [3, 10]
+QUICK_USERS = [100]
+QUICK_CYCLES = [10]
+QUICK_DEGREES = [3]
+# How much slower than the baseline a case can be before it's reported as a regression
+REGRESSION_THRESHOLD = 0.2
+
+
+# People, a connected graph and a PostStore filled with a few steps worth of posts. Seeded, so every run of a case
+# works on the same data
+def _setup(num_users, avg_degree, num_warmup_steps=3):
+    from graph_funcs import gen_biased_rand_ppl, link_ppl_rand_graph
+    from post_store import PostStore
+    np.random.seed(0)
+    users = gen_biased_rand_ppl(num_users, 0.9)
+    graph = link_ppl_rand_graph(users, avg_degree)
+    all_content = PostStore(3)
+    for _ in range(num_warmup_steps):
+        for node in range(num_users):
+            post = users[node]['Person'].make_post()
+            if post is not None:
+                all_content.add_post(post, author=node)
+        all_content.end_step()
+    return users, graph, all_content
+
+
+# Recommending every stored post to one user (send_news). Unit: one post scored
+def bench_send_news(num_users, num_cycles, avg_degree):
+    from social_media import send_news
+    users, graph, all_content = _setup(num_users, avg_degree)
+    start = time.perf_counter()
+    for i in range(num_cycles):
+        person = users[i % num_users]['Person']
+        send_news(person, all_content)
+        person.feed.clear()
+    return time.perf_counter() - start, num_cycles * len(all_content)
+
+
+# Recommending posts close to their opinion to every user at once (send_similar_news_batch). Unit: one user
+def bench_send_similar_news(num_users, num_cycles, avg_degree):
+    from social_media import send_similar_news_batch
+    users, graph, all_content = _setup(num_users, avg_degree)
+    people = [users[i]['Person'] for i in range(num_users)]
+    start = time.perf_counter()
+    for _ in range(num_cycles):
+        send_similar_news_batch(people, all_content)
+        for person in people:
+            person.feed.clear()
+    return time.perf_counter() - start, num_cycles * num_users
+
+
+# Adding posts to the content window and sorting them in at the end of the step (what add_available_post used to do).
+# Unit: one post
+def bench_add_post(num_users, num_cycles, avg_degree):
+    from person import Post
+    from post_store import PostStore
+    rng = np.random.default_rng(0)
+    posts = [Post(leaning, interest) for leaning, interest in rng.random([num_users, 2])]
+    all_content = PostStore(3)
+    start = time.perf_counter()
+    for _ in range(num_cycles):
+        for author, post in enumerate(posts):
+            all_content.add_post(post, author=author)
+        all_content.end_step()
+    return time.perf_counter() - start, num_cycles * num_users
+
+
+# Person.how_engaging called one post at a time. Unit: one call
+def bench_how_engaging(num_users, num_cycles, avg_degree):
+    from person import Person, Post
+    rng = np.random.default_rng(0)
+    posts = [Post(leaning, interest) for leaning, interest in rng.random([num_users, 2])]
+    opinion = 0.5
+    start = time.perf_counter()
+    for _ in range(num_cycles):
+        for post in posts:
+            Person.how_engaging(post, opinion)
+    return time.perf_counter() - start, num_cycles * num_users
+
+
+# how_engaging_batch over every (user, post) pair of a users by users matrix. Unit: one pair
+def bench_how_engaging_batch(num_users, num_cycles, avg_degree):
+    from person import how_engaging_batch
+    rng = np.random.default_rng(0)
+    leanings, interests, opinions = rng.random([3, num_users])
+    start = time.perf_counter()
+    for _ in range(num_cycles):
+        how_engaging_batch(leanings, interests, opinions)
+    return time.perf_counter() - start, num_cycles * num_users * num_users
+
+
+# Same as how_engaging_batch, but with the bias factor looked up in a BiasTable (see bias_table.py). Unit: one pair
+def bench_how_engaging_batch_table(num_users, num_cycles, avg_degree):
+    from person import how_engaging_batch, use_bias_table
+    use_bias_table(1024)
+    rng = np.random.default_rng(0)
+    leanings, interests, opinions = rng.random([3, num_users])
+    start = time.perf_counter()
+    for _ in range(num_cycles):
+        how_engaging_batch(leanings, interests, opinions)
+    return time.perf_counter() - start, num_cycles * num_users * num_users
+
+
+# Person.cycle for everyone, with their feeds topped up by send_news first (not timed). Unit: one agent-step
+def bench_person_cycle(num_users, num_cycles, avg_degree):
+    from social_media import send_news
+    users, graph, all_content = _setup(num_users, avg_degree)
+    people = [users[i]['Person'] for i in range(num_users)]
+    elapsed = 0
+    for _ in range(num_cycles):
+        for person in people:
+            send_news(person, all_content)
+        start = time.perf_counter()
+        for person in people:
+            person.cycle(all_content)
+        elapsed += time.perf_counter() - start
+    return elapsed, num_cycles * num_users
+
+
+# Making a connected networkx graph (gen_connected_graph). Unit: one node
+def bench_gen_connected_graph(num_users, num_cycles, avg_degree):
+    from graph_funcs import gen_connected_graph
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    for _ in range(num_cycles):
+        gen_connected_graph(num_users, avg_degree, rng=rng)
+    return time.perf_counter() - start, num_cycles * num_users
+
+
+# Making a connected graph as a CSR matrix (gen_connected_csr). Unit: one node
+def bench_gen_connected_csr(num_users, num_cycles, avg_degree):
+    from graph_funcs import gen_connected_csr
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    for _ in range(num_cycles):
+        gen_connected_csr(num_users, avg_degree, rng=rng)
+    return time.perf_counter() - start, num_cycles * num_users
+
+
+# A whole time step of the per-object simulation (social_media.run_step). Unit: one agent-step
+def bench_object_step(num_users, num_cycles, avg_degree):
+    from social_media import run_step
+    users, graph, all_content = _setup(num_users, avg_degree)
+    start = time.perf_counter()
+    # The simulation complains when someone runs out of posts to read
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(num_cycles):
+            run_step(graph, all_content)
+    return time.perf_counter() - start, num_cycles * num_users
+
+
+# A whole time step of the vectorized simulation (Population.step). Unit: one agent-step
+def bench_population_step(num_users, num_cycles, avg_degree):
+    from graph_funcs import gen_biased_rand_stats, gen_connected_csr
+    from population import Population
+    rng = np.random.default_rng(0)
+    population = Population(*gen_biased_rand_stats(num_users, 0.9, rng), rng=rng)
+    population.link(gen_connected_csr(num_users, avg_degree, rng))
+    start = time.perf_counter()
+    for _ in range(num_cycles):
+        population.step()
+    return time.perf_counter() - start, num_cycles * num_users
+
+
+# Same as population_step, but recommending with 32 opinion buckets (see bucket_recommender.py). Unit: one agent-step
+def bench_population_step_bucketed(num_users, num_cycles, avg_degree):
+    from bucket_recommender import BucketRecommender
+    from graph_funcs import gen_biased_rand_stats, gen_connected_csr
+    from population import Population
+    rng = np.random.default_rng(0)
+    population = Population(*gen_biased_rand_stats(num_users, 0.9, rng), rng=rng,
+                            recommender=BucketRecommender(32, error_every=None))
+    population.link(gen_connected_csr(num_users, avg_degree, rng))
+    start = time.perf_counter()
+    for _ in range(num_cycles):
+        population.step()
+    return time.perf_counter() - start, num_cycles * num_users
+
+
+# Same as population_step, but with the numba kernels (see kernels.py). Runs the NumPy ones if numba isn't installed.
+# The kernels are compiled (or loaded from numba's cache) before the clock starts. Unit: one agent-step
+def bench_population_step_numba(num_users, num_cycles, avg_degree):
+    from graph_funcs import gen_biased_rand_stats, gen_connected_csr
+    from population import Population
+    rng = np.random.default_rng(0)
+    population = Population(*gen_biased_rand_stats(num_users, 0.9, rng), rng=rng, backend='numba')
+    population.link(gen_connected_csr(num_users, avg_degree, rng))
+    population.step()
+    start = time.perf_counter()
+    for _ in range(num_cycles):
+        population.step()
+    return time.perf_counter() - start, num_cycles * num_users
+
+
+BENCHMARKS = {function.__name__[len('bench_'):]: function for function in [
+    bench_send_news, bench_send_similar_news, bench_add_post, bench_how_engaging, bench_how_engaging_batch,
+    bench_how_engaging_batch_table, bench_person_cycle, bench_gen_connected_graph, bench_gen_connected_csr,
+    bench_object_step, bench_population_step, bench_population_step_bucketed, bench_population_step_numba]}
+
+
+# Runs one case in this process and returns its result
+def run_case(name, num_users, num_cycles, avg_degree):
+    elapsed, work = BENCHMARKS[name](num_users, num_cycles, avg_degree)
+    # ru_maxrss is in kilobytes on linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        max_rss //= 1024
+    return {'benchmark': name, 'num_users': num_users, 'num_cycles': num_cycles, 'avg_degree': avg_degree,
+            'seconds': elapsed, 'work': work, 'throughput': work / elapsed if elapsed > 0 else float('inf'),
+            'max_rss_kb': max_rss}
+
+
+# Runs one case in a fresh python process, so the peak memory is only that case's
+def run_case_isolated(name, num_users, num_cycles, avg_degree):
+    env = dict(os.environ, MPLBACKEND='Agg')
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case', name, str(num_users),
+                             str(num_cycles), str(avg_degree)], env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().split('\n')[-1])
+
+
+def run_suite(names, users, cycles, degrees):
+    results = []
+    for name, num_users, num_cycles, avg_degree in itertools.product(names, users, cycles, degrees):
+        result = run_case_isolated(name, num_users, num_cycles, avg_degree)
+        print(f"{name:24s} users={num_users:<7d} cycles={num_cycles:<5d} degree={avg_degree:<3d} "
+              f"{result['seconds']:9.4f}s {result['throughput']:12.1f}/s {result['max_rss_kb'] / 1024:8.1f} MB")
+        results.append(result)
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+
+
+# Cases that got slower than the baseline by more than threshold (as a fraction of the baseline's throughput)
+def find_regressions(results, baseline, threshold=REGRESSION_THRESHOLD):
+    def key(result):
+        return result['benchmark'], result['num_users'], result['num_cycles'], result['avg_degree']
+    old = {key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        if key(result) in old and result['throughput'] < (1 - threshold) * old[key(result)]['throughput']:
+            regressions.append((result, old[key(result)]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the social media simulation")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument('--users', nargs='+', type=int, help="numbers of users to try")
+    parser.add_argument('--cycles', nargs='+', type=int, help="numbers of time cycles to try")
+    parser.add_argument('--degrees', nargs='+', type=int, help="average degrees to try")
+    parser.add_argument('--quick', action='store_true', help="smallest grid, for a quick check")
+    parser.add_argument('--output', help="file to write the JSON results to")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="fraction of throughput that can be lost before a case counts as a regression")
+    parser.add_argument('--run-case', nargs=4, metavar=('NAME', 'USERS', 'CYCLES', 'DEGREE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case is not None:
+        name, num_users, num_cycles, avg_degree = args.run_case
+        print(json.dumps(run_case(name, int(num_users), int(num_cycles), int(avg_degree))))
+        return 0
+    users = args.users or (QUICK_USERS if args.quick else DEFAULT_USERS)
+    cycles = args.cycles or (QUICK_CYCLES if args.quick else DEFAULT_CYCLES)
+    degrees = args.degrees or (QUICK_DEGREES if args.quick else DEFAULT_DEGREES)
+    results = run_suite(args.only or list(BENCHMARKS), users, cycles, degrees)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            regressions = find_regressions(results, json.load(file), args.threshold)
+        for result, old in regressions:
+            print(f"REGRESSION {result['benchmark']} users={result['num_users']} cycles={result['num_cycles']} "
+                  f"degree={result['avg_degree']}: {result['throughput']:.1f}/s, was {old['throughput']:.1f}/s")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import numpy as np
+
+"""
+This file holds BiasTable, a precomputed version of the bias factor in Person.how_engaging (how much a user likes a
+post's leaning, before it's multiplied by the post's interest value). Working it out exactly takes a beta distribution
+with gamma functions and float powers for every (post, user) pair. With std_dev fixed at 0.09, the beta parameters only
+depend on the user's skewed mean, so the bias factor is a function of just (post leaning, skewed mean). Here it's
+worked out once on a (resolution + 1) x (resolution + 1) grid over [0, 1] x [0, 1], and bilinearly interpolated from
+then on. The grid is over the skewed mean instead of the opinion, since skew_mean is a cube root and isn't smooth at 0.5.
+
+Right next to 0 and 1 (in either the leaning or the mean) the beta distribution blows up, and no grid spacing keeps up
+with it. Anything within edge of 0 or 1 is worked out exactly instead, which is about 8% of uniformly spread pairs for
+the default edge of 0.01.
+
+Maximum error of the bias factor (and so of the predicted engagement, since interest values are at most 1) against the
+exact version, measured with max_error() on 2 million random (leaning, opinion) pairs:
+    resolution  256: max 0.0687, mean 3e-4
+    resolution 1024: max 0.0172, mean 2e-5
+    resolution 2048: max 0.0089, mean 6e-6
+The worst errors are right where the bias factor hits its cap of 1 and stops changing, which is a kink that bilinear
+interpolation rounds off. The error there goes down linearly with the resolution, and everywhere else quadratically.
+
+Whether the table is faster depends on how it's used (measured at resolution 1024 on random inputs):
+ - lookup_outer (how_engaging_batch) interpolates a whole row of the table for every user, so it only pays off once
+ there are more than about 2 * resolution posts in the batch. With 2000 posts it's about even with the exact version,
+ and with 8000 or more it takes about half the time. With fewer posts it's slower
+ - lookup_scalar (Person.how_engaging_stripped) is about 1.6x faster than the exact scalar version, as long as it's
+ given exact_scalar for the edges
+ - lookup (elementwise) is no faster than the exact version, so how_engaging_vec doesn't use the table
+"""
+
+
+class BiasTable:
+    def __init__(self, exact, means_of, resolution=1024, edge=0.01, exact_scalar=None):
+        """
+        @param exact: function of (leanings, means) giving the exact bias factor (bias_factor_exact in person.py). means
+        are already skewed and clipped
+        @param means_of: function turning opinions into those means (only used by max_error)
+        @param resolution: number of grid cells along each axis. More is closer to exact, and takes up
+        8 * (resolution + 1) ** 2 bytes
+        @param edge: how close to 0 or 1 a leaning or mean has to be to be worked out exactly. Never less than one grid
+        cell
+        @param exact_scalar: exact for a single pair of python floats (bias_factor_scalar in person.py), which
+        lookup_scalar falls back on near the edges. None calls exact on numpy scalars instead, which is a lot slower
+        """
+        self.exact = exact
+        self.exact_scalar = exact_scalar
+        self.means_of = means_of
+        self.resolution = resolution
+        self.edge = max(edge, 1 / resolution)
+        grid = np.linspace(0, 1, resolution + 1)
+        # Row i is the mean grid[i], column j the leaning grid[j]
+        self.table = exact(grid[None, :], grid[:, None])
+        # How much the bias factor changes across each cell along the leaning axis
+        self._slopes = np.diff(self.table, axis=1)
+        # Plain python copy for looking up one value at a time (indexing a list is a lot faster than a numpy array)
+        self._rows = self.table.tolist()
+
+    # Which cell each value falls in, and how far across that cell it is
+    def _cell(self, values):
+        scaled = values * self.resolution
+        cell = np.clip(scaled.astype(np.intp), 0, self.resolution - 1)
+        return cell, scaled - cell
+
+    def _on_edge(self, values):
+        return (values < self.edge) | (values > 1 - self.edge)
+
+    # Bias factor for leanings and means broadcast against each other, like how_engaging_vec. Scalars give back a scalar
+    def lookup(self, leanings, means):
+        leanings, means = np.broadcast_arrays(np.asarray(leanings, dtype=float), np.asarray(means, dtype=float))
+        if leanings.ndim == 0:
+            return np.float64(self.lookup_scalar(leanings, means))
+        col, col_frac = self._cell(leanings)
+        row, row_frac = self._cell(means)
+        top = self.table[row, col] + (self.table[row, col + 1] - self.table[row, col]) * col_frac
+        bottom = self.table[row + 1, col] + (self.table[row + 1, col + 1] - self.table[row + 1, col]) * col_frac
+        bias = top + (bottom - top) * row_frac
+        on_edge = self._on_edge(leanings) | self._on_edge(means)
+        if on_edge.any():
+            bias[on_edge] = self.exact(leanings[on_edge], means[on_edge])
+        return bias
+
+    # Bias factor of every post for every mean, with shape (len(means), len(leanings)), like how_engaging_batch. Each
+    # user's row of the table is interpolated first, so only two values per (post, user) pair have to be looked up.
+    # The (post, user) matrix is big enough that every pass over it counts, so it's all done in place
+    def lookup_outer(self, leanings, means):
+        leanings = np.asarray(leanings, dtype=float)
+        means = np.asarray(means, dtype=float)
+        row, row_frac = self._cell(means)
+        row_frac = row_frac[:, None]
+        rows = self.table[row] * (1 - row_frac) + self.table[row + 1] * row_frac
+        slopes = self._slopes[row] * (1 - row_frac) + self._slopes[row + 1] * row_frac
+        col, col_frac = self._cell(leanings)
+        bias = np.take(rows, col, axis=1)
+        change = np.take(slopes, col, axis=1)
+        change *= col_frac
+        bias += change
+        edge_users = self._on_edge(means)
+        if edge_users.any():
+            bias[edge_users] = self.exact(leanings[None, :], means[edge_users, None])
+        edge_posts = self._on_edge(leanings)
+        if edge_posts.any():
+            bias[:, edge_posts] = self.exact(leanings[None, edge_posts], means[:, None])
+        return bias
+
+    # Bias factor of a single (leaning, mean) pair, using plain python floats
+    def lookup_scalar(self, leaning, mean):
+        # Arithmetic on numpy scalars is a lot slower than on python floats
+        leaning = float(leaning)
+        mean = float(mean)
+        edge = self.edge
+        if not (edge <= leaning <= 1 - edge and edge <= mean <= 1 - edge):
+            if self.exact_scalar is not None:
+                return self.exact_scalar(leaning, mean)
+            return float(self.exact(np.float64(leaning), np.float64(mean)))
+        # Away from the edges, neither cell can be the last one
+        scaled_col = leaning * self.resolution
+        scaled_row = mean * self.resolution
+        col = int(scaled_col)
+        row = int(scaled_row)
+        col_frac = scaled_col - col
+        top_row = self._rows[row]
+        bottom_row = self._rows[row + 1]
+        top = top_row[col] + (top_row[col + 1] - top_row[col]) * col_frac
+        bottom = bottom_row[col] + (bottom_row[col + 1] - bottom_row[col]) * col_frac
+        return top + (bottom - top) * (scaled_row - row)
+
+    # Largest and mean difference from the exact bias factor over num_samples random (leaning, opinion) pairs
+    def max_error(self, num_samples=10 ** 6, seed=0):
+        """
+        @param num_samples: how many random pairs to compare on
+        @param seed: seed for the random pairs
+        @return: (max error, mean error)
+        """
+        rng = np.random.default_rng(seed)
+        leanings = rng.random(num_samples)
+        means = self.means_of(rng.random(num_samples))
+        error = np.abs(self.lookup(leanings, means) - self.exact(leanings, means))
+        return float(error.max()), float(error.mean())
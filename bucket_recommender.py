@@ -0,0 +1,124 @@
+import numpy as np
+from person import how_engaging_batch
+from kernels import rank_top_k
+from post_store import LEAN_COL, INTEREST_COL
+
+"""
+This file holds BucketRecommender, an approximate version of send_news. Exact recommending scores every post for every
+user, which is O(users * posts) per step, even though the only thing about a user that goes into how_engaging is their
+opinion. Here opinions are rounded into num_buckets equal-width buckets over [0, 1], every post is scored once for the
+middle of each bucket, and each user is served the ranking of their bucket. That's O(num_buckets * posts) to score,
+plus whatever it takes to hand each user their part of the ranking.
+
+More buckets are slower but closer to the exact ranking. To see how close, every error_every-th step a sample of users
+is also ranked exactly, and the two rankings are compared on the top error_k posts:
+ - recall: fraction of the exact top error_k that the approximate top error_k also has
+ - engagement_loss: how much lower the (exact) predicted engagement of the approximate top error_k is on average than
+ that of the exact top error_k
+ - max_opinion_error: furthest any user's opinion was from the middle of their bucket
+With similar news, the most engaging posts tend to sit right at the edge of a user's window, where moving the opinion a
+little swaps them in or out, so recall is a lot lower there than when everything is recommended.
+"""
+
+
+# For every opinion, which rows have a leaning in [opinion - tolerance, opinion + tolerance) (send_similar_news's window)
+def _in_window(rows, opinions, tolerance):
+    return ((rows[None, :, LEAN_COL] >= opinions[:, None] - tolerance) &
+            (rows[None, :, LEAN_COL] < opinions[:, None] + tolerance))
+
+
+class BucketRecommender:
+    def __init__(self, num_buckets=32, error_every=10, error_sample=64, error_k=10, seed=0):
+        """
+        @param num_buckets: how many buckets opinions are rounded into. This is the speed/accuracy knob
+        @param error_every: compare against the exact ranking every error_every-th step. None never compares
+        @param error_sample: how many users are ranked exactly when comparing
+        @param error_k: how many of the top posts the comparison looks at
+        @param seed: seed for picking the sampled users (kept apart from the simulation's random numbers)
+        """
+        self.num_buckets = num_buckets
+        self.error_every = error_every
+        self.error_sample = error_sample
+        self.error_k = error_k
+        self.rng = np.random.default_rng(seed)
+        # One row per comparison made (see measure)
+        self.reports = []
+
+    # Opinion in the middle of every bucket
+    def centres(self):
+        return (np.arange(self.num_buckets) + 0.5) / self.num_buckets
+
+    # Which bucket each opinion falls in
+    def bucket_of(self, opinions):
+        buckets = np.floor(np.asarray(opinions, dtype=float) * self.num_buckets).astype(np.int64)
+        return np.clip(buckets, 0, self.num_buckets - 1)
+
+    # Every opinion rounded to the middle of its bucket
+    def quantize(self, opinions):
+        return self.centres()[self.bucket_of(opinions)]
+
+    # Scores rows of [leaning, interest, id] for the middle of every bucket and ranks them
+    def rank(self, rows, k=None, tolerance=None):
+        """
+        @param rows: content to rank, in the layout PostStore keeps it in
+        @param k: only rank the k best posts of each bucket. None ranks everything
+        @param tolerance: if given, posts whose leaning is further than this from the middle of a bucket are left out of
+        its ranking (see send_similar_news)
+        @return: (ranking, engagement, num_ranked). ranking has one row of indices into rows per bucket, best first,
+        engagement is the predicted engagement of every row for every bucket, and num_ranked is how many entries of each
+        bucket's ranking are real posts
+        """
+        centres = self.centres()
+        # Person._read_feed swaps the first two columns, so column 1 is the leaning the user will see
+        engagement = how_engaging_batch(rows[:, INTEREST_COL], rows[:, LEAN_COL], centres)
+        num_ranked = np.full(self.num_buckets, len(rows))
+        if tolerance is not None:
+            in_window = _in_window(rows, centres, tolerance)
+            engagement[~in_window] = -np.inf
+            num_ranked = np.count_nonzero(in_window, axis=1)
+        if k is None:
+            ranking = np.argsort(-engagement, axis=1, kind='stable')
+        else:
+            ranking = rank_top_k(engagement, k)
+            num_ranked = np.minimum(num_ranked, ranking.shape[1])
+        return ranking, engagement, num_ranked
+
+    # Compares the bucketed ranking against the exact one for a sample of users, if this is one of the steps that gets
+    # compared. Returns the report (or None)
+    def measure(self, step, rows, opinions, tolerance=None):
+        """
+        @param step: current time step
+        @param rows: content that was ranked
+        @param opinions: everyone's actual opinions
+        @param tolerance: same as in rank
+        """
+        if self.error_every is None or step % self.error_every != 0 or len(rows) == 0 or len(opinions) == 0:
+            return None
+        opinions = np.asarray(opinions, dtype=float)
+        sample = np.sort(self.rng.choice(len(opinions), min(self.error_sample, len(opinions)), replace=False))
+        quantized = self.quantize(opinions[sample])
+        exact = how_engaging_batch(rows[:, INTEREST_COL], rows[:, LEAN_COL], opinions[sample])
+        approx = how_engaging_batch(rows[:, INTEREST_COL], rows[:, LEAN_COL], quantized)
+        if tolerance is not None:
+            exact[~_in_window(rows, opinions[sample], tolerance)] = -np.inf
+            approx[~_in_window(rows, quantized, tolerance)] = -np.inf
+        k = min(self.error_k, len(rows))
+        exact_top = rank_top_k(exact, k)
+        approx_top = rank_top_k(approx, k)
+        recall = np.mean([len(np.intersect1d(e, a)) / k for e, a in zip(exact_top, approx_top)])
+        # Posts the user would never have been sent count as no engagement at all
+        true_engagement = np.where(np.isfinite(exact), exact, 0)
+        loss = (np.take_along_axis(true_engagement, exact_top, axis=1).mean(axis=1) -
+                np.take_along_axis(true_engagement, approx_top, axis=1).mean(axis=1))
+        report = {'step': int(step), 'num_buckets': self.num_buckets, 'num_posts': len(rows), 'k': k,
+                  'recall': float(recall), 'engagement_loss': float(loss.mean()),
+                  'max_opinion_error': float(np.abs(opinions - self.quantize(opinions)).max())}
+        self.reports.append(report)
+        return report
+
+    # Averages of every comparison made so far
+    def summary(self):
+        if len(self.reports) == 0:
+            return {}
+        return {key: float(np.mean([report[key] for report in self.reports]))
+                for key in ['recall', 'engagement_loss', 'max_opinion_error']}
@@ -0,0 +1,229 @@
+import os
+import json
+import itertools
+import collections
+import tempfile
+import numpy as np
+import networkx as nx
+from concurrent.futures import ThreadPoolExecutor
+from person import Post
+from post_store import PostStore
+
+"""
+This file saves the whole state of a simulation to disk every so often, so that a long run that dies partway through
+can carry on from its last snapshot instead of starting over. Restarting from a snapshot gives exactly the same results
+as if the run had never stopped.
+
+Every class that changes as the simulation runs (Population, Person, Feed, OpinionMemory, PostStore) has a get_state()
+that returns a nested dictionary of numpy arrays, and a set_state() that takes it back. Here those dictionaries are
+flattened into one .npz file (keys like 'all_content/records'). Anything in them that isn't a numpy array (like the state
+of a random number generator, which has 128 bit integers in it) is stored as a json string. Nothing is pickled.
+
+For the per-object simulation in social_media.py, everyone's state is packed into a few flat arrays instead of an entry
+per person, and the graph is stored as a neighbour list that keeps the order of each node's neighbours (it decides the
+order notifications arrive in).
+"""
+
+_JSON_PREFIX = 'json:'
+
+
+# Turns a nested dictionary into a flat one with '/' separated keys
+def _flatten(state, prefix=''):
+    flat = {}
+    for key, value in state.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + '/'))
+        elif isinstance(value, (np.ndarray, np.generic)):
+            flat[name] = value
+        else:
+            flat[_JSON_PREFIX + name] = np.array(json.dumps(value))
+    return flat
+
+
+def _unflatten(flat):
+    state = {}
+    for name, value in flat.items():
+        if name.startswith(_JSON_PREFIX):
+            name = name[len(_JSON_PREFIX):]
+            value = json.loads(str(value))
+        elif value.ndim == 0:
+            value = value[()]
+        *parents, key = name.split('/')
+        node = state
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[key] = value
+    # json turns arrays inside the random states into lists, which set_state takes just fine
+    return state
+
+
+# Writes a state dictionary to path. The file is written under a temporary name and then renamed, so there's always a
+# complete checkpoint at path, even if the program dies while writing
+def save_checkpoint(path, state):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            np.savez(file, **_flatten(state))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_checkpoint(path):
+    with np.load(path) as data:
+        return _unflatten({name: data[name] for name in data.files})
+
+
+class Checkpointer:
+    """
+    Saves a snapshot every interval steps. The state is copied in the main loop (get_state() hands back copies), but
+    writing it to disk happens on a background thread, so the simulation carries on while the file is written. Only one
+    write is ever in flight: if the next snapshot comes around before the last one is done, it waits for it
+    """
+    def __init__(self, path, interval):
+        """
+        @param path: file the checkpoints are written to (each one replaces the last)
+        @param interval: how many steps go by between checkpoints
+        """
+        self.path = path
+        self.interval = interval
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    # Saves a checkpoint if step is one of the steps that get one. get_state is only called if it is
+    def maybe_save(self, step, get_state):
+        if step % self.interval == 0:
+            self.save(get_state())
+
+    def save(self, state):
+        self.wait()
+        self._pending = self._executor.submit(save_checkpoint, self.path, state)
+
+    # Blocks until the last checkpoint is on disk (and raises whatever went wrong while writing it)
+    def wait(self):
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Packs a list of state dictionaries with the same keys into one dictionary of arrays. Values that are arrays get
+# concatenated, along with how long each one was
+def _pack(states):
+    packed = {}
+    for key, value in states[0].items():
+        values = [state[key] for state in states]
+        if isinstance(value, dict):
+            packed[key] = _pack(values)
+        elif np.ndim(value) == 0:
+            packed[key] = np.array(values)
+        else:
+            packed[key] = {'values': np.concatenate(values),
+                           'lengths': np.array([len(array) for array in values], dtype=np.int64)}
+    return packed
+
+
+def _unpack(packed, num_states):
+    states = [{} for _ in range(num_states)]
+    for key, value in packed.items():
+        if isinstance(value, dict) and set(value) == {'values', 'lengths'}:
+            starts = np.cumsum(value['lengths']) - value['lengths']
+            parts = [value['values'][start:start + length] for start, length in zip(starts, value['lengths'])]
+        elif isinstance(value, dict):
+            parts = _unpack(value, num_states)
+        else:
+            parts = value
+        for state, part in zip(states, parts):
+            state[key] = part
+    return states
+
+
+# The whole state of the per-object simulation in social_media.py, in between two time steps
+def object_sim_state(graph, all_content, extra=None):
+    """
+    @param graph: graph whose nodes hold the people
+    @param all_content: PostStore of the simulation
+    @param extra: dictionary of anything else the loop wants back on a restart (which step it was on, ...)
+    """
+    num_nodes = graph.number_of_nodes()
+    neighbours = [list(graph.adj[node]) for node in range(num_nodes)]
+    # Reading the next id off of the counter means making a new one that starts at the same place
+    next_post_id = next(Post.new_id)
+    Post.new_id = itertools.count(next_post_id)
+    return {'people': _pack([graph.nodes[node]['Person'].get_state() for node in range(num_nodes)]),
+            'adjacency': {'values': np.array([n for node in neighbours for n in node], dtype=np.int64),
+                          'lengths': np.array([len(node) for node in neighbours], dtype=np.int64)},
+            'all_content': all_content.get_state(), 'next_post_id': np.int64(next_post_id),
+            'np_random': np.random.get_state(legacy=False), 'extra': {} if extra is None else extra}
+
+
+# Works out an order to add the edges of a saved adjacency in, so that every node's neighbours come out in the order they
+# were saved in. networkx lists a node's neighbours in the order their edges were added, so an order like that always
+# exists for a saved graph: the order the edges were added in the first place. Each node's list says which of its edges
+# came first, and the edges are sorted topologically on that
+def _edges_in_order(values, lengths):
+    """
+    @param values, lengths: neighbours of every node, one after the other, and how many each node has
+    @return: list of (node, neighbour) edges
+    """
+    starts = np.cumsum(lengths) - lengths
+    edge_ids = {}
+    edges = []
+    # Edges that have to come right after each edge in some node's list, and how many have to come before each one
+    after = []
+    num_before = []
+    for node in range(len(lengths)):
+        previous = None
+        for neighbour in values[starts[node]:starts[node] + lengths[node]].tolist():
+            key = (min(node, neighbour), max(node, neighbour))
+            if key not in edge_ids:
+                edge_ids[key] = len(edges)
+                edges.append((node, neighbour))
+                after.append([])
+                num_before.append(0)
+            edge = edge_ids[key]
+            if previous is not None:
+                after[previous].append(edge)
+                num_before[edge] += 1
+            previous = edge
+    ready = collections.deque(edge for edge in range(len(edges)) if num_before[edge] == 0)
+    order = []
+    while len(ready) > 0:
+        edge = ready.popleft()
+        order.append(edges[edge])
+        for later in after[edge]:
+            num_before[later] -= 1
+            if num_before[later] == 0:
+                ready.append(later)
+    assert len(order) == len(edges), "the saved neighbour lists don't come from any order of adding the edges"
+    return order
+
+
+# Puts the people of ppl_dict back the way they were in state. Returns the graph, the PostStore and the extra dictionary.
+# If all_content is given, the content goes back into it (keeping its retention settings) instead of a new PostStore
+def restore_object_sim(state, ppl_dict, all_content=None):
+    num_nodes = len(ppl_dict)
+    for node, person_state in enumerate(_unpack(state['people'], num_nodes)):
+        ppl_dict[node]['Person'].set_state(person_state)
+    graph = nx.Graph()
+    graph.add_nodes_from(range(num_nodes))
+    graph.add_edges_from(_edges_in_order(state['adjacency']['values'], state['adjacency']['lengths']))
+    nx.set_node_attributes(graph, ppl_dict)
+    if all_content is None:
+        all_content = PostStore()
+    all_content.set_state(state['all_content'])
+    Post.new_id = itertools.count(int(state['next_post_id']))
+    np.random.set_state(state['np_random'])
+    return graph, all_content, state['extra']
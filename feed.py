@@ -0,0 +1,126 @@
+import numpy as np
+
+"""
+This file holds Feed, the queue of post ids that the social media site has recommended to a user. Person._read_feed used
+to call list.pop(0) for every post it read, which is O(len(feed)) each time, and feeds could grow by hundreds of posts
+every cycle. Here the ids live in a numpy buffer with a head index, so reading a post just moves the head forward. The
+buffer only gets compacted (or grown) when the end of it is reached, so appending is O(1) on average as well.
+
+A feed can also be given a capacity. When more posts come in than fit, either the oldest posts or the ones with the
+lowest predicted engagement are thrown out, depending on the eviction policy.
+"""
+
+EVICTION_POLICIES = ['oldest', 'lowest']
+
+
+class Feed:
+    def __init__(self, capacity=None, eviction='oldest'):
+        """
+        @param capacity: most posts the feed can hold. None means there's no limit
+        @param eviction: which posts to throw out when the feed is over capacity. 'oldest' drops the posts that have been
+        waiting the longest, 'lowest' drops the ones with the lowest predicted engagement
+        """
+        assert eviction in EVICTION_POLICIES, f"eviction must be one of {EVICTION_POLICIES}"
+        assert capacity is None or capacity > 0
+        self.capacity = capacity
+        self.eviction = eviction
+        size = 16 if capacity is None else capacity
+        self._ids = np.zeros(size, dtype=np.int64)
+        # Predicted engagement of each post, nan if it wasn't given
+        self._engagement = np.zeros(size)
+        # The posts in the feed are the ones in [_head, _tail) of the buffer
+        self._head = 0
+        self._tail = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def __iter__(self):
+        return iter(self.get_ids().tolist())
+
+    # The ids of every post in the feed, oldest first
+    def get_ids(self):
+        return self._ids[self._head:self._tail].copy()
+
+    # Everything in the feed, as arrays (see checkpoint.py)
+    def get_state(self):
+        return {'ids': self.get_ids(), 'engagement': self._engagement[self._head:self._tail].copy()}
+
+    def set_state(self, state):
+        self.clear()
+        self._make_room(len(state['ids']))
+        self._ids[:len(state['ids'])] = state['ids']
+        self._engagement[:len(state['ids'])] = state['engagement']
+        self._tail = len(state['ids'])
+
+    def clear(self):
+        self._head = 0
+        self._tail = 0
+
+    # Takes the oldest post out of the feed and returns its id
+    def pop(self):
+        if self._head == self._tail:
+            raise IndexError("pop from an empty feed")
+        post_id = int(self._ids[self._head])
+        self._head += 1
+        if self._head == self._tail:
+            self.clear()
+        return post_id
+
+    # Adds one post to the end of the feed
+    def append(self, post_id, engagement=np.nan):
+        self.extend([post_id], [engagement])
+
+    # Adds a bunch of posts to the end of the feed, in order, throwing some out if the feed goes over capacity
+    def extend(self, post_ids, engagement=None):
+        """
+        @param post_ids: ids of the posts to add
+        @param engagement: predicted engagement of each post (only used by the 'lowest' eviction policy)
+        """
+        post_ids = np.asarray(post_ids, dtype=np.int64)
+        if engagement is None:
+            engagement = np.full(len(post_ids), np.nan)
+        engagement = np.asarray(engagement, dtype=float)
+        if self.capacity is not None and len(self) + len(post_ids) > self.capacity:
+            self._evict(post_ids, engagement)
+            return
+        self._make_room(len(post_ids))
+        self._ids[self._tail:self._tail + len(post_ids)] = post_ids
+        self._engagement[self._tail:self._tail + len(post_ids)] = engagement
+        self._tail += len(post_ids)
+
+    # Makes sure there's space for num_new more posts after _tail, by moving the feed to the front of the buffer or
+    # making the buffer bigger
+    def _make_room(self, num_new):
+        if self._tail + num_new <= len(self._ids):
+            return
+        num_posts = len(self)
+        if num_posts + num_new <= len(self._ids) // 2 or (self.capacity is not None and
+                                                        num_posts + num_new <= len(self._ids)):
+            ids = self._ids
+            engagement = self._engagement
+        else:
+            size = max(2 * len(self._ids), num_posts + num_new)
+            ids = np.zeros(size, dtype=np.int64)
+            engagement = np.zeros(size)
+        ids[:num_posts] = self._ids[self._head:self._tail]
+        engagement[:num_posts] = self._engagement[self._head:self._tail]
+        self._ids = ids
+        self._engagement = engagement
+        self._head = 0
+        self._tail = num_posts
+
+    # Adds the new posts and keeps only capacity posts, picked with the eviction policy
+    def _evict(self, post_ids, engagement):
+        all_ids = np.concatenate([self._ids[self._head:self._tail], post_ids])
+        all_engagement = np.concatenate([self._engagement[self._head:self._tail], engagement])
+        if self.eviction == 'oldest':
+            keep = slice(len(all_ids) - self.capacity, len(all_ids))
+        else:
+            # Posts without a predicted engagement are the first to go. The posts that are kept stay in order
+            scores = np.where(np.isnan(all_engagement), -np.inf, all_engagement)
+            keep = np.sort(np.argpartition(-scores, self.capacity - 1)[:self.capacity])
+        self._ids[:self.capacity] = all_ids[keep]
+        self._engagement[:self.capacity] = all_engagement[keep]
+        self._head = 0
+        self._tail = self.capacity
@@ -1,7 +1,7 @@
 import numpy as np
 import networkx as nx
-import secrets
-import matplotlib.pyplot as plt
+import scipy.sparse
+import scipy.sparse.csgraph
 from person import Person, Post
 
 """
@@ -10,9 +10,47 @@ social_media.py was getting a bit crowded so I refactored it into this file
 """
 
 
-# Uses fast_gnp_random_graph cuz I'm not expecting very connected graphs
-def gen_connected_graph(num_nodes, avg_degree):
-    assert num_nodes > 0
+# Works out which edges join the components of a graph into one. Component i (components are ordered by their smallest
+# node) gets an edge between a random node of its own and a random node of any component before it. That's the same
+# graph you'd get by adding an edge between the first two components over and over until the graph is connected, but
+# the components only have to be found once
+def _stitching_edges(labels, rng=None):
+    """
+    @param labels: array with the component that each node is in
+    @param rng: numpy Generator to pick the nodes with
+    @return: two arrays of nodes, with an edge to be added between each pair
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    _, first_nodes, node_component = np.unique(labels, return_index=True, return_inverse=True)
+    num_components = len(first_nodes)
+    if num_components < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # Ranking the components by their smallest node, and grouping the nodes by component in that order
+    rank = np.empty(num_components, dtype=np.int64)
+    rank[np.argsort(first_nodes)] = np.arange(num_components)
+    node_rank = rank[node_component.ravel()]
+    nodes_by_rank = np.argsort(node_rank, kind='stable')
+    sizes = np.bincount(node_rank, minlength=num_components)
+    starts = np.cumsum(sizes) - sizes
+    later = np.arange(1, num_components)
+    new_nodes = nodes_by_rank[starts[later] + (rng.random(len(later)) * sizes[later]).astype(np.int64)]
+    old_nodes = nodes_by_rank[(rng.random(len(later)) * starts[later]).astype(np.int64)]
+    return old_nodes, new_nodes
+
+
+# Makes a networkx graph connected by adding one edge per extra component. Returns how many edges were added
+def connect_components(G, rng=None):
+    labels = np.zeros(G.number_of_nodes(), dtype=np.int64)
+    for label, component in enumerate(nx.connected_components(G)):
+        labels[list(component)] = label
+    old_nodes, new_nodes = _stitching_edges(labels, rng)
+    G.add_edges_from(zip(old_nodes.tolist(), new_nodes.tolist()))
+    return len(old_nodes)
+
+
+# Probability of drawing each edge for a graph with the given number of nodes and average degree
+def _edge_prob(num_nodes, avg_degree):
     prob = 0
     # Avoiding divide by 0 errors (if num_nodes==1, we want prob==0)
     if num_nodes > 1:
@@ -21,111 +59,158 @@ def gen_connected_graph(num_nodes, avg_degree):
         prob = 2 * avg_degree * num_nodes / (num_nodes * (num_nodes - 1))
     if prob > 1:
         prob = 1
+    return prob
+
+
+# Uses fast_gnp_random_graph cuz I'm not expecting very connected graphs. If a numpy Generator is given as rng, the
+# graph only depends on its state
+def gen_connected_graph(num_nodes, avg_degree, rng=None):
+    assert num_nodes > 0
+    prob = _edge_prob(num_nodes, avg_degree)
     # Generating a random graph with the specified attributes
-    G = nx.fast_gnp_random_graph(num_nodes, prob)
+    seed = None if rng is None else int(rng.integers(2 ** 32))
+    G = nx.fast_gnp_random_graph(num_nodes, prob, seed=seed)
     # nx.draw_kamada_kawai(G)
     # plt.show()
-    num_added_edges = 0
     # Making the graph connected
-    while not nx.is_connected(G):
-        # Gives a generator of sets of all nodes
-        sets_of_cxns = nx.connected_components(G)
-        first_list = list(next(sets_of_cxns))
-        second_list = list(next(sets_of_cxns))
-        first_node = secrets.choice(first_list)
-        second_node = secrets.choice(second_list)
-        G.add_edge(first_node, second_node)
-        num_added_edges += 1
+    num_added_edges = connect_components(G, rng)
     # print(f"Number of added edges is {num_added_edges}")
     # nx.draw_kamada_kawai(G)
     # plt.show()
     return G
 
 
-# like gen_rand_ppl but generates one "hump" at a specified location
-def gen_biased_rand_ppl(num_people, bias):
+# Same kind of graph as gen_connected_graph, but built straight into a scipy CSR adjacency matrix without networkx. A
+# networkx graph keeps a dictionary per node and per edge, which doesn't fit in memory for millions of nodes
+def gen_connected_csr(num_nodes, avg_degree, rng=None):
+    """
+    @param num_nodes: number of nodes in the graph
+    @param avg_degree: average number of connections of each node (before the components get joined up)
+    @param rng: numpy Generator used for every random draw. A fresh one is made if None is given
+    @return: symmetric scipy.sparse.csr_matrix with a 1 for every edge
+    """
+    assert num_nodes > 0
+    if rng is None:
+        rng = np.random.default_rng()
+    prob = _edge_prob(num_nodes, avg_degree)
+    num_pairs = num_nodes * (num_nodes - 1) // 2
+    if prob >= 0.1:
+        # Dense enough that every pair might as well be looked at
+        first, second = np.triu_indices(num_nodes, 1)
+        drawn = rng.random(len(first)) < prob
+        first, second = first[drawn], second[drawn]
+    else:
+        # Drawing the number of edges, then that many distinct pairs (each pair is encoded as first * n + second)
+        num_edges = rng.binomial(num_pairs, prob)
+        codes = np.zeros(0, dtype=np.int64)
+        while len(codes) < num_edges:
+            num_draws = int((num_edges - len(codes)) * 1.1) + 10
+            first = rng.integers(num_nodes, size=num_draws)
+            second = rng.integers(num_nodes - 1, size=num_draws)
+            second += second >= first
+            codes = np.unique(np.concatenate([codes, np.minimum(first, second) * num_nodes +
+                                              np.maximum(first, second)]))
+        if len(codes) > num_edges:
+            codes = np.sort(rng.choice(codes, num_edges, replace=False))
+        first, second = codes // num_nodes, codes % num_nodes
+    adjacency = _symmetric_csr(first, second, num_nodes)
+    # Finding the components once, and joining them all up
+    _, labels = scipy.sparse.csgraph.connected_components(adjacency, directed=False)
+    old_nodes, new_nodes = _stitching_edges(labels, rng)
+    if len(old_nodes) > 0:
+        adjacency = _symmetric_csr(np.concatenate([first, old_nodes]), np.concatenate([second, new_nodes]), num_nodes)
+    return adjacency
+
+
+# CSR adjacency matrix with an edge between first[i] and second[i] for every i
+def _symmetric_csr(first, second, num_nodes):
+    rows = np.concatenate([first, second])
+    cols = np.concatenate([second, first])
+    data = np.ones(len(rows), dtype=np.int8)
+    return scipy.sparse.csr_matrix((data, (rows, cols)), shape=(num_nodes, num_nodes))
+
+
+"""
+The gen_*_stats functions draw everybody's stats at once and return them as arrays, in the order that Population and
+MCRunner take them: (consumption, expected_engagement, activity, initial_opinion). They're what the gen_*_ppl functions
+are built on, and can be used directly when there's no need for Person objects (a million people takes a fraction of a
+second this way). rng can be a numpy Generator; if it's None, the global np.random state is used like it always was
+"""
+
+
+# Everything but the initial opinions is drawn the same way for every distribution
+def _gen_stats(num_people, init_op, rng):
+    init_op = np.clip(init_op, 0, 1)
+    consumption = (rng.random(num_people) * 5).astype(np.int64)
+    expected_engagement = rng.random(num_people)
+    activity = rng.random(num_people)
+    return consumption, expected_engagement, activity, init_op
+
+
+def gen_rand_stats(num_people, rng=None):
+    rng = np.random if rng is None else rng
+    return _gen_stats(num_people, rng.normal(loc=0.5, scale=0.05, size=num_people), rng)
+
+
+def gen_biased_rand_stats(num_people, bias, rng=None):
+    rng = np.random if rng is None else rng
+    return _gen_stats(num_people, rng.normal(loc=bias, scale=0.03, size=num_people), rng)
+
+
+def gen_polar_rand_stats(num_people, lower_bias, upper_bias, rng=None):
+    rng = np.random if rng is None else rng
+    # half of the time, we want people leaning high and the other half we want people leaning low
+    is_upper = rng.random(num_people) > 0.5
+    init_op = rng.normal(loc=np.where(is_upper, upper_bias, lower_bias), scale=0.03)
+    return _gen_stats(num_people, init_op, rng)
+
+
+# Makes the dictionary of people that the per-object simulation uses out of arrays of stats. People only get a name
+# when they're first asked for it (see Person.name), so the "Name" entry is left out unless with_names is True. If a
+# numpy Generator is given as rng, every person gets a stream of their own spawned from it, so a seeded run is the same
+# every time. Otherwise they all draw from the global np.random state like they always did
+def stats_to_ppl_dict(consumption, expected_engagement, activity, initial_opinion, with_names=False, rng=None):
+    num_people = len(initial_opinion)
+    person_rngs = [None] * num_people if rng is None else rng.spawn(num_people)
     # Dictionary of dictionaries
     ppl_dict = {}
-    # Populating the dictionary
     for i in range(num_people):
-        # half of the time, we want people leaning high and the other half we want people leaning low
-        init_op = np.random.normal(loc=bias, scale=0.03)
-        # Making sure that no one's outside our defined range
-        if init_op < 0:
-            init_op = 0
-        elif init_op > 1:
-            init_op = 1
-        rand_person = Person(int(np.random.rand() * 5), np.random.rand(), np.random.rand(), initial_opinion=init_op)
-        # The dictionary holds the person's name, and the actualy instance of the person class to call methods on
-        rand_person_dict = {"Name": rand_person.my_name_is(), "Person": rand_person}
+        rand_person = Person(int(consumption[i]), float(expected_engagement[i]), float(activity[i]),
+                             initial_opinion=float(initial_opinion[i]), rng=person_rngs[i])
+        # The dictionary holds the actual instance of the person class to call methods on (and maybe their name)
+        rand_person_dict = {"Person": rand_person}
+        if with_names:
+            rand_person_dict["Name"] = rand_person.my_name_is()
         ppl_dict[i] = rand_person_dict
     return ppl_dict
 
 
+# like gen_rand_ppl but generates one "hump" at a specified location
+def gen_biased_rand_ppl(num_people, bias, rng=None, with_names=False):
+    return stats_to_ppl_dict(*gen_biased_rand_stats(num_people, bias, rng), with_names=with_names, rng=rng)
+
+
 # Pretty much exactly like gen_rand_ppl but generates two "humps" on the opinion spectrum
-def gen_polar_rand_ppl(num_people, lower_bias, upper_bias):
-    # Dictionary of dictionaries
-    ppl_dict = {}
-    # Populating the dictionary
-    for i in range(num_people):
-        # half of the time, we want people leaning high and the other half we want people leaning low
-        if np.random.rand() > 0.5:
-            init_op = np.random.normal(loc=upper_bias, scale=0.03)
-        else:
-            init_op = np.random.normal(loc=lower_bias, scale=0.03)
-        # Making sure that no one's outside our defined range
-        if init_op < 0:
-            init_op = 0
-        elif init_op > 1:
-            init_op = 1
-        rand_person = Person(int(np.random.rand() * 5), np.random.rand(), np.random.rand(), initial_opinion=init_op)
-        # The dictionary holds the person's name, and the actualy instance of the person class to call methods on
-        rand_person_dict = {"Name": rand_person.my_name_is(), "Person": rand_person}
-        ppl_dict[i] = rand_person_dict
-    return ppl_dict
+def gen_polar_rand_ppl(num_people, lower_bias, upper_bias, rng=None, with_names=False):
+    return stats_to_ppl_dict(*gen_polar_rand_stats(num_people, lower_bias, upper_bias, rng), with_names=with_names,
+                             rng=rng)
 
 
 # This function generates a dictionary of random people with specified size
-def gen_rand_ppl(num_people):
-    # Dictionary of dictionaries
-    ppl_dict = {}
-    # Populating the dictionary
-    for i in range(num_people):
-        init_op = np.random.normal(loc=0.5, scale=0.05)
-        if init_op < 0:
-            init_op = 0
-        elif init_op > 1:
-            init_op = 1
-        rand_person = Person(int(np.random.rand() * 5), np.random.rand(), np.random.rand(), initial_opinion=init_op)
-        # The dictionary holds the person's name, and the actualy instance of the person class to call methods on
-        rand_person_dict = {"Name": rand_person.my_name_is(), "Person": rand_person}
-        ppl_dict[i] = rand_person_dict
-    return ppl_dict
+def gen_rand_ppl(num_people, rng=None, with_names=False):
+    return stats_to_ppl_dict(*gen_rand_stats(num_people, rng), with_names=with_names, rng=rng)
 
 
 # This function takes in a dictionary of random people and associates them with a randomly generated graph with a
-# minimum average degree of avg_connections (see _gen_connected_graph())
-def link_ppl_rand_graph(people_dict, avg_connections):
+# minimum average degree of avg_connections (see gen_connected_graph()). rng is passed on to gen_connected_graph
+def link_ppl_rand_graph(people_dict, avg_connections, rng=None):
     num_nodes = len(people_dict)
-    graph = gen_connected_graph(num_nodes, avg_connections)
+    graph = gen_connected_graph(num_nodes, avg_connections, rng)
     nx.set_node_attributes(graph, people_dict)
     return graph
 
 
+# Drawing lives in plotting.py, which is only imported here so that matplotlib isn't loaded unless something is drawn
 def draw_bias_graph(graph):
-    """
-    @type graph: the graph to draw, with associated dictionary of People with an opinion field
-    @return:
-    """
-    color_map = []
-    for node_tuple in graph.nodes(data=True):
-        # Retrieving the associated leaning with each node
-        leaning = node_tuple[1]['Person'].get_opinion()
-        if leaning < 0.5:
-            color_map.append('red')
-        elif leaning > 0.5:
-            color_map.append('blue')
-        else:
-            color_map.append('green')
-    nx.draw(graph, node_color=color_map, with_labels=True)
-    plt.show()
+    from plotting import draw_bias_graph as _draw_bias_graph
+    _draw_bias_graph(graph)
@@ -1,4 +1,3 @@
-import secrets
 import numpy as np
 import networkx as nx
 import matplotlib
@@ -6,6 +5,7 @@ import matplotlib.pyplot as plt
 import netgraph
 from networkx_viewer import Viewer
 from person import Person, Post
+from graph_funcs import connect_components
 
 
 # Useful to know exactly how it's implemented
@@ -50,17 +50,8 @@ def _gen_connected_graph(num_nodes, avg_degree):
     G = nx.fast_gnp_random_graph(num_nodes, prob)
     # nx.draw_kamada_kawai(G)
     # plt.show()
-    num_added_edges = 0
     # Making the graph connected
-    while not nx.is_connected(G):
-        # Gives a generator of sets of all nodes
-        sets_of_cxns = nx.connected_components(G)
-        first_list = list(next(sets_of_cxns))
-        second_list = list(next(sets_of_cxns))
-        first_node = secrets.choice(first_list)
-        second_node = secrets.choice(second_list)
-        G.add_edge(first_node, second_node)
-        num_added_edges += 1
+    num_added_edges = connect_components(G)
     print(f"Number of added edges is {num_added_edges}")
     # nx.draw_kamada_kawai(G)
     # plt.show()
@@ -79,8 +70,8 @@ def _gen_rand_ppl(num_people):
         elif init_op > 1:
             init_op = 1
         rand_person = Person(int(np.random.rand() * 5), np.random.rand(), np.random.rand(), initial_opinion=init_op)
-        # Points to a person with certain attributes and names
-        rand_person_dict = {"Name": rand_person.my_name_is(), "Person": rand_person}
+        # Points to a person with certain attributes. Their name is only made up if someone asks for it (see Person.name)
+        rand_person_dict = {"Person": rand_person}
         ppl_dict[i] = rand_person_dict
     return ppl_dict
 
@@ -109,10 +100,9 @@ def _associated_ppl_with_rand_graph(people_dict, avg_connections):
 def poll_opinions(G, show_hist=False):
     opinion_poll = []
     for node in G.nodes(data=True):
-        name = node[1]['Name']
         person = node[1]['Person']
         opinion = person.get_opinion()
-        # print(f"Name is {name}, opinion is {opinion}")
+        # print(f"Name is {person.name}, opinion is {opinion}")
         opinion_poll.append(opinion)
     if show_hist:
         fig, axs = plt.subplots(1)
@@ -26,7 +26,7 @@ class History:
     # This stores all relevant data about the Person after every time period
     # Automatically increments the time index when it is called
     def store_data(self, cur_opinion, entire_feed=None, post_engagement=None, notifications=None):
-        self.cur_epoch.store_posts(entire_feed)
+        self.cur_epoch.store_all_posts(entire_feed)
         self.time_index += 1
 
     # This method will display all the information we have about the person's beliefs and, critically, the news articles
@@ -57,27 +57,27 @@ class Epoch:
         """
         self.read_posts = []
         """
-        This will be a numpy array of values that 
+        Sorted numpy array of the ids of every post the person read. New ids are collected in _new_read_ids and only
+        sorted in when read_posts_indices is looked at, instead of being inserted one at a time (which made a new copy
+        of the whole array for every post)
         """
-        self.read_posts_indices = np.ones(0)
+        self._read_posts_indices = np.ones(0)
+        self._new_read_ids = []
         self.all_posts = []
 
-    """
-    Taken from stackexchange question 48776902. Goes through a sorted list, finds the index that the value would have
-    been at (value should not already been in sorted_list) and adds value at that index. Used to speed up the bookeeping
-    of what posts the user has already seen.
-    """
+    @property
+    def read_posts_indices(self):
+        if len(self._new_read_ids) > 0:
+            self._read_posts_indices = np.sort(np.concatenate([self._read_posts_indices] + self._new_read_ids))
+            self._new_read_ids = []
+        return self._read_posts_indices
+
+    # Used to speed up the bookeeping of what posts the user has already seen
     def _add_read_posts(self, posts):
         """
-        @param posts: The list of indices (integers) to be added to self.read_posts_indices
-        @return: Nothing. Sorts and inserts all integers in values self.read_posts
+        @param posts: The list of posts whose ids are to be added to self.read_posts_indices
         """
-        for post in posts:
-            val = post.get_id()
-            # Find the index that val should be at
-            idx = np.searchsorted(self.read_posts_indices, val)
-            # "insert" value at that index
-            self.read_posts_indices = np.concatenate((self.read_posts_indices[:idx], [val], self.read_posts_indices[idx:]))
+        self._new_read_ids.append(np.array([post.get_id() for post in posts], dtype=float))
 
     # Stores a list of all the posts the user actually finished reading
     def store_read_posts(self, posts):
@@ -85,5 +85,119 @@ class Epoch:
         self._add_read_posts(posts)
 
     # Stores a list of all the posts which were in the user's feed, but which they may or may not have finished reading
-    def store_all_posts(self):
-        pass
+    def store_all_posts(self, posts):
+        self.all_posts.append(posts)
+
+
+class ReadLog:
+    """
+    Growable log of which posts were read by whom, in the same compressed layout as the adjacency in population.py. Every
+    sample gets a block of (user, post id) entries sorted by user, and indptr[i] is where the block of sample i starts.
+    The entry arrays double in size when they fill up, so adding a sample is O(entries in it) on average
+    """
+    def __init__(self):
+        self.indptr = [0]
+        self._users = np.zeros(1024, dtype=np.int64)
+        self._ids = np.zeros(1024, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def add(self, users, post_ids):
+        start = self.indptr[-1]
+        end = start + len(users)
+        if end > len(self._users):
+            size = max(2 * len(self._users), end)
+            self._users = np.concatenate([self._users[:start], np.zeros(size - start, dtype=np.int64)])
+            self._ids = np.concatenate([self._ids[:start], np.zeros(size - start, dtype=np.int64)])
+        order = np.argsort(users, kind='stable')
+        self._users[start:end] = np.asarray(users)[order]
+        self._ids[start:end] = np.asarray(post_ids)[order]
+        self.indptr.append(end)
+
+    # Ids of the posts user read in sample, in the order they were read
+    def get(self, sample, user):
+        start, end = self.indptr[sample], self.indptr[sample + 1]
+        users = self._users[start:end]
+        return self._ids[start + np.searchsorted(users, user, 'left'):start + np.searchsorted(users, user, 'right')]
+
+    # Every (user, post id) entry of sample
+    def get_sample(self, sample):
+        start, end = self.indptr[sample], self.indptr[sample + 1]
+        return self._users[start:end], self._ids[start:end]
+
+
+class PopulationHistory:
+    """
+    Keeps track of the whole population (see population.py) over one run, in columns: one preallocated
+    (number of samples, number of users) array each for opinion, whether people were online and how much engagement they
+    got out of what they read, plus a ReadLog of the posts they read. Only every every-th time step is sampled, which
+    bounds how much memory a long run needs. If the run goes on for longer than num_time_cycles, the arrays double in
+    size like ReadLog's do, so nothing stops being recorded
+    """
+    def __init__(self, num_users, num_time_cycles, every=1, record_reads=True):
+        """
+        @param num_users: number of users in the population
+        @param num_time_cycles: how many steps the run will last (only used to decide how much room to start with)
+        @param every: only time steps that are a multiple of every are recorded
+        @param record_reads: whether the ids of the posts that were read are logged
+        """
+        self.num_users = num_users
+        self.every = every
+        self.record_reads = record_reads
+        num_samples = max(-(-num_time_cycles // every), 1)
+        self._steps = np.zeros(num_samples, dtype=np.int64)
+        self._opinion = np.zeros([num_samples, num_users])
+        self._is_online = np.zeros([num_samples, num_users], dtype=bool)
+        self._engagement = np.zeros([num_samples, num_users])
+        self.reset()
+
+    # Forgets everything that was recorded (done for every new realization)
+    def reset(self):
+        self.num_samples = 0
+        self.reads = ReadLog()
+
+    # Whether time_step is one of the steps that get recorded
+    def samples(self, time_step):
+        return time_step % self.every == 0
+
+    def record(self, time_step, opinion, is_online, engagement, read_users=None, read_ids=None):
+        """
+        @param time_step: the step that's being recorded (should be one that samples() is True for)
+        @param opinion: everyone's opinion at the end of the step
+        @param is_online: who was online during the step
+        @param engagement: total engagement each user got out of the posts they read during the step
+        @param read_users, read_ids: one entry per post read during the step, saying who read which post
+        """
+        i = self.num_samples
+        if i == len(self._steps):
+            self._steps, self._opinion, self._is_online, self._engagement = [
+                np.concatenate([array, np.zeros_like(array)])
+                for array in (self._steps, self._opinion, self._is_online, self._engagement)]
+        self._steps[i] = time_step
+        self._opinion[i] = opinion
+        self._is_online[i] = is_online
+        self._engagement[i] = engagement
+        if self.record_reads:
+            self.reads.add(read_users, read_ids)
+        self.num_samples += 1
+
+    @property
+    def steps(self):
+        return self._steps[:self.num_samples]
+
+    @property
+    def opinion(self):
+        return self._opinion[:self.num_samples]
+
+    @property
+    def is_online(self):
+        return self._is_online[:self.num_samples]
+
+    @property
+    def engagement(self):
+        return self._engagement[:self.num_samples]
+
+    # Ids of the posts that user read in the sample-th recorded step
+    def read_posts(self, sample, user):
+        return self.reads.get(sample, user)
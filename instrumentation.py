@@ -0,0 +1,124 @@
+import csv
+import json
+import time
+
+"""
+This file holds Instruments, which times the phases of every time step (making posts, notifying, recommending, reading,
+recording history) and counts what happened during them (posts made, notifications sent, posts scored, feed lengths...).
+At the end of each step, the timers and counters become one row of a trace, which can be written out as JSON or CSV to
+see where the time of each step went.
+
+To keep it cheap enough to leave on, only every sample_every-th step is measured. On the other steps phase() hands back
+a timer that does nothing and count() returns straight away. Code that isn't being profiled gets NULL_INSTRUMENTS, which
+never measures anything.
+"""
+
+
+class _Timer:
+    def __init__(self, instruments, name):
+        self.instruments = instruments
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instruments.add_time(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Instruments:
+    def __init__(self, sample_every=1):
+        """
+        @param sample_every: only every sample_every-th step is measured
+        """
+        self.sample_every = sample_every
+        # Whether the current step is being measured
+        self.active = False
+        self.rows = []
+        self._step = None
+        self._times = {}
+        self._counts = {}
+        self._step_start = 0
+
+    # Called at the start of every step. Works out whether this one gets measured
+    def start_step(self, step):
+        self._step = step
+        self.active = step % self.sample_every == 0
+        if self.active:
+            self._times = {}
+            self._counts = {}
+            self._step_start = time.perf_counter()
+
+    # Context manager that adds the time spent inside it to the named phase. Phases can be entered more than once a step
+    def phase(self, name):
+        return _Timer(self, name) if self.active else _NULL_TIMER
+
+    def add_time(self, name, seconds):
+        if self.active:
+            self._times[name] = self._times.get(name, 0.0) + seconds
+
+    # Adds value to the named counter for this step
+    def count(self, name, value=1):
+        if self.active:
+            self._counts[name] = self._counts.get(name, 0) + value
+
+    # Sets the named counter for this step (for things like feed lengths, where only the latest value matters)
+    def gauge(self, name, value):
+        if self.active:
+            self._counts[name] = value
+
+    # Called at the end of every step. Turns what was measured into a row of the trace
+    def end_step(self):
+        if not self.active:
+            return
+        row = {'step': self._step, 'total_time': time.perf_counter() - self._step_start}
+        row.update({f"time_{name}": seconds for name, seconds in self._times.items()})
+        # Counters can come from numpy, which json doesn't know about
+        row.update({name: value.item() if hasattr(value, 'item') else value for name, value in self._counts.items()})
+        self.rows.append(row)
+        self.active = False
+
+    # Total time of every phase, over all of the measured steps
+    def summary(self):
+        totals = {}
+        for row in self.rows:
+            for key, value in row.items():
+                if key.startswith('time_') or key == 'total_time':
+                    totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    def to_json(self, path):
+        with open(path, 'w') as file:
+            json.dump({'sample_every': self.sample_every, 'rows': self.rows, 'summary': self.summary()}, file,
+                      indent=2)
+
+    def to_csv(self, path):
+        columns = []
+        for row in self.rows:
+            columns.extend(key for key in row if key not in columns)
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+
+# Instruments that never measure anything, for code that isn't being profiled
+class _NullInstruments(Instruments):
+    def start_step(self, step):
+        pass
+
+
+NULL_INSTRUMENTS = _NullInstruments()
@@ -0,0 +1,119 @@
+import importlib.util
+import numpy as np
+from person import how_engaging_vec, how_engaging_batch
+
+"""
+This file holds the agent kernels of Population: the parts of a step that go over every (user, post) pair. Those are
+reading (every agent goes through their posts one after the other, and each post they read changes their opinion before
+they read the next one, like Person._read_feed, _read_notifications and belief_update_func) and ranking a batch of posts
+for every opinion when it's popped off the feeds (what send_news sorted by). With NumPy, reading has to be done one post
+position at a time across all of the readers, going over the whole padded (readers x posts) matrix for every position,
+and ranking builds the whole (opinions x posts) engagement matrix before sorting it. With numba (numba_kernels.py),
+each reader's posts and each opinion's ranking are gone through in a compiled loop, and the readers or opinions are
+split up between threads with prange (each one only touches their own entries, so nothing has to be locked).
+
+numba is optional, and is only imported once get_kernels('numba') is called. If it isn't installed, the NumPy versions
+are handed back instead. The compiled kernels work out the bias factor exactly, which is already faster than looking it
+up in the bias table, so they ignore the table (it only changes how the NumPy version ranks), and their results can
+differ from the NumPy ones in the last few bits.
+
+The rest of Person.cycle (_stay_online, _check_phone, make_post) is done with whole-array operations in Population that
+are O(users) per step, with the random numbers drawn beforehand so that they're the same whichever backend is used.
+Those aren't compiled, since they take a small part of a step next to reading and ranking.
+"""
+
+HAVE_NUMBA = importlib.util.find_spec('numba') is not None
+
+BACKENDS = ['numpy', 'numba']
+
+
+# Indices of the k highest entries of every row of scores, highest first. Uses a partial sort (np.partition), so it's
+# O(n) per row instead of the O(n log n) of a full sort. Ties keep the order they appear in, same as a stable sort
+def rank_top_k(scores, k):
+    """
+    @param scores: 2D array with one row of scores per user
+    @param k: how many of the best entries to keep from each row
+    @return: integer array with shape (len(scores), min(k, scores.shape[1]))
+    """
+    num_cols = scores.shape[1]
+    k = min(k, num_cols)
+    if k == 0:
+        return np.zeros([len(scores), 0], dtype=np.int64)
+    if k < num_cols:
+        # The k-th highest score of every row. Everything above it makes the cut, and so do the first few entries equal
+        # to it (as many as it takes to get to k)
+        threshold = -np.partition(-scores, k - 1, axis=1)[:, k - 1:k]
+        above = scores > threshold
+        at_threshold = scores == threshold
+        num_ties_needed = k - np.count_nonzero(above, axis=1, keepdims=True)
+        keep = above | (at_threshold & (np.cumsum(at_threshold, axis=1) <= num_ties_needed))
+        candidates = np.nonzero(keep)[1].reshape(len(scores), k)
+    else:
+        candidates = np.broadcast_to(np.arange(num_cols), scores.shape)
+    # Putting the candidates in order, breaking ties with their original position
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+# Has each user in users read their posts one after the other. leanings and interests have shape
+# (len(users), num_posts) and are nan where the user has no post to read. Updates opinion, mem_total, mem_norm, cyc_total
+# and cyc_norm in place, and returns the total engagement of each user
+def read_posts_numpy(users, leanings, interests, opinion, mem_total, mem_norm, remembered, cyc_total, cyc_norm):
+    """
+    @param users: indices of the users reading
+    @param remembered: for each user, whether what they read is remembered after this cycle (goes into mem_total and
+    mem_norm) or only until the end of it (cyc_total and cyc_norm, which have one entry per user in users)
+    """
+    tot_engagement = np.zeros(len(users))
+    for j in range(leanings.shape[1]):
+        reading = ~np.isnan(leanings[:, j])
+        readers = users[reading]
+        engagement = how_engaging_vec(leanings[reading, j], interests[reading, j], opinion[readers])
+        tot_engagement[reading] += engagement
+        # Person.belief_update_func
+        keep = remembered[reading]
+        mem_total[readers[keep]] += engagement[keep] * leanings[reading, j][keep]
+        mem_norm[readers[keep]] += engagement[keep]
+        cyc_total[reading & ~remembered] += engagement[~keep] * leanings[reading, j][~keep]
+        cyc_norm[reading & ~remembered] += engagement[~keep]
+        opinion[readers] = (mem_total[readers] + cyc_total[reading]) / (mem_norm[readers] + cyc_norm[reading])
+    return tot_engagement
+
+
+# Indices of the k posts every opinion finds most engaging, best first (ties keep the order the posts are in), with
+# shape (len(opinions), min(k, len(leanings))). Same as send_news's sort
+def rank_posts_numpy(leanings, interests, window_leanings, opinions, k, tolerance=None):
+    """
+    @param leanings, interests: leaning and interest value of every post, as the reader sees them
+    @param window_leanings: what send_similar_news's window goes by for every post (the column PostStore sorts on)
+    @param opinions: opinion to rank for
+    @param k: how many of the best posts to rank
+    @param tolerance: if given, posts whose window_leaning is further than this from an opinion go to the back of its
+    ranking, since send_similar_news would never have sent them
+    """
+    engagement = how_engaging_batch(leanings, interests, opinions)
+    if tolerance is not None:
+        in_window = ((window_leanings[None, :] >= opinions[:, None] - tolerance) &
+                     (window_leanings[None, :] < opinions[:, None] + tolerance))
+        engagement[~in_window] = -np.inf
+    return rank_top_k(engagement, k)
+
+
+class Kernels:
+    def __init__(self, name, read_posts, rank_posts):
+        # Backend that's actually used (numpy if numba was asked for but isn't installed)
+        self.name = name
+        self.read_posts = read_posts
+        self.rank_posts = rank_posts
+
+
+NUMPY_KERNELS = Kernels('numpy', read_posts_numpy, rank_posts_numpy)
+
+
+# The kernels of the given backend ('numpy' or 'numba')
+def get_kernels(backend='numpy'):
+    assert backend in BACKENDS, f"backend must be one of {BACKENDS}"
+    if backend == 'numba' and HAVE_NUMBA:
+        from numba_kernels import read_posts_numba, rank_posts_numba
+        return Kernels('numba', read_posts_numba, rank_posts_numba)
+    return NUMPY_KERNELS
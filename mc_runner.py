@@ -0,0 +1,98 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from population import Population
+from agent_streams import AgentStreams
+from graph_funcs import gen_connected_graph
+
+"""
+This file runs the Monte Carlo realizations of the simulation (a new random graph, everyone reset, and the whole time
+loop) in parallel. Every realization is independent, so they're handed out to a pool of worker processes. Each one gets
+its own random stream, spawned from a single np.random.SeedSequence, so a run can be reproduced from its seed no matter
+how many workers it was spread over.
+
+Workers only send back numpy arrays (the final opinions and how many people were online at each step) instead of
+pickled graphs full of Person objects.
+"""
+
+
+# Runs a single realization from start to finish. Has to be at the top level of the module so it can be pickled
+def _run_realization(args):
+    stats, avg_connections, num_time_cycles, seed_seq, agent_streams, population_kwargs = args
+    rng = np.random.default_rng(seed_seq)
+    streams = AgentStreams(seed_seq.spawn(1)[0]) if agent_streams else None
+    population = Population(*stats, rng=rng, streams=streams, **population_kwargs)
+    population.link(gen_connected_graph(population.num_users, avg_connections, rng=rng))
+    time_spent_online = np.zeros(num_time_cycles, dtype=np.int64)
+    for i in range(num_time_cycles):
+        time_spent_online[i] = population.step()
+    return population.get_opinions(), time_spent_online
+
+
+# What the realizations of an MCRunner produced, stacked into arrays with one row per realization
+class MCResults:
+    def __init__(self, initial_opinions, final_opinions, time_spent_online):
+        """
+        @param initial_opinions: array with everyone's opinion before the algorithm was run
+        @param final_opinions: array with shape (number of realizations, number of users)
+        @param time_spent_online: array with shape (number of realizations, number of time cycles) holding how many
+        people were online at each step
+        """
+        self.initial_opinions = initial_opinions
+        self.final_opinions = final_opinions
+        self.time_spent_online = time_spent_online
+
+    def __len__(self):
+        return len(self.final_opinions)
+
+    # Average number of users on the site, over every step of every realization
+    def average_online(self):
+        return self.time_spent_online.mean()
+
+
+class MCRunner:
+    def __init__(self, consumption, expected_engagement, activity, initial_opinion, avg_connections,
+                 num_time_cycles, num_workers=None, seed=None, agent_streams=False, **population_kwargs):
+        """
+        The first four arguments are arrays with one entry per user, same as for Population
+        @param avg_connections: average degree of the random graph made for each realization
+        @param num_time_cycles: how many steps each realization runs for
+        @param num_workers: how many processes to run realizations in. None uses every core, and 1 runs them in this
+        process (handy for debugging)
+        @param seed: seed for np.random.SeedSequence. None picks a fresh one, which is kept in self.seed_seq
+        @param agent_streams: if True, every user's random numbers come from AgentStreams (see agent_streams.py), so they
+        only depend on the seed, the realization, the step and the user
+        @param population_kwargs: passed on to Population (top_k, similar_news, ...)
+        """
+        self.stats = (np.asarray(consumption), np.asarray(expected_engagement), np.asarray(activity),
+                      np.asarray(initial_opinion, dtype=float))
+        self.avg_connections = avg_connections
+        self.num_time_cycles = num_time_cycles
+        self.num_workers = num_workers
+        self.seed_seq = np.random.SeedSequence(seed)
+        self.agent_streams = agent_streams
+        self.population_kwargs = population_kwargs
+
+    # Builds an MCRunner out of the dictionary of people that gen_rand_ppl and friends return
+    @classmethod
+    def from_ppl_dict(cls, ppl_dict, avg_connections, num_time_cycles, **kwargs):
+        people = [ppl_dict[i]['Person'] for i in range(len(ppl_dict))]
+        return cls([p.consumption for p in people], [p.exp_eng for p in people], [p.activity for p in people],
+                   [p.initialized_opinion for p in people], avg_connections, num_time_cycles, **kwargs)
+
+    # Runs num_mc_cycles realizations and gathers their results. Realization i always uses the i-th child of the seed
+    def run(self, num_mc_cycles):
+        tasks = [(self.stats, self.avg_connections, self.num_time_cycles, child, self.agent_streams,
+                  self.population_kwargs)
+                 for child in np.random.SeedSequence(self.seed_seq.entropy).spawn(num_mc_cycles)]
+        if self.num_workers == 1:
+            results = [_run_realization(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                results = list(executor.map(_run_realization, tasks))
+        num_users = len(self.stats[3])
+        final_opinions = np.zeros([num_mc_cycles, num_users])
+        time_spent_online = np.zeros([num_mc_cycles, self.num_time_cycles], dtype=np.int64)
+        for i, (opinions, online) in enumerate(results):
+            final_opinions[i] = opinions
+            time_spent_online[i] = online
+        return MCResults(self.stats[3].copy(), final_opinions, time_spent_online)
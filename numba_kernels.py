@@ -0,0 +1,134 @@
+import math
+import numpy as np
+from numba import njit, prange
+from person import margin
+
+"""
+This file holds the numba versions of the kernels in kernels.py. It's only imported by get_kernels('numba'), so that
+importing population (or anything else) doesn't pay for loading numba when the NumPy backend is used.
+
+The bias factor is worked out exactly, like bias_factor_exact in person.py, with math.lgamma in place of gammaln and
+betaln. The beta distribution's parameters only depend on the user's opinion and its logs only on the post's leaning,
+so when a batch is ranked, each is worked out once (_beta_params per opinion, _post_logs per post) and only the cheap
+part is left for every (post, opinion) pair (_bias_from_logs).
+"""
+
+
+# a, b and the log of the normalization of the beta distribution that bias_factor_exact uses for the given opinion
+@njit(cache=True)
+def _beta_params(opinion):
+    mean = min(max(opinion, margin), 1 - margin)
+    mean = np.cbrt(0.5 ** 2 * (mean - 0.5)) + 0.5
+    mean = min(max(mean, margin), 1 - margin)
+    std_dev = 0.09
+    temp_num = mean * (1 - mean) / (std_dev ** 2)
+    a = min(max(mean * temp_num, margin), 1 - margin)
+    b = min(max((1 - mean) * temp_num, margin), 1 - margin)
+    # 2 * gammaln(b) - betaln(a, b)
+    log_norm = 2 * math.lgamma(b) - (math.lgamma(a) + math.lgamma(b) - math.lgamma(a + b))
+    return a, b, log_norm
+
+
+# log(x) and log(1 - x) of a post's leaning x, which is all of the beta distribution that depends on the post. The log
+# of 0 is left as -inf, since whenever 1 - x is 0 and would matter _bias_from_logs doesn't use it
+@njit(cache=True)
+def _post_logs(leaning):
+    x = min(max(leaning, margin), 1 - margin)
+    log_x = math.log(x)
+    log_1mx = math.log(1 - x) if 1 - x > 0 else -np.inf
+    return log_x, log_1mx
+
+
+# bias_factor_exact for a single post, given its _post_logs and the _beta_params of the user
+@njit(cache=True)
+def _bias_from_logs(log_x, log_1mx, a, b, log_norm):
+    # beta_dist falls back to func = 1 when python raises a ZeroDivisionError (a post with a leaning of exactly 1)
+    if log_1mx == -np.inf and b < 1:
+        log_func = 0.0
+    else:
+        log_func = (a - 1) * log_x + (b - 1) * log_1mx
+    beta = math.exp(min(log_func + log_norm, math.log(10)))
+    return min(1.0, (3 * beta / 10 + 0.3) / 2)
+
+
+@njit(parallel=True, cache=True)
+def _read_posts(users, leanings, interests, opinion, mem_total, mem_norm, remembered, cyc_total, cyc_norm,
+                tot_engagement):
+    for i in prange(len(users)):
+        user = users[i]
+        for j in range(leanings.shape[1]):
+            leaning = leanings[i, j]
+            if np.isnan(leaning):
+                continue
+            a, b, log_norm = _beta_params(opinion[user])
+            log_x, log_1mx = _post_logs(leaning)
+            engagement = interests[i, j] * _bias_from_logs(log_x, log_1mx, a, b, log_norm)
+            tot_engagement[i] += engagement
+            if remembered[i]:
+                mem_total[user] += engagement * leaning
+                mem_norm[user] += engagement
+            else:
+                cyc_total[i] += engagement * leaning
+                cyc_norm[i] += engagement
+            opinion[user] = (mem_total[user] + cyc_total[i]) / (mem_norm[user] + cyc_norm[i])
+
+
+# Same as read_posts_numpy in kernels.py
+def read_posts_numba(users, leanings, interests, opinion, mem_total, mem_norm, remembered, cyc_total, cyc_norm):
+    tot_engagement = np.zeros(len(users))
+    _read_posts(np.ascontiguousarray(users, dtype=np.int64), np.ascontiguousarray(leanings, dtype=float),
+                np.ascontiguousarray(interests, dtype=float), opinion, mem_total, mem_norm,
+                np.ascontiguousarray(remembered, dtype=np.bool_), cyc_total, cyc_norm, tot_engagement)
+    return tot_engagement
+
+
+# Indices of the k lowest entries of scores, lowest first, with ties kept in the order they appear in. Same as
+# rank_top_k (with the scores negated): O(len(scores)) to find the k-th lowest, and then only those k get sorted
+@njit(cache=True)
+def _top_k(scores, k):
+    threshold = np.partition(scores, k - 1)[k - 1]
+    num_below = 0
+    for score in scores:
+        if score < threshold:
+            num_below += 1
+    num_ties_needed = k - num_below
+    candidates = np.empty(k, dtype=np.int64)
+    num_candidates = 0
+    for j in range(len(scores)):
+        if scores[j] < threshold or (scores[j] == threshold and num_ties_needed > 0):
+            if scores[j] == threshold:
+                num_ties_needed -= 1
+            candidates[num_candidates] = j
+            num_candidates += 1
+    # mergesort is stable, so ties stay in the order they appear in
+    return candidates[np.argsort(scores[candidates], kind='mergesort')]
+
+
+@njit(parallel=True, cache=True)
+def _rank_posts(leanings, interests, window_leanings, opinions, k, tolerance, ranking):
+    log_x = np.empty(len(leanings))
+    log_1mx = np.empty(len(leanings))
+    for j in range(len(leanings)):
+        log_x[j], log_1mx[j] = _post_logs(leanings[j])
+    for i in prange(len(opinions)):
+        a, b, log_norm = _beta_params(opinions[i])
+        # Negated, so that the lowest scores are the most engaging posts
+        scores = np.empty(len(leanings))
+        for j in range(len(leanings)):
+            if tolerance >= 0 and not (opinions[i] - tolerance <= window_leanings[j] < opinions[i] + tolerance):
+                scores[j] = np.inf
+            else:
+                scores[j] = -interests[j] * _bias_from_logs(log_x[j], log_1mx[j], a, b, log_norm)
+        ranking[i, :] = _top_k(scores, k)
+
+
+# Same as rank_posts_numpy in kernels.py
+def rank_posts_numba(leanings, interests, window_leanings, opinions, k, tolerance=None):
+    k = min(k, len(leanings))
+    ranking = np.zeros((len(opinions), k), dtype=np.int64)
+    if k == 0:
+        return ranking
+    _rank_posts(np.ascontiguousarray(leanings, dtype=float), np.ascontiguousarray(interests, dtype=float),
+                np.ascontiguousarray(window_leanings, dtype=float), np.ascontiguousarray(opinions, dtype=float), k,
+                -1.0 if tolerance is None else float(tolerance), ranking)
+    return ranking
@@ -0,0 +1,124 @@
+import numpy as np
+
+"""
+This file holds OpinionMemory, which keeps track of the posts that shape a person's opinion. Person.belief_update_func
+used to append every post it read to a list and then sum the whole list up again to get the engagement weighted mean,
+and truncate_update_posts() made a new copy of the list every cycle. Here the weighted sum and its norm are kept as
+running totals instead, so reading a post is O(1).
+
+There are two ways of forgetting posts:
+ - The original one (window=None): posts read during the first num_remembered_times time steps are remembered for good,
+   and anything read after that only counts until the end of the cycle it was read in
+ - A sliding window (window=k): only posts read in the last k time steps count. They're kept in a ring buffer that is
+   cleared out by age at the end of every cycle, taking them back out of the running totals
+A weighting function (like ebbinghaus_weighting in person.py) can also be plugged in, to have older posts count for less.
+Since the weights change as posts get older, the mean has to be worked out over all remembered posts in that case.
+"""
+
+
+class OpinionMemory:
+    def __init__(self, initial_opinion, num_remembered_times=20, window=None, weighting=None):
+        """
+        @param initial_opinion: what the person believes before reading anything. It's remembered as 5 posts with an
+        engagement of 1, read at time steps 0 to 4
+        @param num_remembered_times: posts read after this many time steps are only remembered until the end of the
+        cycle (only used when window is None)
+        @param window: if not None, only posts read in the last window time steps are remembered
+        @param weighting: function of (age, engagement) that returns how much a post counts for, on top of its
+        engagement. None means every post counts the same
+        """
+        self.num_remembered_times = num_remembered_times
+        self.window = window
+        self.weighting = weighting
+        # Only needed if posts ever have to be looked at again (for forgetting them by age, or for weighting them)
+        self.keeps_entries = window is not None or weighting is not None
+        self.reset(initial_opinion)
+
+    # Forgets everything, and goes back to only remembering initial_opinion
+    def reset(self, initial_opinion):
+        # Running totals of engagement * leaning and engagement for the posts that are remembered for good
+        self.total = 0.0
+        self.norm = 0.0
+        # Same thing, but for posts that will be forgotten at the end of this cycle
+        self.cycle_total = 0.0
+        self.cycle_norm = 0.0
+        # Ring buffer of [time step, engagement, leaning] entries, in the order they were read
+        self._entries = np.zeros([16, 3])
+        self._head = 0
+        self._len = 0
+        for i in range(5):
+            self.add(i, 1, initial_opinion)
+
+    # Remembers a post the person just read
+    def add(self, time_step, engagement, leaning):
+        if self.window is None and time_step > self.num_remembered_times:
+            self.cycle_total += engagement * leaning
+            self.cycle_norm += engagement
+        else:
+            self.total += engagement * leaning
+            self.norm += engagement
+        if self.keeps_entries:
+            if self._len == len(self._entries):
+                self._entries = np.concatenate([self._ordered_entries(), np.zeros_like(self._entries)])
+                self._head = 0
+            self._entries[(self._head + self._len) % len(self._entries)] = [time_step, engagement, leaning]
+            self._len += 1
+
+    # The remembered entries, oldest first
+    def _ordered_entries(self):
+        idx = (self._head + np.arange(self._len)) % len(self._entries)
+        return self._entries[idx]
+
+    # The engagement weighted mean of the leanings of every remembered post. If nothing is remembered, default is
+    # returned instead
+    def opinion(self, time_step, default=None):
+        if self.weighting is not None:
+            entries = self._ordered_entries()
+            weights = entries[:, 1] * self.weighting(time_step - entries[:, 0], entries[:, 1])
+            total = np.sum(weights * entries[:, 2])
+            norm = np.sum(weights)
+        else:
+            total = self.total + self.cycle_total
+            norm = self.norm + self.cycle_norm
+        if norm == 0:
+            return default
+        return total / norm
+
+    # Forgets whatever shouldn't be remembered once the cycle is over. time_step is the time step that's about to start
+    def end_cycle(self, time_step):
+        self.cycle_total = 0.0
+        self.cycle_norm = 0.0
+        if self.window is None:
+            if self.keeps_entries:
+                # Same as truncating the list at the first post read after num_remembered_times
+                while self._len > 0 and self._entries[(self._head + self._len - 1) % len(self._entries), 0] > \
+                        self.num_remembered_times:
+                    self._len -= 1
+            return
+        # Taking the posts that have gotten too old back out of the running totals
+        while self._len > 0 and self._entries[self._head, 0] < time_step - self.window:
+            _, engagement, leaning = self._entries[self._head]
+            self.total -= engagement * leaning
+            self.norm -= engagement
+            self._head = (self._head + 1) % len(self._entries)
+            self._len -= 1
+        if self._len == 0:
+            # Getting rid of any rounding error that built up
+            self.total = 0.0
+            self.norm = 0.0
+
+    def __len__(self):
+        return self._len
+
+    # Everything that's remembered, as arrays (see checkpoint.py)
+    def get_state(self):
+        return {'totals': np.array([self.total, self.norm, self.cycle_total, self.cycle_norm]),
+                'entries': self._ordered_entries()}
+
+    def set_state(self, state):
+        self.total, self.norm, self.cycle_total, self.cycle_norm = [float(value) for value in state['totals']]
+        entries = np.asarray(state['entries'], dtype=float).reshape(-1, 3)
+        self._entries = np.zeros([max(16, len(entries)), 3])
+        self._entries[:len(entries)] = entries
+        self._head = 0
+        self._len = len(entries)
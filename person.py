@@ -1,8 +1,11 @@
+import math
 import numpy as np
-from scipy.special import expit, gamma
-import names
+from scipy.special import expit, gamma, gammaln, betaln
 import itertools
 from history import History
+from feed import Feed
+from opinion_memory import OpinionMemory
+from bias_table import BiasTable
 
 margin = 1E-16
 
@@ -56,6 +59,13 @@ def ebbinghaus(time, k, c):
     return k / denom
 
 
+# Weighting for OpinionMemory that has posts fade away following the Ebbinghaus curve (see ebbinghaus for k and c)
+def ebbinghaus_weighting(k=20, c=1):
+    def weighting(age, engagement):
+        return ebbinghaus(age, k, c)
+    return weighting
+
+
 # Something to add polarization. Graph is in desmos
 def skew_mean(mean):
     mean = put_in_range(mean, margin)
@@ -64,6 +74,142 @@ def skew_mean(mean):
     return inter + 0.5
 
 
+# Vectorized version of skew_mean (put_in_range is replaced with np.clip)
+def skew_mean_vec(mean):
+    mean = np.clip(mean, margin, 1 - margin)
+    return np.cbrt(0.5 ** 2 * (mean - 0.5)) + 0.5
+
+
+# Bias factor of Person.how_engaging (what the interest value gets multiplied by), given the user's skewed mean instead of
+# their opinion. leanings and means are broadcast against each other
+def bias_factor_exact(leanings, means):
+    """
+    The beta distribution is worked out in log space (with gammaln/betaln instead of gamma) so that a and b values near
+    the margin can't overflow. beta_dist multiplies by gamma(b) instead of dividing by it, and that's kept as is so the
+    numbers match the scalar version
+    @param leanings: leaning of the posts
+    @param means: skew_mean_vec of the opinions of the users reading the posts, clipped to [margin, 1 - margin]
+    @return: numpy array with the bias factor of every (post, user) pair
+    """
+    mean = np.clip(means, margin, 1 - margin)
+    x = np.clip(leanings, margin, 1 - margin)
+    # Same beta distribution parameters as in Person.how_engaging
+    std_dev = 0.09
+    temp_num = mean * (1 - mean) / (std_dev ** 2)
+    a = np.clip(mean * temp_num, margin, 1 - margin)
+    b = np.clip((1 - mean) * temp_num, margin, 1 - margin)
+    # log(gamma(a + b) / gamma(a) * gamma(b))
+    log_norm = 2 * gammaln(b) - betaln(a, b)
+    with np.errstate(divide='ignore'):
+        log_func = (a - 1) * np.log(x) + (b - 1) * np.log(1 - x)
+    # beta_dist falls back to func = 1 when python raises a ZeroDivisionError (a post with a leaning of exactly 1)
+    log_func = np.where((1 - x == 0) & (b < 1), 0, log_func)
+    # Anything past a beta value of 17 / 3 already maxes out the bias factor, so the exponent is capped to stay finite
+    beta = np.exp(np.minimum(log_func + log_norm, np.log(10)))
+    return np.minimum(1, (3 * beta / 10 + 0.3) / 2)
+
+
+# bias_factor_exact for a single (leaning, mean) pair, with python floats and math.lgamma, which is a lot faster than
+# calling the numpy version on one value
+def bias_factor_scalar(leaning, mean):
+    mean = min(max(mean, margin), 1 - margin)
+    x = min(max(leaning, margin), 1 - margin)
+    std_dev = 0.09
+    temp_num = mean * (1 - mean) / (std_dev ** 2)
+    a = min(max(mean * temp_num, margin), 1 - margin)
+    b = min(max((1 - mean) * temp_num, margin), 1 - margin)
+    log_norm = math.lgamma(b) + math.lgamma(a + b) - math.lgamma(a)
+    if 1 - x == 0 and b < 1:
+        log_func = 0.0
+    else:
+        log_func = (a - 1) * math.log(x) + (b - 1) * math.log(1 - x)
+    beta = math.exp(min(log_func + log_norm, math.log(10)))
+    return min(1.0, (3 * beta / 10 + 0.3) / 2)
+
+
+# The user's opinion as it goes into the beta distribution
+def _skewed_means(user_leanings):
+    return np.clip(skew_mean_vec(user_leanings), margin, 1 - margin)
+
+
+# skew_mean of a single opinion in [0, 1], with python floats (np.cbrt is slow on one value). Not clipped to the
+# margin, since the bias table works the values right next to 0 and 1 out exactly anyway (and clips them there)
+def _skewed_mean_scalar(user_leaning):
+    shift = 0.5 ** 2 * (user_leaning - 0.5)
+    if shift < 0:
+        return 0.5 - (-shift) ** (1 / 3)
+    return 0.5 + shift ** (1 / 3)
+
+
+# BiasTable that how_engaging_stripped and how_engaging_batch look the bias factor up in, set with use_bias_table. None
+# works it out exactly
+_bias_table = None
+
+
+# Switches how_engaging_stripped (and so how_engaging) and how_engaging_batch over to a precomputed BiasTable with the
+# given resolution (see bias_table.py), or back to the exact version if resolution is None. Returns the table.
+# how_engaging_vec always works it out exactly, since a lookup per element costs about as much as the exact formula.
+# how_engaging_batch only comes out ahead with the table once there are more than about 2 * resolution posts in the
+# batch (2000 for the default of 1024); below that it's slower
+def use_bias_table(resolution=1024, edge=0.01):
+    global _bias_table
+    _bias_table = None if resolution is None else BiasTable(bias_factor_exact, _skewed_means, resolution, edge,
+                                                            exact_scalar=bias_factor_scalar)
+    return _bias_table
+
+
+def get_bias_table():
+    return _bias_table
+
+
+# Elementwise version of Person.how_engaging. leanings, interests and user_leanings are broadcast against each other.
+# Always exact (see use_bias_table)
+def how_engaging_vec(leanings, interests, user_leanings):
+    """
+    @param leanings: leaning of the posts
+    @param interests: interest values of the posts
+    @param user_leanings: opinions of the users reading the posts
+    @return: numpy array with the predicted engagement of every (post, user) pair
+    """
+    return interests * bias_factor_exact(leanings, _skewed_means(user_leanings))
+
+
+# Predicted engagement of every user with every post, all in one go. Row i is what Person.how_engaging would give for
+# each post if user i read it
+def how_engaging_batch(leanings, interests, user_opinions):
+    """
+    @param leanings: 1D array with the leaning of each post
+    @param interests: 1D array with the interest value of each post
+    @param user_opinions: 1D array with the opinion of each user
+    @return: numpy array with shape (len(user_opinions), len(leanings))
+    """
+    leanings = np.asarray(leanings, dtype=float)
+    interests = np.asarray(interests, dtype=float)
+    user_opinions = np.asarray(user_opinions, dtype=float)
+    if _bias_table is not None:
+        engagement = _bias_table.lookup_outer(leanings, _skewed_means(user_opinions))
+        engagement *= interests
+        return engagement
+    return how_engaging_vec(leanings[None, :], interests[None, :], user_opinions[:, None])
+
+
+# Same as how_engaging_batch, but hands the matrix back a few rows at a time so that no more than max_entries
+# (post, user) pairs are worked out at once. Yields the slice of users each block belongs to along with the block
+def how_engaging_batch_chunked(leanings, interests, user_opinions, max_entries=2 ** 22):
+    """
+    @param leanings: 1D array with the leaning of each post
+    @param interests: 1D array with the interest value of each post
+    @param user_opinions: 1D array with the opinion of each user
+    @param max_entries: most (post, user) pairs to hold in memory at once. Always at least one row
+    @return: generator of (slice of users, numpy array with shape (number of users in the slice, len(leanings)))
+    """
+    user_opinions = np.asarray(user_opinions, dtype=float)
+    rows_per_chunk = max(1, max_entries // max(1, len(leanings)))
+    for start in range(0, len(user_opinions), rows_per_chunk):
+        users = slice(start, min(start + rows_per_chunk, len(user_opinions)))
+        yield users, how_engaging_batch(leanings, interests, user_opinions[users])
+
+
 class Post:
     # Taken from stackoverflow question 1045344
     new_id = itertools.count()
@@ -120,7 +266,8 @@ class Post:
 
 class Person:
     def __init__(self, consumption, expected_engagement, activity, name=None, initial_opinion=0.5,
-                 begin_online=True):
+                 begin_online=True, feed_capacity=None, feed_eviction='oldest', memory_window=None,
+                 memory_weighting=None, rng=None):
         """
         @param consumption: integer indicating how many posts, on average, this user will consume
         @param expected_engagement: float in the range [0, 1] indicating, on average, how engaging a post
@@ -129,15 +276,25 @@ class Person:
         @param name: string that holds the person's name
         @param initial_opinion: float in the range [0, 1] indicating what they initially believe about the issue
         @param begin_online: boolean that determines whether the user starts online or not
+        @param feed_capacity: most posts the feed can hold (None for no limit)
+        @param feed_eviction: which posts get thrown out of a full feed, 'oldest' or 'lowest' (predicted engagement)
+        @param memory_window: if not None, only posts read in the last memory_window time steps shape the person's
+        opinion (see OpinionMemory)
+        @param memory_weighting: function of (age, engagement) that makes older posts count for less, like
+        ebbinghaus_weighting(). None means all remembered posts count the same
+        @param rng: numpy Generator the person draws their random numbers from (AgentStreams.agent_generator gives
+        every person a stream of their own). None uses the global np.random state
         """
+        self.rng = np.random if rng is None else rng
         # This stat determines how likely the person is to post
         self.activity = activity
         # Keeps track of how much content this person can consume (on average)
         self.consumption = consumption
         # This is how engaging the person expect the average article in their feed to be
         self.exp_eng = expected_engagement
-        # This keeps track of all the novel articles which the social media site delivers to this person
-        self.feed = []
+        # This keeps track of all the novel articles which the social media site delivers to this person. Like the
+        # notifications, it only holds post ids, which are looked up in the PostStore that is passed to cycle()
+        self.feed = Feed(capacity=feed_capacity, eviction=feed_eviction)
         # This keeps track of direct notifications to the user (from adjacent nodes)
         self.notifications = []
         # This keeps track of what the person thinks over time. Initialized to be some value that we also keep track
@@ -151,11 +308,9 @@ class Person:
         time. I chose to factor it out into a separate class, we'll see if that was wise or not
         """
         self.history = History()
-        # Makes a random name for the person or uses the one specified upon instantiation
-        if isinstance(name, str):
-            self.name = name
-        else:
-            self.name = names.get_full_name()
+        # Uses the name specified upon instantiation. Otherwise a random name is only made up the first time it's asked
+        # for, since names.get_full_name() is slow and the names are only ever used for debug printouts
+        self._name = name if isinstance(name, str) else None
 
         # Keeps track of how many time steps have passed in the algorithm
         self.time_step = 0
@@ -163,7 +318,8 @@ class Person:
         # forgotten
         self.num_remembered_times = 20
         # Keeps track of the last couple of posts that we have seen. Used in belief_update_func
-        self.op_update_posts = [[i, 1, self.opinion] for i in range(5)]
+        self.op_memory = OpinionMemory(self.opinion, self.num_remembered_times, window=memory_window,
+                                       weighting=memory_weighting)
 
     @staticmethod
     def deprecated_how_engaging(post, user_leaning):
@@ -195,7 +351,21 @@ class Person:
         @type user_leaning: float
         @return:
         """
-        x = post.get_leaning()
+        return Person.how_engaging_stripped(post.get_leaning(), post.get_interest(), user_leaning)
+
+    # Same as how_engaging, but takes the leaning and interest value of the post directly, so that posts which are only
+    # stored as records don't have to be turned back into Post objects
+    @staticmethod
+    def how_engaging_stripped(leaning, interest, user_leaning):
+        """
+        @type leaning: float
+        @type interest: float
+        @type user_leaning: float
+        @return:
+        """
+        if _bias_table is not None:
+            return interest * _bias_table.lookup_scalar(leaning, _skewed_mean_scalar(user_leaning))
+        x = leaning
         mean = skew_mean(user_leaning)
         # mean = user_leaning
         # print(f"mean is {mean} margin is {margin}")
@@ -215,33 +385,19 @@ class Person:
         cutoff = 10
         # bias_factor = (min(beta_dist(x, a, b), cutoff) / cutoff + 1) / 2
         bias_factor = min(1, (3 * beta_dist(x, a, b) / 10 + 0.3) / 2)
-        result = post.get_interest() * bias_factor
+        result = interest * bias_factor
         if result > 1:
             print(f"Result is greater than 1!!! ({result})\nbias factor is {bias_factor} and interest is \
-{post.get_interest()}")
+{interest}")
         return result
 
     # How the user updates their beliefs. Subject to modification
     def belief_update_func(self, post_leaning, engagement):
-        self.op_update_posts.append([self.time_step, engagement, post_leaning])
-        total = 0
-        norm = 0
-        for element in self.op_update_posts:
-            # print(f"checking out element {element}")
-            # We're finding the weighted average of the posts' leaning, weighted by the engagement the user had
-            total += element[1] * element[2]
-            norm += element[1]
-        # print(f"{self.name} went from believing {self.opinion} to {total / norm}")
-        return total / norm
-
-    def truncate_update_posts(self):
-        index = len(self.op_update_posts)
-        for idx, element in enumerate(self.op_update_posts):
-            if element[0] > self.num_remembered_times:
-                index = idx
-                break
-        my_list = self.op_update_posts[:index]
-        return my_list
+        self.op_memory.add(self.time_step, engagement, post_leaning)
+        # We're finding the weighted average of the posts' leaning, weighted by the engagement the user had. If they
+        # have forgotten everything, their opinion stays where it is
+        # print(f"{self.name} went from believing {self.opinion} to {self.op_memory.opinion(self.time_step)}")
+        return self.op_memory.opinion(self.time_step, default=self.opinion)
 
     # Resets the state of the person to their original opinion, with an empty feed and no notifications
     def reset(self, is_online=True):
@@ -251,7 +407,27 @@ class Person:
         self.is_online = is_online
         self.history.new_epoch()
         self.time_step = 0
-        self.op_update_posts = [[i, 1, self.opinion] for i in range(5)]
+        self.op_memory.reset(self.opinion)
+
+    # Everything about the person that changes as the algorithm runs, as arrays (see checkpoint.py)
+    def get_state(self):
+        state = {'opinion': np.float64(self.opinion), 'is_online': np.bool_(self.is_online),
+                 'time_step': np.int64(self.time_step), 'notifications': np.array(self.notifications, dtype=np.int64),
+                 'feed': self.feed.get_state(), 'op_memory': self.op_memory.get_state()}
+        # The global np.random state is saved separately, since it's shared by everybody
+        if self.rng is not np.random:
+            state['rng'] = self.rng.bit_generator.state
+        return state
+
+    def set_state(self, state):
+        self.opinion = float(state['opinion'])
+        self.is_online = bool(state['is_online'])
+        self.time_step = int(state['time_step'])
+        self.notifications = [int(post_id) for post_id in state['notifications']]
+        self.feed.set_state(state['feed'])
+        self.op_memory.set_state(state['op_memory'])
+        if 'rng' in state:
+            self.rng.bit_generator.state = state['rng']
 
     # Method to see if the person is online or not
     def get_online(self):
@@ -263,54 +439,66 @@ class Person:
         # If the person is offline, they will not be making any posts
         if not self.is_online:
             return None
-        elif np.random.rand() < self.activity:
+        elif self.rng.random() < self.activity:
             # Screening the leaning of the user
-            leaning = self.opinion + np.random.normal(loc=0.0, scale=0.05)
+            leaning = self.opinion + self.rng.normal(loc=0.0, scale=0.05)
             if leaning > 1:
                 leaning = 1
             elif leaning < 0:
                 leaning = 0
             # Initializes a post with a random engagement factor and a bias which reflects the user's current opinion
-            post = Post(leaning, np.random.rand())
+            post = Post(leaning, self.rng.random())
             return post
         # Otherwise the user has decided not to make a post, and returns None
         return None
 
     # Function that has the person read all of their notifications from direct friends
-    def _read_notifications(self):
+    def _read_notifications(self, posts):
+        """
+        @type posts: PostStore
+        """
         # Similar to _read_feed, keeps track of how engaged the person was reading each post, and returns a list of
         # these values
         engagement = []
-        for post in self.notifications:
-            interest = Person.how_engaging(post, self.opinion)
+        for record in posts.get_records(self.notifications):
+            interest = Person.how_engaging_stripped(record['leaning'], record['interest'], self.opinion)
             engagement.append(interest)
-            self.opinion = self.belief_update_func(post.get_leaning(), interest)
+            self.opinion = self.belief_update_func(record['leaning'], interest)
         return engagement
 
     # Function that has the person read the first few posts in their inbox
-    def _read_feed(self):
-        num_posts_to_read = int(self.consumption + np.random.normal())
+    def _read_feed(self, posts):
+        """
+        @type posts: PostStore
+        """
+        num_posts_to_read = int(self.consumption + self.rng.normal())
         if num_posts_to_read < 1:
             num_posts_to_read = 1
         # This list keeps track of the engagement of the user while reading each article (interest + screen)
         engagement = []
         if num_posts_to_read > len(self.feed):
-            print(f"You haven't given {self.name} enough posts to read!!! They're getting bored!")
+            # Printing self.name would make up a name (which is slow) for everyone who runs out of posts
+            print(f"You haven't given {self._name or 'a user'} enough posts to read!!! They're getting bored!")
             return engagement
         for i in range(num_posts_to_read):
-            post = self.feed.pop(0)
+            record = posts.get_records(self.feed.pop())
+            """
+            Feed posts used to be rebuilt with Post.from_array(), which swaps the leaning and interest value of the
+            stripped data. That's kept as is so that the results don't change
+            """
             # This person finds the article interesting at face value (does not take into account their leaning)
-            interest = Person.how_engaging(post, self.opinion)
+            interest = Person.how_engaging_stripped(record['interest'], record['leaning'], self.opinion)
             engagement.append(interest)
-            self.opinion = self.belief_update_func(post.get_leaning(), interest)
+            self.opinion = self.belief_update_func(record['interest'], interest)
         return engagement
 
     # Function that simulates random phone pickups. if they get an interesting enough notification, they'll go online
-    def _check_phone(self):
-        for post in self.notifications:
-            if post.get_interest() > self.exp_eng:
-                self.is_online = True
-                break
+    def _check_phone(self, posts):
+        """
+        @type posts: PostStore
+        """
+        if np.any(posts.get_records(self.notifications)['interest'] > self.exp_eng):
+            self.is_online = True
         self.notifications.clear()
 
     # This is the function that will determine whether or not the person decides to keep looking through their feed
@@ -318,21 +506,45 @@ class Person:
         prob = np.pi / 2 * np.arctan(tot_interest - self.consumption * self.exp_eng + np.tan(np.pi / 4))
         # There's always a 5% chance that people stay online, even if they haven't gotten very interesting posts
         prob = max(prob, 0.05)
-        return np.random.rand() <= prob
+        return self.rng.random() <= prob
+
+    # Ids of every post in the person's feed and notifications (the ones PostStore.forget_records has to keep)
+    def used_post_ids(self):
+        return np.concatenate([self.feed.get_ids(), np.asarray(self.notifications, dtype=np.int64)])
 
     # Sends a notification to the person's phone
-    def notify(self, post):
+    def notify(self, post_id):
         """
-        @type post: Post
+        @type post_id: int
+        @param post_id: id of the post in the PostStore
         """
-        assert isinstance(post, Post)
         # print(f"{self.name} notified of post")
-        self.notifications.append(post)
+        self.notifications.append(post_id)
 
     # Adds a post to their feed
-    def add_to_feed(self, post):
-        assert isinstance(post, Post)
-        self.feed.append(post)
+    def add_to_feed(self, post_id, engagement=np.nan):
+        """
+        @type post_id: int
+        @param post_id: id of the post in the PostStore
+        @param engagement: how engaging the site predicts the post will be (used if the feed has to throw posts out)
+        """
+        self.feed.append(post_id, engagement)
+
+    # Adds a bunch of posts to the end of their feed, in order
+    def extend_feed(self, post_ids, engagement=None):
+        self.feed.extend(post_ids, engagement)
+
+    # The person's name, made up the first time it's needed
+    @property
+    def name(self):
+        if self._name is None:
+            import names
+            self._name = names.get_full_name()
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
 
     # Returns the person's name
     def my_name_is(self):
@@ -343,24 +555,28 @@ class Person:
         return self.opinion
 
     # Function that simulates the person going through their feed, and deciding whether they will be online next cycle
-    def cycle(self):
+    def cycle(self, posts):
+        """
+        @type posts: PostStore
+        @param posts: where the posts in the feed and notifications are stored
+        """
         tot_interest = []
         if self.is_online:
             # Reads through the stuff that's been recommended by the algorithm
-            notification_engagement = self._read_notifications()
-            feed_engagement = self._read_feed()
+            notification_engagement = self._read_notifications(posts)
+            feed_engagement = self._read_feed(posts)
             tot_interest = sum(notification_engagement) + sum(feed_engagement)
             self.is_online = self._stay_online(tot_interest)
         else:
             # They'll check their phones 10% of the cycles for new notifications
-            if len(self.notifications) > 0 and np.random.rand() < 0.1:
+            if len(self.notifications) > 0 and self.rng.random() < 0.1:
                 # They'll see if they have any new notifications, and go online if they're interesting
-                self._check_phone()
+                self._check_phone(posts)
             # The person has a 5% chance of spontaneously going online TESTING 0% CASE
             # elif np.random.rand() < 0.05:
-            elif np.random.rand() < 0:
+            elif self.rng.random() < 0:
                 self.is_online = True
         self.time_step += 1
         # Have the user forget some posts
-        self.op_update_posts = self.truncate_update_posts()
+        self.op_memory.end_cycle(self.time_step)
         return tot_interest
@@ -0,0 +1,57 @@
+import numpy as np
+import networkx as nx
+import matplotlib.pyplot as plt
+
+"""
+This file holds everything that draws. It's kept apart from the simulation so that matplotlib (and whatever backend it
+picks) only gets loaded the first time something is actually plotted. The simulation modules import from here inside the
+functions that plot, so headless worker processes, and machines without a display, never pay for it.
+"""
+
+
+# Colours every node by which side of the issue the person is on
+def draw_bias_graph(graph):
+    """
+    @type graph: the graph to draw, with associated dictionary of People with an opinion field
+    @return:
+    """
+    color_map = []
+    for node_tuple in graph.nodes(data=True):
+        # Retrieving the associated leaning with each node
+        leaning = node_tuple[1]['Person'].get_opinion()
+        if leaning < 0.5:
+            color_map.append('red')
+        elif leaning > 0.5:
+            color_map.append('blue')
+        else:
+            color_map.append('green')
+    nx.draw(graph, node_color=color_map, with_labels=True)
+    plt.show()
+
+
+# Histogram of everybody's opinion, with curve (a function of the opinion, like social_media.gaussian) drawn over it
+def show_opinion_hist(opinion_poll, curve=None):
+    fig, axs = plt.subplots(1)
+    # We can set the number of bins with the `bins` kwarg
+    axs.hist(opinion_poll, bins=20, density=True)
+    if curve is not None:
+        lin = np.linspace(0, 1, 100)
+        axs.plot(lin, curve(lin))
+    plt.show()
+
+
+# The plots at the end of a run: how many people were online over the last few steps, and the opinions at the end and
+# at the start
+def show_run_summary(time_spent_online, opinion_dist, initial_op, num_users, num_steps_to_plot=300):
+    fig, (ax1, ax2, ax3) = plt.subplots(1, 3)
+    # Plots the last few hundred steps of the number of people online
+    if len(time_spent_online) < num_steps_to_plot:
+        lin_space = np.arange(len(time_spent_online))
+        ax1.plot(lin_space, time_spent_online)
+    else:
+        lin_space = np.arange(num_steps_to_plot)
+        ax1.plot(lin_space, time_spent_online[-num_steps_to_plot:])
+    n_bins = min(int(num_users / 5), 30)
+    ax2.hist(opinion_dist, density=True, bins=n_bins, range=[0, 1])
+    ax3.hist(initial_op, density=True, bins=n_bins, range=[0, 1])
+    plt.show()
@@ -0,0 +1,540 @@
+import numpy as np
+import scipy.sparse
+from post_store import PostStore, LEAN_COL, INTEREST_COL, ID_COL
+from instrumentation import NULL_INSTRUMENTS
+from kernels import get_kernels
+from agent_streams import PHASE_POST, PHASE_POST_LEANING, PHASE_POST_INTEREST, PHASE_READ, PHASE_STAY_ONLINE, \
+    PHASE_CHECK_PHONE
+
+"""
+This file holds a vectorized version of the simulation in social_media.py. Instead of a Person object per node, every
+stat that Person keeps track of is stored in a numpy array with one entry per user, and the whole population is advanced
+at once. It's meant to behave exactly like the per-object loop in social_media.py (same posting, notification, feed,
+reading and going-offline rules), just without the python overhead of walking the graph node by node.
+
+A note on how posts are stored: posts live in a PostStore, and are kept as rows of [leaning, interest, id], which is the
+layout that Post.get_stripped_data() produces and that PostStore sorts on. Because Post.__init__ stores its two
+arguments the other way around, a post in that layout means different things depending on how it reaches a user:
+ - Person._read_feed swaps the leaning and interest value (feed posts used to be rebuilt with Post.from_array()), so the
+   user sees column 1 as the leaning and column 0 as the interest value
+ - Notifications are read straight from the post's record, so the user sees column 0 as the leaning and column 1 as
+   the interest value
+Both are mirrored here so that the two versions of the simulation give the same statistics.
+"""
+
+
+# Turns a networkx graph into a compressed list of neighbours. The neighbours of node i are
+# indices[indptr[i]:indptr[i+1]]
+def graph_to_adjacency(graph):
+    """
+    @param graph: networkx graph whose nodes are labelled 0 to n-1, or a scipy sparse adjacency matrix (like the ones
+    gen_connected_csr makes), which already is in this layout
+    @return: indptr and indices arrays (the same layout scipy uses for CSR matrices)
+    """
+    if scipy.sparse.issparse(graph):
+        graph = scipy.sparse.csr_matrix(graph)
+        return graph.indptr.astype(np.int64), graph.indices.astype(np.int64)
+    num_nodes = graph.number_of_nodes()
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    neighbours = []
+    for node in range(num_nodes):
+        node_neighbours = list(graph.adj[node])
+        indptr[node + 1] = indptr[node] + len(node_neighbours)
+        neighbours.extend(node_neighbours)
+    return indptr, np.array(neighbours, dtype=np.int64)
+
+
+# Turns a compressed list of neighbours back into a networkx graph, for drawing it or using the networkx algorithms.
+# networkx is only needed for this, so it's imported here
+def adjacency_to_graph(indptr, indices):
+    import networkx as nx
+    num_nodes = len(indptr) - 1
+    graph = nx.Graph()
+    graph.add_nodes_from(range(num_nodes))
+    owners = np.repeat(np.arange(num_nodes), np.diff(indptr))
+    graph.add_edges_from(zip(owners.tolist(), np.asarray(indices).tolist()))
+    return graph
+
+
+# Works out who gets notified of every post made this step, all in one go. Same as looping over the authors and calling
+# notify on each of their neighbours, but gathers the neighbour lists with a single index into the adjacency
+def propagate_posts(indptr, indices, posted, post_ids):
+    """
+    @param indptr, indices: compressed list of neighbours (see graph_to_adjacency)
+    @param posted: boolean array, True for every user that made a post this step
+    @param post_ids: ids of the new posts, one per user that posted, in order of user
+    @return: inbox_indptr and inbox_ids arrays in the same layout as the adjacency. The posts user i gets notified of
+    are inbox_ids[inbox_indptr[i]:inbox_indptr[i+1]], in order of author
+    """
+    authors = np.flatnonzero(posted)
+    counts = indptr[authors + 1] - indptr[authors]
+    num_edges = counts.sum()
+    # Position of every edge of every author within indices
+    offsets = np.arange(num_edges) - np.repeat(np.cumsum(counts) - counts, counts)
+    recipients = indices[np.repeat(indptr[authors], counts) + offsets]
+    ids = np.repeat(np.asarray(post_ids, dtype=np.int64), counts)
+    order = np.argsort(recipients, kind='stable')
+    inbox_indptr = np.zeros(len(posted) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(recipients, minlength=len(posted)), out=inbox_indptr[1:])
+    return inbox_indptr, ids[order]
+
+
+# Groups the entries of a flat list by their owner. Returns the order to visit the entries in, and for every entry in
+# that order, its position within its owner's list. Order inside an owner's list is preserved
+def _group_by_owner(owners):
+    order = np.argsort(owners, kind='stable')
+    sorted_owners = owners[order]
+    if len(owners) == 0:
+        return order, np.zeros(0, dtype=np.int64)
+    # Index of the first entry of every run of the same owner
+    starts = np.flatnonzero(np.r_[True, sorted_owners[1:] != sorted_owners[:-1]])
+    run_lengths = np.diff(np.r_[starts, len(owners)])
+    positions = np.arange(len(owners)) - np.repeat(starts, run_lengths)
+    return order, positions
+
+
+# How many posts a user with the given consumption gets in their feed when send_news only keeps the top few.
+# _read_feed reads int(consumption + N(0, 1)) posts, so a few extra covers all but the rarest draws
+def feed_top_k(consumption, slack=3):
+    return np.maximum(1, np.asarray(consumption).astype(np.int64) + slack)
+
+
+class Population:
+    def __init__(self, consumption, expected_engagement, activity, initial_opinion, begin_online=True, rng=None,
+                 top_k=False, similar_news=False, tolerance=0.3, feed_capacity=None, feed_horizon=None, history=None,
+                 streams=None, instruments=None, content_window=None, recommender=None, backend='numpy'):
+        """
+        Every argument except begin_online and rng is an array with one entry per user. See Person.__init__ for what
+        each stat means
+        @param consumption: integers indicating how many posts, on average, each user will consume
+        @param expected_engagement: floats in the range [0, 1], how engaging a post must be to keep the user online
+        @param activity: floats in the range [0, 1] indicating how frequently each user creates posts
+        @param initial_opinion: floats in the range [0, 1] indicating what each user initially believes
+        @param begin_online: whether users start online or not
+        @param rng: numpy Generator used for every random draw. A fresh one is made if None is given
+        @param top_k: if True, each step's feed only holds the feed_top_k(consumption) most engaging posts (see
+        send_news in social_media.py)
+        @param similar_news: if True, users are only recommended posts whose leaning is within tolerance of their
+        opinion (send_similar_news in social_media.py) instead of everything
+        @param tolerance: how far from a user's opinion recommended posts can be when similar_news is True
+        @param feed_capacity: most posts a feed can hold. When more come in, the oldest ones are thrown out (like a
+        Feed with the 'oldest' eviction policy). None means there's no limit
+        @param feed_horizon: how many steps a batch of recommendations stays in the feeds. Posts from older batches that
+        haven't been read yet are thrown out. None keeps them until they're read, like Person's Feed does. Readers get
+        through about consumption posts a step while a whole content window arrives, so without a horizon (or a
+        feed_capacity) almost every batch stays around, and memory grows as num_users x num_steps. With a horizon of
+        10, the statistics still agree with those of Person's unbounded Feed to within the run-to-run noise (see
+        test_same_statistics_as_objects)
+        @param history: PopulationHistory that everyone's opinion, online state, engagement and read posts get
+        recorded in as the population steps. None records nothing
+        @param streams: AgentStreams to draw every user's random numbers from, so that they only depend on the seed, the
+        step and the user (see agent_streams.py). If None, everything is drawn from rng in one go
+        @param instruments: Instruments that time the phases of every step and count what happened in them (see
+        instrumentation.py). None measures nothing
+        @param content_window: dictionary of retention settings for the content window (the arguments of PostStore). None
+        keeps the last 3 steps worth of posts, like social_media.py
+        @param recommender: BucketRecommender to recommend with, which ranks posts for everyone in an opinion bucket at
+        once instead of for each user's own opinion (see bucket_recommender.py). None recommends exactly
+        @param backend: 'numpy', or 'numba' to have each user's posts read and each batch ranked in compiled loops (see
+        kernels.py). Falls back to 'numpy' if numba isn't installed
+        """
+        self.num_users = len(initial_opinion)
+        self.consumption = np.asarray(consumption, dtype=np.int64)
+        self.exp_eng = np.asarray(expected_engagement, dtype=float)
+        self.activity = np.asarray(activity, dtype=float)
+        self.initialized_opinion = np.array(initial_opinion, dtype=float)
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.top_k = top_k
+        self.similar_news = similar_news
+        self.tolerance = tolerance
+        self.feed_capacity = feed_capacity
+        self.feed_horizon = feed_horizon
+        self.history = history
+        self.streams = streams
+        self.instruments = NULL_INSTRUMENTS if instruments is None else instruments
+        self.recommender = recommender
+        self.kernels = get_kernels(backend)
+        # Same as in Person: anything read after this many time steps is only remembered until the end of the cycle
+        self.num_remembered_times = 20
+        # How much content the site keeps around to recommend (see post_store.py)
+        self.content_window = {'num_stored_cycles': 3, **({} if content_window is None else content_window)}
+        self.num_stored_cycles = self.content_window['num_stored_cycles']
+        # Neighbour lists, set with link()
+        self.indptr = np.zeros(self.num_users + 1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int64)
+        self.reset(begin_online)
+
+    # Uniform numbers in [0, 1), one for each user in users, for the given phase of this step (see agent_streams.py)
+    def _random(self, phase, users):
+        if self.streams is None:
+            return self.rng.random(len(users))
+        return self.streams.random(self._current_step(), phase, users)
+
+    def _normal(self, phase, users, scale=1.0):
+        if self.streams is None:
+            return self.rng.normal(loc=0.0, scale=scale, size=len(users))
+        return self.streams.normal(self._current_step(), phase, users, scale=scale)
+
+    # Everyone is always on the same time step
+    def _current_step(self):
+        return int(self.time_step[0]) if self.num_users > 0 else 0
+
+    # Builds a Population out of the dictionary of people that gen_rand_ppl and friends return
+    @classmethod
+    def from_ppl_dict(cls, ppl_dict, rng=None, **kwargs):
+        people = [ppl_dict[i]['Person'] for i in range(len(ppl_dict))]
+        return cls([p.consumption for p in people], [p.exp_eng for p in people], [p.activity for p in people],
+                   [p.initialized_opinion for p in people], rng=rng, **kwargs)
+
+    # Copies the opinions of the population back into the Person objects (useful for poll_opinions and the plots)
+    def write_back(self, ppl_dict):
+        for i in range(self.num_users):
+            ppl_dict[i]['Person'].opinion = self.opinion[i]
+
+    # Uses the connections of a networkx graph (or a scipy sparse adjacency matrix) to decide who gets notified of whose
+    # posts
+    def link(self, graph):
+        if scipy.sparse.issparse(graph):
+            assert graph.shape == (self.num_users, self.num_users)
+        else:
+            assert graph.number_of_nodes() == self.num_users
+        self.indptr, self.indices = graph_to_adjacency(graph)
+
+    # Resets everyone to their original opinion, with an empty feed and no notifications (Person.reset for everybody)
+    def reset(self, is_online=True):
+        n = self.num_users
+        self.opinion = self.initialized_opinion.copy()
+        self.is_online = np.full(n, bool(is_online))
+        self.time_step = np.zeros(n, dtype=np.int64)
+        """
+        Person.belief_update_func takes the engagement weighted mean over its OpinionMemory, which starts out as 5
+        entries of the initial opinion with weight 1. Posts read during the first num_remembered_times steps are never
+        forgotten, so they're kept as a running total and norm. Posts read after that only count until the end of
+        the cycle
+        """
+        self.mem_total = 5 * self.opinion
+        self.mem_norm = np.full(n, 5.0)
+        # Notifications are kept as one flat list of post ids, along with who each one belongs to
+        self.notif_owner = np.zeros(0, dtype=np.int64)
+        self.notif_ids = np.zeros(0, dtype=np.int64)
+        """
+        Every step, each user gets the whole window of recent content appended to their feed, ranked by their opinion
+        at that time. Since everyone gets the same window, the feed is stored as the windows themselves (batches) plus
+        each user's opinion when the batch was sent. The actual ranking is only worked out once the user reaches that
+        batch in their feed. A batch is kept until every user has read (or skipped) past it, so it's feed_capacity or
+        feed_horizon that keeps the number of batches (and their num_users long opinion arrays) from growing every step
+        """
+        self.batches = {}
+        self.batch_opinions = {}
+        # How many posts of each batch ended up in each user's feed
+        self.batch_lens = {}
+        self.next_batch = 0
+        self.feed_batch = np.zeros(n, dtype=np.int64)
+        self.feed_offset = np.zeros(n, dtype=np.int64)
+        self.feed_len = np.zeros(n, dtype=np.int64)
+        self.all_content = PostStore(**self.content_window)
+        if self.history is not None:
+            self.history.reset()
+
+    def get_opinions(self):
+        return self.opinion.copy()
+
+    # Everything that changes as the population steps, as arrays (see checkpoint.py). The batches are stored one after
+    # the other, along with how many posts each one has
+    def get_state(self):
+        keys = sorted(self.batches)
+        return {'opinion': self.opinion.copy(), 'is_online': self.is_online.copy(), 'time_step': self.time_step.copy(),
+                'mem_total': self.mem_total.copy(), 'mem_norm': self.mem_norm.copy(),
+                'notif_owner': self.notif_owner.copy(), 'notif_ids': self.notif_ids.copy(),
+                'batch_keys': np.array(keys, dtype=np.int64),
+                'batch_sizes': np.array([len(self.batches[key]) for key in keys], dtype=np.int64),
+                'batches': np.concatenate([np.zeros([0, 3])] + [self.batches[key] for key in keys]),
+                'batch_opinions': np.array([self.batch_opinions[key] for key in keys],
+                                           dtype=float).reshape(len(keys), self.num_users),
+                'batch_lens': np.array([self.batch_lens[key] for key in keys],
+                                       dtype=np.int64).reshape(len(keys), self.num_users),
+                'next_batch': np.int64(self.next_batch), 'feed_batch': self.feed_batch.copy(),
+                'feed_offset': self.feed_offset.copy(), 'feed_len': self.feed_len.copy(),
+                'indptr': self.indptr.copy(), 'indices': self.indices.copy(),
+                'all_content': self.all_content.get_state(), 'rng': self.rng.bit_generator.state}
+
+    def set_state(self, state):
+        for name in ['opinion', 'is_online', 'time_step', 'mem_total', 'mem_norm', 'notif_owner', 'notif_ids',
+                     'feed_batch', 'feed_offset', 'feed_len', 'indptr', 'indices']:
+            setattr(self, name, np.array(state[name]))
+        self.batches = {}
+        self.batch_opinions = {}
+        self.batch_lens = {}
+        start = 0
+        for i, key in enumerate(state['batch_keys']):
+            self.batches[int(key)] = np.array(state['batches'][start:start + state['batch_sizes'][i]])
+            self.batch_opinions[int(key)] = np.array(state['batch_opinions'][i])
+            self.batch_lens[int(key)] = np.array(state['batch_lens'][i])
+            start += state['batch_sizes'][i]
+        self.next_batch = int(state['next_batch'])
+        self.all_content.set_state(state['all_content'])
+        self.rng.bit_generator.state = state['rng']
+
+    # Every online user decides whether or not to post (Person.make_post), and the posts are added to the content
+    # made this step. Returns the ids of the new posts and who made them, in node order
+    def make_posts(self):
+        n = self.num_users
+        posted = self.is_online & (self._random(PHASE_POST, np.arange(n)) < self.activity)
+        authors = np.flatnonzero(posted)
+        leaning = np.clip(self.opinion[authors] + self._normal(PHASE_POST_LEANING, authors, scale=0.05), 0, 1)
+        interest = self._random(PHASE_POST_INTEREST, authors)
+        # Post(leaning, interest).get_stripped_data() is [interest, leaning, id]. The store fills in the ids
+        rows = self.all_content.add_rows(np.column_stack([interest, leaning, np.zeros(len(authors))]), authors)
+        self.instruments.count('posts_made', len(authors))
+        return rows[:, ID_COL].astype(np.int64), authors
+
+    # Sends every new post to the friends of whoever wrote it
+    def notify(self, post_ids, authors):
+        posted = np.zeros(self.num_users, dtype=bool)
+        posted[authors] = True
+        inbox_indptr, inbox_ids = propagate_posts(self.indptr, self.indices, posted, post_ids)
+        self.instruments.count('notifications_sent', len(inbox_ids))
+        if len(inbox_ids) > 0:
+            owners = np.repeat(np.arange(self.num_users), np.diff(inbox_indptr))
+            self.notif_owner = np.concatenate([self.notif_owner, owners])
+            self.notif_ids = np.concatenate([self.notif_ids, inbox_ids])
+
+    # Puts the freshest content in the content window and adds the whole window to everyone's feed (send_news)
+    def send_news(self):
+        self.all_content.end_step()
+        window = np.concatenate(self.all_content.get_content())
+        self.instruments.gauge('content_window', len(window))
+        if len(window) == 0:
+            return
+        batch = self.next_batch
+        self.next_batch += 1
+        self.batches[batch] = window
+        if self.recommender is None:
+            opinions = self.opinion.copy()
+        else:
+            # The batch is ranked for the middle of everyone's bucket instead of their own opinion, so _pop_feed only
+            # has to score it once per bucket
+            opinions = self.recommender.quantize(self.opinion)
+            self.recommender.measure(self._current_step(), window, self.opinion,
+                                     self.tolerance if self.similar_news else None)
+        self.batch_opinions[batch] = opinions
+        if self.similar_news:
+            # The merged view of the window is sorted by leaning, so each user's window is a slice found with two
+            # searchsorted calls
+            leanings = self.all_content.get_view()[:, LEAN_COL]
+            batch_len = (np.searchsorted(leanings, opinions + self.tolerance) -
+                         np.searchsorted(leanings, opinions - self.tolerance))
+        else:
+            batch_len = np.full(self.num_users, len(window))
+        if self.top_k:
+            # Everyone's feed is replaced by the best few posts of this batch
+            batch_len = np.minimum(feed_top_k(self.consumption), batch_len)
+            self.batch_lens[batch] = batch_len
+            self.feed_batch[:] = batch
+            self.feed_offset[:] = 0
+            self.feed_len = batch_len.copy()
+            return
+        self.batch_lens[batch] = batch_len
+        # Users whose feed had run dry start reading from this batch
+        self.feed_batch[self.feed_len == 0] = batch
+        self.feed_offset[self.feed_len == 0] = 0
+        self.feed_len += batch_len
+        if self.feed_capacity is not None:
+            over = np.flatnonzero(self.feed_len > self.feed_capacity)
+            self._skip_feed(over, self.feed_len[over] - self.feed_capacity)
+        if self.feed_horizon is not None:
+            self._forget_batches(batch - self.feed_horizon + 1)
+
+    # Throws the posts of every batch before first_kept out of everyone's feed, and forgets about those batches
+    def _forget_batches(self, first_kept):
+        stale = np.flatnonzero(self.feed_batch < first_kept)
+        if len(stale) == 0:
+            return
+        # Whatever is left of each stale reader's feed from before first_kept
+        remaining = -self.feed_offset[stale]
+        for batch in range(int(self.feed_batch[stale].min()), first_kept):
+            if batch in self.batch_lens:
+                remaining += np.where(self.feed_batch[stale] <= batch, self.batch_lens[batch][stale], 0)
+        self._skip_feed(stale, remaining)
+        # Readers whose part of the old batches was empty never got moved along by _skip_feed
+        still_stale = stale[self.feed_batch[stale] < first_kept]
+        self.feed_batch[still_stale] = first_kept
+        self.feed_offset[still_stale] = 0
+        self._drop_read_batches()
+
+    # Forgets about batches nobody has left to read
+    def _drop_read_batches(self):
+        if len(self.batches) > 0:
+            oldest = self.feed_batch.min()
+            for batch in [b for b in self.batches if b < oldest]:
+                del self.batches[batch]
+                del self.batch_opinions[batch]
+                del self.batch_lens[batch]
+
+    # Throws out the oldest num_posts posts in the feed of each user in users, without reading them
+    def _skip_feed(self, users, num_posts):
+        need = num_posts.copy()
+        while np.any(need > 0):
+            waiting = np.flatnonzero(need > 0)
+            for batch in np.unique(self.feed_batch[users[waiting]]):
+                group = waiting[self.feed_batch[users[waiting]] == batch]
+                group_users = users[group]
+                batch_len = self.batch_lens[batch][group_users]
+                num_from_batch = np.minimum(need[group], batch_len - self.feed_offset[group_users])
+                need[group] -= num_from_batch
+                self.feed_len[group_users] -= num_from_batch
+                self.feed_offset[group_users] += num_from_batch
+                finished = group_users[self.feed_offset[group_users] == batch_len]
+                self.feed_batch[finished] += 1
+                self.feed_offset[finished] = 0
+
+    # Works out the next num_posts posts in the feed of each user in users and takes them out of the feed. Returns an
+    # array of post rows with shape (len(users), max(num_posts), 3), padded with nans
+    def _pop_feed(self, users, num_posts):
+        max_posts = num_posts.max() if len(users) > 0 else 0
+        popped = np.full([len(users), max_posts, 3], np.nan)
+        num_taken = np.zeros(len(users), dtype=np.int64)
+        need = num_posts.copy()
+        while np.any(need > 0):
+            waiting = np.flatnonzero(need > 0)
+            for batch in np.unique(self.feed_batch[users[waiting]]):
+                group = waiting[self.feed_batch[users[waiting]] == batch]
+                group_users = users[group]
+                window = self.batches[batch]
+                # Ranking the batch the same way send_news sorted it (highest predicted engagement first). Users with
+                # the same opinion (everyone in a bucket, with a recommender) get the same ranking, so it's only worked
+                # out once for each opinion
+                opinions, inverse = np.unique(self.batch_opinions[batch][group_users], return_inverse=True)
+                batch_len = self.batch_lens[batch][group_users]
+                offsets = self.feed_offset[group_users]
+                num_from_batch = np.minimum(need[group], batch_len - offsets)
+                # Only the part of the ranking that's about to be read needs to be sorted. Posts outside of a user's
+                # window (with similar news) were never sent to them, so they go to the back of the ranking
+                ranking = self.kernels.rank_posts(window[:, INTEREST_COL], window[:, LEAN_COL], window[:, LEAN_COL],
+                                                     opinions, (offsets + num_from_batch).max(),
+                                                     self.tolerance if self.similar_news else None)
+                ranking = ranking[inverse.reshape(-1)]
+                self.instruments.count('posts_scored', len(opinions) * len(window))
+                for j in range(num_from_batch.max(initial=0)):
+                    reading = j < num_from_batch
+                    rows = window[ranking[reading, offsets[reading] + j]]
+                    popped[group[reading], num_taken[group[reading]] + j] = rows
+                num_taken[group] += num_from_batch
+                self.instruments.count('posts_materialized', num_from_batch.sum())
+                need[group] -= num_from_batch
+                self.feed_len[group_users] -= num_from_batch
+                self.feed_offset[group_users] += num_from_batch
+                # Moving on to the next batch for users that finished this one
+                finished = group_users[self.feed_offset[group_users] == batch_len]
+                self.feed_batch[finished] += 1
+                self.feed_offset[finished] = 0
+        self._drop_read_batches()
+        return popped
+
+    # Has each user in users read their posts one after the other (Person._read_feed/_read_notifications). leanings
+    # and interests have shape (len(users), num_posts) and are nan where the user has no post to read
+    def _read_posts(self, users, leanings, interests, cyc_total, cyc_norm):
+        # Whether or not what's read this step will be remembered after the cycle is over
+        remembered = self.time_step[users] <= self.num_remembered_times
+        return self.kernels.read_posts(users, leanings, interests, self.opinion, self.mem_total, self.mem_norm, remembered,
+                          cyc_total, cyc_norm)
+
+    # Everyone goes through their normal routine on the site (Person.cycle). If this step is sampled by the history,
+    # returns the arguments for History.record (step() records them, so that it's timed apart from the reading).
+    # Otherwise returns None
+    def cycle(self):
+        n = self.num_users
+        online = np.flatnonzero(self.is_online)
+        offline = np.flatnonzero(~self.is_online)
+        cyc_total = np.zeros(len(online))
+        cyc_norm = np.zeros(len(online))
+        # Reading all of the notifications, oldest first. Online users never clear their notifications
+        owner_idx = np.full(n, -1)
+        owner_idx[online] = np.arange(len(online))
+        owner = owner_idx[self.notif_owner]
+        is_mine = owner >= 0
+        order, positions = _group_by_owner(owner[is_mine])
+        mine = self.all_content.get_records(self.notif_ids[is_mine][order])
+        num_cols = positions.max() + 1 if len(positions) > 0 else 0
+        leanings = np.full([len(online), num_cols], np.nan)
+        interests = np.full([len(online), num_cols], np.nan)
+        leanings[owner[is_mine][order], positions] = mine['leaning']
+        interests[owner[is_mine][order], positions] = mine['interest']
+        tot_interest = self._read_posts(online, leanings, interests, cyc_total, cyc_norm)
+        recording = self.history is not None and n > 0 and self.history.samples(int(self.time_step[0]))
+        if recording:
+            read_users = [online[owner[is_mine][order]]]
+            read_ids = [self.notif_ids[is_mine][order]]
+
+        # Reading the first few posts in the feed (only if there are enough of them)
+        num_to_read = np.maximum(1, (self.consumption[online] + self._normal(PHASE_READ, online)).astype(np.int64))
+        has_enough = num_to_read <= self.feed_len[online]
+        readers = online[has_enough]
+        popped = self._pop_feed(readers, num_to_read[has_enough])
+        leanings = np.full([len(online), popped.shape[1]], np.nan)
+        interests = np.full([len(online), popped.shape[1]], np.nan)
+        # Person._read_feed swaps the columns, so the leaning is in the interest column and vice versa
+        leanings[has_enough] = popped[:, :, INTEREST_COL]
+        interests[has_enough] = popped[:, :, LEAN_COL]
+        tot_interest += self._read_posts(online, leanings, interests, cyc_total, cyc_norm)
+        if recording:
+            was_read = ~np.isnan(popped[:, :, ID_COL])
+            read_users.append(np.repeat(readers, was_read.sum(axis=1)))
+            read_ids.append(popped[:, :, ID_COL][was_read].astype(np.int64))
+            engagement = np.zeros(n)
+            engagement[online] = tot_interest
+            was_online = np.zeros(n, dtype=bool)
+            was_online[online] = True
+
+        # Person._stay_online
+        prob = np.pi / 2 * np.arctan(tot_interest - self.consumption[online] * self.exp_eng[online] + np.tan(np.pi / 4))
+        prob = np.maximum(prob, 0.05)
+        self.is_online[online] = self._random(PHASE_STAY_ONLINE, online) <= prob
+
+        # Offline users check their phones 10% of the time, and go online if they see an interesting enough notification
+        has_notifs = np.zeros(n, dtype=bool)
+        has_notifs[self.notif_owner] = True
+        checking = offline[has_notifs[offline] & (self._random(PHASE_CHECK_PHONE, offline) < 0.1)]
+        if len(checking) > 0:
+            is_checking = np.zeros(n, dtype=bool)
+            is_checking[checking] = True
+            checked = is_checking[self.notif_owner]
+            # Person._check_phone looks at the interest value in the post's record
+            notif_interest = self.all_content.get_records(self.notif_ids)['interest']
+            interesting = checked & (notif_interest > self.exp_eng[self.notif_owner])
+            self.is_online[self.notif_owner[interesting]] = True
+            self.notif_owner = self.notif_owner[~checked]
+            self.notif_ids = self.notif_ids[~checked]
+        record = None
+        if recording:
+            record = (int(self.time_step[0]), self.opinion, was_online, engagement, np.concatenate(read_users),
+                      np.concatenate(read_ids))
+        self.time_step += 1
+        return record
+
+    # Runs one time step of the algorithm for the whole population. Returns how many people were online
+    def step(self):
+        instruments = self.instruments
+        instruments.start_step(self._current_step())
+        # Feeds hold the rows of their batches, so only notifications need the records of posts outside the window
+        if self.all_content.wants_to_forget():
+            self.all_content.forget_records(self.notif_ids)
+        with instruments.phase('post'):
+            post_ids, authors = self.make_posts()
+        with instruments.phase('notify'):
+            self.notify(post_ids, authors)
+        num_online = int(np.count_nonzero(self.is_online))
+        with instruments.phase('recommend'):
+            self.send_news()
+        with instruments.phase('read'):
+            record = self.cycle()
+        if record is not None:
+            with instruments.phase('history'):
+                self.history.record(*record)
+        if instruments.active:
+            instruments.gauge('online', num_online)
+            instruments.gauge('feed_length', int(self.feed_len.sum()))
+            instruments.gauge('max_feed_length', int(self.feed_len.max(initial=0)))
+            instruments.gauge('notifications_pending', len(self.notif_ids))
+        instruments.end_step()
+        return num_online
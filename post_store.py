@@ -0,0 +1,353 @@
+import numpy as np
+
+"""
+This file holds PostStore, which keeps track of all the content that the social media site can recommend. It replaces
+the ring of arrays (with -1 as a placeholder for cycles that haven't happened yet) and add_available_post() that used to
+be in social_media.py. add_available_post() copied the whole array every time a post was made, which made every time step
+quadratic in the number of posts. Here, posts made during a step are just appended to a list, and they get sorted by
+leaning all at once when the step is over.
+
+Every post the store has seen gets a compact record (POST_DTYPE) in one shared table, looked up by id with
+get_records(). Feeds and notifications only hold these ids, so no Post objects have to be kept around (or rebuilt) once
+a post has been made. For recommending, the posts of each stored cycle are also kept as rows of [leaning, interest, id],
+the layout that Post.get_stripped_data() produces.
+
+The store can't tell on its own which ids feeds and notifications still hold, so the records table only shrinks when
+whoever owns those calls forget_records() with them. Records of posts that are neither in the window nor in that list
+are dropped. wants_to_forget() says when it's worth it (whenever the table has doubled since the last time), so the
+work of gathering the ids still in use is spread out over the posts that have been made since. Until the first records
+are dropped, a post's id is also its index in the table, and as long as the ids that are left are one contiguous run,
+they're looked up with an offset. Otherwise they're found with a binary search. In the simulations, users that stay
+online never clear their notifications (see Person.cycle), so a post's record is only dropped once everyone that was
+notified of it has checked their phone, and it has left the window and every feed
+
+How much content is kept around (the content window) is up to the retention settings:
+ - num_stored_cycles: posts older than this many steps are dropped. This is the only setting the simulation used to have
+ - post_budget: once there are more posts than this, the oldest ones are dropped. Within the oldest step that is still
+ kept, the least interesting posts go first (interest being FEED_INTEREST_COL, see below)
+ - decay: a weighting function of (age, interest), like the ones OpinionMemory takes (ebbinghaus_weighting). A post is
+ dropped once its interest times its weight falls below min_interest
+ - max_bytes: cap on the memory the window (the cycle arrays and the merged view) takes up. It works like a post budget.
+ It only covers the window, not the whole store: the records table takes another POST_DTYPE.itemsize bytes for every
+ post that hasn't been forgotten (see forget_records), so the store's memory still grows with the total number of posts
+ made for as long as feeds or notifications hold on to them
+These can be combined, and every post has to pass all of them to stay. With a budget or a decay, num_stored_cycles can
+be made much bigger than 3, since it's no longer the only thing keeping the window small.
+
+Besides the per-cycle arrays, the store keeps one merged array of everything in the window, sorted by leaning (newest
+first where leanings are equal). It's kept up to date as steps come and go: the new step is merged in with one
+searchsorted and the dropped posts are masked out, instead of sorting the whole window again every step. The records
+table is not part of the window, since feeds and notifications can hold ids of posts that have left the window long ago.
+"""
+
+# Column indices of the [leaning, interest, id] rows
+LEAN_COL = 0
+INTEREST_COL = 1
+ID_COL = 2
+# Person._read_feed swaps the first two columns, so the interest value that readers of a feed see (and that the
+# recommenders multiply the bias factor by) is column 0, and the author's leaning is column 1. Retention ranks posts on
+# this column, so that keeping the most interesting posts doesn't end up keeping one side of the opinion spectrum
+FEED_INTEREST_COL = 0
+
+# What's stored about every post. author is the node of whoever made it (-1 if unknown)
+POST_DTYPE = np.dtype([('leaning', np.float64), ('interest', np.float64), ('id', np.int64), ('author', np.int64)])
+
+# Memory every post in the window takes up: its row in its cycle's array, its row in the merged view, and the step it
+# arrived in
+WINDOW_BYTES_PER_POST = 2 * 3 * 8 + 8
+
+
+class PostStore:
+    def __init__(self, num_stored_cycles=3, post_budget=None, decay=None, min_interest=0.1, max_bytes=None):
+        """
+        @param num_stored_cycles: how many time steps worth of posts are kept around. Anything older is forgotten
+        @param post_budget: most posts the window holds. None has no limit other than num_stored_cycles
+        @param decay: function of (age in steps, interest) that a post's interest is multiplied by as it gets older, like
+        ebbinghaus_weighting() in person.py. None doesn't decay anything
+        @param min_interest: decayed interest below which a post is dropped (only used with decay)
+        @param max_bytes: most memory (in bytes) the window can take up, see WINDOW_BYTES_PER_POST. This doesn't cap the
+        store as a whole: the records table isn't part of the window and still grows with the number of posts made (see
+        forget_records)
+        """
+        self.num_stored_cycles = num_stored_cycles
+        self.post_budget = post_budget
+        self.decay = decay
+        self.min_interest = min_interest
+        self.max_bytes = max_bytes
+        # One leaning-sorted array per stored cycle. None means that cycle hasn't happened yet
+        self.cycles = [None] * num_stored_cycles
+        # Index of the cycle that was stored last
+        self.store_idx = -1
+        # How many steps have been stored, and which step each cycle was stored in
+        self.num_steps = 0
+        self.cycle_steps = np.full(num_stored_cycles, -1, dtype=np.int64)
+        # Everything in the window, sorted by leaning, along with the step each row was stored in
+        self._merged = np.zeros([0, 3])
+        self._merged_steps = np.zeros(0, dtype=np.int64)
+        # Posts made during the current step, waiting to be sorted in end_step()
+        self._pending_rows = []
+        self._pending_chunks = []
+        # Records of the posts that haven't been forgotten, in order of id. Only the first num_records entries are used,
+        # the rest is room to grow into
+        self._records = np.zeros(64, dtype=POST_DTYPE)
+        self.num_records = 0
+        # How many ids have been handed out (the id of the next post)
+        self.num_posts = 0
+        # If the records that are left are the ids [_first_id, num_posts), the record of a post is at its id - _first_id
+        self._first_id = 0
+        self._contiguous = True
+        # First id handed out during the current step, and how many records were left after the last forget_records
+        self._step_first_id = 0
+        self._num_kept = 0
+
+    # The records of every post that hasn't been forgotten, in order of id. Use get_records to look posts up by id
+    @property
+    def records(self):
+        return self._records[:self.num_records]
+
+    # The records of the given post ids (a single id gives back a single record). The ids can't have been forgotten
+    def get_records(self, ids):
+        if not isinstance(ids, (int, np.integer)):
+            ids = np.asarray(ids, dtype=np.int64)
+        if self._contiguous:
+            return self._records[ids - self._first_id]
+        return self._records[np.searchsorted(self.records['id'], ids)]
+
+    # Makes room for count more records (doubling the table when it's full) and returns their ids
+    def _new_ids(self, count):
+        if self.num_records + count > len(self._records):
+            new_records = np.zeros(max(2 * len(self._records), self.num_records + count), dtype=POST_DTYPE)
+            new_records[:self.num_records] = self.records
+            self._records = new_records
+        ids = np.arange(self.num_posts, self.num_posts + count)
+        self.num_posts += count
+        self.num_records += count
+        return ids
+
+    # Whether enough posts have been made since the last forget_records for it to be worth calling again
+    def wants_to_forget(self):
+        return self.num_records >= max(2 * self._num_kept, 1024)
+
+    # Drops the records of every post that isn't in the window, wasn't made during the current step and isn't in
+    # used_ids. Those can't be looked up anymore
+    def forget_records(self, used_ids):
+        """
+        @param used_ids: ids that feeds, notifications or anything else still hold
+        """
+        ids = self.records['id']
+        window_ids = [array[:, ID_COL].astype(np.int64) for array in self.get_content()]
+        keep = np.isin(ids, np.concatenate([np.asarray(used_ids, dtype=np.int64).reshape(-1)] + window_ids))
+        keep |= ids >= self._step_first_id
+        self._set_records(self.records[keep])
+
+    # Replaces the records table with the given records (in order of id), and works out how to look them up
+    def _set_records(self, records):
+        self._records = np.array(records, dtype=POST_DTYPE)
+        self.num_records = len(self._records)
+        self._num_kept = self.num_records
+        ids = self._records['id']
+        self._first_id = int(ids[0]) if len(ids) > 0 else self.num_posts
+        self._contiguous = len(ids) == 0 or (ids[-1] - ids[0] + 1 == len(ids) and ids[-1] == self.num_posts - 1)
+
+    # Adds a single post to the content made during this step. Returns the id the store gave it
+    def add_post(self, post, author=-1):
+        """
+        @type post: Post
+        @param author: node of the person who made the post
+        """
+        post_id = int(self._new_ids(1)[0])
+        self._records[post_id] = (post.get_leaning(), post.get_interest(), post_id, author)
+        self._pending_rows.append([post.get_leaning(), post.get_interest(), post_id])
+        return post_id
+
+    # Adds a whole array of [leaning, interest, id] rows to the content made during this step. The id column is
+    # ignored, and the rows are returned with the ids the store gave them
+    def add_rows(self, rows, authors=None):
+        self._flush_rows()
+        rows = np.array(rows, dtype=float).reshape(-1, 3)
+        ids = self._new_ids(len(rows))
+        rows[:, ID_COL] = ids
+        # The new ids are consecutive, so this is a view into the table
+        records = self.records[self.num_records - len(rows):]
+        records['leaning'] = rows[:, LEAN_COL]
+        records['interest'] = rows[:, INTEREST_COL]
+        records['id'] = ids
+        records['author'] = -1 if authors is None else authors
+        self._pending_chunks.append(rows)
+        return rows
+
+    def _flush_rows(self):
+        if len(self._pending_rows) > 0:
+            self._pending_chunks.append(np.array(self._pending_rows, dtype=float))
+            self._pending_rows = []
+
+    # Sorts the content made during this step by leaning and stores it in place of the oldest cycle. Returns the newly
+    # stored array
+    def end_step(self):
+        self._flush_rows()
+        if len(self._pending_chunks) > 0:
+            new_content = np.concatenate(self._pending_chunks)
+        else:
+            new_content = np.ones([0, 3])
+        self._pending_chunks = []
+        """
+        add_available_post() put each post before any others with the same leaning, so posts with equal leanings end up
+        newest first. Sorting on the leaning and then the reversed order of insertion keeps that
+        """
+        order = np.lexsort((-np.arange(len(new_content)), new_content[:, LEAN_COL]))
+        new_content = new_content[order]
+        self.store_idx += 1
+        if self.store_idx >= self.num_stored_cycles:
+            self.store_idx = 0
+        self.cycles[self.store_idx] = new_content
+        self.cycle_steps[self.store_idx] = self.num_steps
+        self.num_steps += 1
+        self._step_first_id = self.num_posts
+        dropped_ids = self._apply_retention()
+        self._update_view(new_content, dropped_ids)
+        return self.cycles[self.store_idx]
+
+    # Most posts the window can hold under post_budget and max_bytes (None if neither is set)
+    def _max_posts(self):
+        limits = []
+        if self.post_budget is not None:
+            limits.append(self.post_budget)
+        if self.max_bytes is not None:
+            limits.append(self.max_bytes // WINDOW_BYTES_PER_POST)
+        return min(limits) if len(limits) > 0 else None
+
+    # How many steps ago each cycle was stored (0 for the one that was just stored)
+    def _ages(self):
+        return self.num_steps - 1 - self.cycle_steps
+
+    # Drops the posts that decay or the budget say have to go from the cycle arrays. The ring itself takes care of
+    # num_stored_cycles. Returns the ids of the dropped posts
+    def _apply_retention(self):
+        dropped = []
+        if self.decay is not None:
+            ages = self._ages()
+            for i, array in enumerate(self.cycles):
+                if array is None or len(array) == 0:
+                    continue
+                keep = self._decayed(array, ages[i]) >= self.min_interest
+                if not keep.all():
+                    dropped.append(array[~keep, ID_COL])
+                    self.cycles[i] = array[keep]
+        max_posts = self._max_posts()
+        if max_posts is not None:
+            excess = len(self) - max_posts
+            # Oldest first
+            for i in np.argsort(-self._ages(), kind='stable'):
+                array = self.cycles[i]
+                if excess <= 0:
+                    break
+                if array is None or len(array) == 0:
+                    continue
+                if len(array) <= excess:
+                    dropped.append(array[:, ID_COL])
+                    self.cycles[i] = array[:0]
+                    excess -= len(array)
+                else:
+                    # Only part of this step has to go, so the least interesting posts do. The rest stay in leaning order
+                    keep = np.ones(len(array), dtype=bool)
+                    keep[np.argsort(array[:, FEED_INTEREST_COL], kind='stable')[:excess]] = False
+                    dropped.append(array[~keep, ID_COL])
+                    self.cycles[i] = array[keep]
+                    excess = 0
+        return np.concatenate(dropped) if len(dropped) > 0 else np.zeros(0)
+
+    def _decayed(self, rows, ages):
+        return rows[:, FEED_INTEREST_COL] * self.decay(ages, rows[:, FEED_INTEREST_COL])
+
+    # Brings the merged view up to date: masks out whatever left the window and merges the new (sorted) content in
+    def _update_view(self, new_content, dropped_ids):
+        oldest_kept = self.num_steps - self.num_stored_cycles
+        keep = self._merged_steps >= oldest_kept
+        if len(dropped_ids) > 0:
+            keep &= ~np.isin(self._merged[:, ID_COL], dropped_ids)
+        merged = self._merged[keep]
+        merged_steps = self._merged_steps[keep]
+        # The new content may have lost some posts to retention already
+        if len(dropped_ids) > 0:
+            new_content = new_content[~np.isin(new_content[:, ID_COL], dropped_ids)]
+        # side='left' puts new posts before older ones with the same leaning, like end_step does within a step
+        positions = np.searchsorted(merged[:, LEAN_COL], new_content[:, LEAN_COL], side='left')
+        self._merged = np.insert(merged, positions, new_content, axis=0)
+        self._merged_steps = np.insert(merged_steps, positions, self.num_steps - 1)
+
+    # Rebuilds the merged view from scratch out of the cycle arrays
+    def _rebuild_view(self):
+        content = [array for array in self.cycles if array is not None]
+        steps = [np.full(len(array), step) for array, step in zip(self.cycles, self.cycle_steps) if array is not None]
+        merged = np.concatenate([np.zeros([0, 3])] + content)
+        merged_steps = np.concatenate([np.zeros(0, dtype=np.int64)] + steps).astype(np.int64)
+        # Each cycle is already sorted, so a stable sort on (leaning, newest step first) only has to break the ties
+        order = np.lexsort((-merged_steps, merged[:, LEAN_COL]))
+        self._merged = merged[order]
+        self._merged_steps = merged_steps[order]
+
+    # Everything in the window as one array sorted by leaning. It's the store's own array, so it shouldn't be changed
+    def get_view(self):
+        return self._merged
+
+    # Same as get_view, but only the posts with a leaning in [low, high)
+    def get_view_range(self, low, high):
+        start, end = np.searchsorted(self._merged[:, LEAN_COL], [low, high])
+        return self._merged[start:end]
+
+    # Memory the window takes up right now, in bytes (not counting the records table)
+    def window_nbytes(self):
+        return (sum(array.nbytes for array in self.cycles if array is not None) + self._merged.nbytes +
+                self._merged_steps.nbytes)
+
+    # All the stored arrays (each one sorted by leaning), in the order of the ring, skipping cycles that haven't
+    # happened yet
+    def get_content(self):
+        return [array for array in self.cycles if array is not None]
+
+    # Same as get_content, but only the posts with a leaning in [low, high). Each array is a view of the stored one
+    def get_range(self, low, high):
+        content = []
+        for array in self.get_content():
+            start, end = np.searchsorted(array[:, LEAN_COL], [low, high])
+            content.append(array[start:end])
+        return content
+
+    # How many posts each stored cycle holds (0 for ones that haven't happened yet)
+    def cycle_lengths(self):
+        return [0 if array is None else len(array) for array in self.cycles]
+
+    # Total number of posts that can be recommended
+    def __len__(self):
+        return sum(self.cycle_lengths())
+
+    # Everything needed to carry on from where the store is now, as arrays (see checkpoint.py). Only works between steps
+    def get_state(self):
+        self._flush_rows()
+        assert len(self._pending_chunks) == 0, "can't save a PostStore in the middle of a step"
+        lengths = np.array([-1 if array is None else len(array) for array in self.cycles], dtype=np.int64)
+        content = np.concatenate([np.zeros([0, 3])] + self.get_content())
+        return {'cycle_lengths': lengths, 'content': content, 'store_idx': np.int64(self.store_idx),
+                'num_steps': np.int64(self.num_steps), 'cycle_steps': self.cycle_steps.copy(),
+                'records': self.records.copy(), 'num_posts': np.int64(self.num_posts)}
+
+    def set_state(self, state):
+        self.num_stored_cycles = len(state['cycle_lengths'])
+        self.cycles = []
+        start = 0
+        for length in state['cycle_lengths']:
+            if length < 0:
+                self.cycles.append(None)
+            else:
+                self.cycles.append(np.array(state['content'][start:start + length]))
+                start += length
+        self.store_idx = int(state['store_idx'])
+        self.num_steps = int(state['num_steps'])
+        self.cycle_steps = np.array(state['cycle_steps'], dtype=np.int64)
+        self._rebuild_view()
+        self._pending_rows = []
+        self._pending_chunks = []
+        # Checkpoints from before records could be forgotten hold every record there was
+        self.num_posts = int(state.get('num_posts', len(state['records'])))
+        self._step_first_id = self.num_posts
+        self._set_records(state['records'])
@@ -1,11 +1,16 @@
+import os
 import time
 import numpy as np
-import networkx as nx
-import matplotlib
-import matplotlib.pyplot as plt
-import netgraph
-from networkx_viewer import Viewer
-from person import Person, Post
+from person import Person, Post, how_engaging_batch, use_bias_table
+from population import Population, feed_top_k
+from kernels import rank_top_k
+from post_store import PostStore, ID_COL
+from mc_runner import MCRunner
+from trajectory import TrajectoryWriter
+from history import PopulationHistory
+from instrumentation import Instruments, NULL_INSTRUMENTS
+from bucket_recommender import BucketRecommender
+from checkpoint import Checkpointer, load_checkpoint, object_sim_state, restore_object_sim
 from graph_funcs import gen_rand_ppl, gen_polar_rand_ppl, gen_biased_rand_ppl, link_ppl_rand_graph, draw_bias_graph
 
 
@@ -32,12 +37,9 @@ def poll_opinions(ppl_dict, show_hist=False):
     for element in ppl_dict.items():
         opinion_poll.append(element[1]['Person'].get_opinion())
     if show_hist:
-        fig, axs = plt.subplots(1)
-        # We can set the number of bins with the `bins` kwarg
-        axs.hist(opinion_poll, bins=20, density=True)
-        lin = np.linspace(0, 1, 100)
-        axs.plot(lin, gaussian(lin))
-        plt.show()
+        # Only loading matplotlib once something gets plotted
+        from plotting import show_opinion_hist
+        show_opinion_hist(opinion_poll, gaussian)
     return opinion_poll
 
 
@@ -58,126 +60,248 @@ def find_post_with_attr(list_posts, des_interest, des_leaning):
     return closest_post
 
 
-def add_available_post(array, post):
+def send_similar_news(user, content, top_k=False, tolerance=0.3):
     """
-    This function takes in a post, and stores the stripped down data (leaning, interest, and id) in a numpy array. Sorts the
-    posts by their leaning for quick access by the social media site
-    @param array: numpy n by 3 array of doubles
-    @param post: post to be stored in the array
-    @return: array with the post appended
+    Only recommends posts whose leaning is within tolerance of the user's opinion. See send_similar_news_batch
+    @type content: PostStore
+    @param content: all the available content that has been generated in the last few time steps
+    @type user: Person whose feed we will populate with new posts
+    @param top_k: same as in send_news
+    @param tolerance: how far a post's leaning can be from the user's opinion for it to be recommended
     """
-    if len(array) == 0:
-        return np.array([post.get_stripped_data()])
-    idx = np.searchsorted(array[:, 0], post.get_leaning())
-    # print(f"array started out as \n{np.around(array, 2)}\n want to add post with {np.round(post.get_leaning(), 2)} leaning"
-    #       f" to index {idx}")
-    if idx == 0:
-        return np.concatenate(([post.get_stripped_data()], array))
-    elif idx == len(array):
-        return np.concatenate((array, [post.get_stripped_data()]))
-
-    # print(f"post is {post}, array is {array} index is {idx}, get_stripped_data returns {post.get_stripped_data()}")
-    # print(f"array[:idx] is {array[:idx]}, and array[idx:] is {array[idx:]}")
-    return np.concatenate((array[:idx], [post.get_stripped_data()], array[idx:]))
-
-
-def send_similar_news(user, content):
+    send_similar_news_batch([user], content, top_k=top_k, tolerance=tolerance)
+
+
+def send_similar_news_batch(users, content, top_k=False, tolerance=0.3, group_width=0.25, max_entries=2 ** 22):
     """
-    @param content: all the available content that has been generated in the last time step, stored as a list of
-    numpy arrays (there's probably a more efficient way to do that, but I'm not sure how)
-    @type user: Person whose feed we will populate with new posts
+    basic idea:
+    We're going to check all posts that are within tolerance of each user's opinion, use the batched version of the
+    static method in Person class to calculate how engaging they will be, rank that, and then send it to the user's
+    feed. Since every content array is sorted by leaning, the posts in [opinion - tolerance, opinion + tolerance) are one
+    contiguous slice found with a pair of searchsorted calls.
+    Users with similar opinions (within group_width * tolerance of each other) are handled together: their windows are
+    merged into one slice per array, the whole group is scored in one call, and posts outside each user's own window are
+    masked out
+    @type content: PostStore
+    @param content: all the available content that has been generated in the last few time steps
+    @param users: list of Person whose feeds we will populate with new posts
+    @param top_k: same as in send_news
+    @param tolerance: how far a post's leaning can be from the user's opinion for it to be recommended
+    @param group_width: width of the opinion groups, as a fraction of tolerance. Wider groups mean fewer, larger queries
+    @param max_entries: most (post, user) pairs to score at once. Groups that would go over are split up
+    @return: how many (post, user) pairs were scored
     """
-    tolerance = 0.3
-    opinion = user.get_opinion()
-    output = []
-    for array in content:
-        # Skipping over portions of the array which aren't "initialized"
-        if isinstance(array, int):
+    arrays = content.get_content()
+    if len(arrays) == 0 or len(users) == 0:
+        return 0
+    num_scored = 0
+    opinions = np.array([user.get_opinion() for user in users], dtype=float)
+    groups = np.floor(opinions / (tolerance * group_width)).astype(np.int64)
+    order = np.argsort(opinions, kind='stable')
+    boundaries = np.flatnonzero(np.diff(groups[order])) + 1
+    for group in np.split(order, boundaries):
+        low = opinions[group].min() - tolerance
+        high = opinions[group].max() + tolerance
+        # The part of every content array that any user in the group could be recommended
+        candidates = np.concatenate(content.get_range(low, high))
+        if len(candidates) == 0:
             continue
-        """
-        basic idea:
-        We're going to check all posts that are within 0.15 leaning of the user's opinion. Then we're going to use the
-        static method in Person class to calculate how engaging it will be, rank that, and then send it to the user's
-        feed
-        """
-        # print(f"array is \n{array}\nportion that we're interested in is\n{array[:, 0]}")
-        # This is the index that a post with the perfect leaning would have. It's the beginning of our search
-        opinion_idx = np.searchsorted(array[:, 0], opinion)
-        """
-        Checking the posts that have more of a positive leaning
-        """
-        if opinion_idx < len(array):
-            # Initializing the first post that we examine
-            post_leaning = array[opinion_idx, 0]
-            post = Post.from_array(array[opinion_idx])
-            post_idx = opinion_idx
-            # While we're still close to the user's preferred region
-            while np.abs(post_leaning - opinion) < tolerance and post_idx < len(array):
-                # Predicting how riveting the post will be, and storing that
-                predicted_engagement = Person.how_engaging(post, opinion)
-                output.append([predicted_engagement, post])
-                # If we're at the end, we need to break out of the loop
-                if post_idx == len(array) - 1:
-                    break
-                # Otherwise we can go onto the next post
-                post_idx += 1
-                post_leaning = array[post_idx, 0]
-                post = Post.from_array(array[post_idx])
-        """
-        Checking the posts that have more of a negative leaning
-        """
-        if 0 < opinion_idx < len(array):
-            # Initializing the first post that we examine
-            post_idx = opinion_idx - 1
-            post_leaning = array[post_idx, 0]
-            post = Post.from_array(array[post_idx])
-            # While we're still close to the user's preferred region
-            while np.abs(post_leaning - opinion) < tolerance and post_idx >= 0:
-                # Predicting how riveting the post will be, and storing that
-                predicted_engagement = Person.how_engaging(post, opinion)
-                output.append([predicted_engagement, post])
-                # If we've reached the zeroeth index, we need to break out of the loop
-                if post_idx == 0:
-                    break
-                # Otherwise we can go onto the next post
-                post_idx -= 1
-                post_leaning = array[post_idx, 0]
-                post = Post.from_array(array[post_idx])
-    output = sorted(output, key=lambda x: x[0], reverse=True)
-    for tuple in output:
-        person.add_to_feed(tuple[1])
-
-
-def send_news(user, content):
+        rows_per_chunk = max(1, max_entries // len(candidates))
+        for start in range(0, len(group), rows_per_chunk):
+            _rank_similar_news([users[i] for i in group[start:start + rows_per_chunk]],
+                               opinions[group[start:start + rows_per_chunk]], candidates, top_k, tolerance)
+        num_scored += len(group) * len(candidates)
+    return num_scored
+
+
+# Scores candidates for a group of users, keeping only posts within each user's window, and fills their feeds
+def _rank_similar_news(users, opinions, candidates, top_k, tolerance):
+    # Person._read_feed swaps the first two columns, so column 1 is the leaning the user will see
+    predicted_engagement = how_engaging_batch(candidates[:, 1], candidates[:, 0], opinions)
+    in_window = ((candidates[None, :, 0] >= opinions[:, None] - tolerance) &
+                 (candidates[None, :, 0] < opinions[:, None] + tolerance))
+    predicted_engagement[~in_window] = -np.inf
+    num_in_window = np.count_nonzero(in_window, axis=1)
+    if top_k:
+        num_to_send = np.minimum(num_in_window, [feed_top_k(user.consumption) for user in users])
+        ranking = rank_top_k(predicted_engagement, num_to_send.max())
+    else:
+        num_to_send = num_in_window
+        # Sorting the output by how engaging it is. Posts outside the window end up at the back
+        ranking = np.argsort(-predicted_engagement, axis=1, kind='stable')
+    for user, user_ranking, user_engagement, num in zip(users, ranking, predicted_engagement, num_to_send):
+        if top_k:
+            user.feed.clear()
+        user.extend_feed(candidates[user_ranking[:num], ID_COL], user_engagement[user_ranking[:num]])
+
+
+def send_news(user, content, top_k=False):
     """
-    @param content: all the available content that has been generated in the last time step, stored as a list of
-    numpy arrays (there's probably a more efficient way to do that, but I'm not sure how)
+    @type content: PostStore
+    @param content: all the available content that has been generated in the last few time steps
     @type user: Person whose feed we will populate with new posts
+    @param top_k: if True, only the feed_top_k(user.consumption) most engaging posts are ranked and the user's feed is
+    replaced with them, instead of everything being sorted and added on to the end of the feed. Since every post in the
+    content window gets offered again next step, nothing is lost by not keeping the rest around, and the feed stops
+    growing while the user is offline
     """
-    tolerance = 0.3
     opinion = user.get_opinion()
-    output = []
-    for array in content:
-        # Skipping over portions of the array which aren't "initialized"
-        if isinstance(array, int):
-            continue
+    arrays = content.get_content()
+    if len(arrays) == 0:
+        return
+    all_posts = np.concatenate(arrays)
+    """
+    basic idea:
+    We're going to check ALL posts, using the batched version of the static method in Person class to calculate how
+    engaging they will be, rank that, and then send the post ids to the user's feed. Person._read_feed swaps the first
+    two columns, so column 1 is the leaning the user will see and column 0 is the interest value
+    """
+    predicted_engagement = how_engaging_batch(all_posts[:, 1], all_posts[:, 0], [opinion])
+    if top_k:
+        ranking = rank_top_k(predicted_engagement, feed_top_k(user.consumption))[0]
+        user.feed.clear()
+    else:
+        # Sorting the output by how engaging it is (stable, so ties keep the order they were generated in)
+        ranking = np.argsort(-predicted_engagement[0], kind='stable')
+    # Putting each post, based on its predicted engagement, in the user's feed
+    user.extend_feed(all_posts[ranking, ID_COL], predicted_engagement[0, ranking])
+
+
+def send_news_bucketed(users, content, recommender, top_k=False, tolerance=None, step=0):
+    """
+    Approximate send_news for a whole list of users at once: everyone gets the ranking of the opinion bucket they're in
+    instead of one worked out for their own opinion (see bucket_recommender.py)
+    @type content: PostStore
+    @param content: all the available content that has been generated in the last few time steps
+    @param users: list of Person whose feeds we will populate with new posts
+    @type recommender: BucketRecommender
+    @param top_k: same as in send_news
+    @param tolerance: if given, only posts within tolerance of the middle of each bucket are recommended (like
+    send_similar_news)
+    @param step: current time step, for the recommender's error reports
+    """
+    arrays = content.get_content()
+    if len(arrays) == 0 or len(users) == 0:
+        return
+    all_posts = np.concatenate(arrays)
+    opinions = np.array([user.get_opinion() for user in users], dtype=float)
+    buckets = recommender.bucket_of(opinions)
+    num_to_send = np.full(len(users), len(all_posts))
+    if top_k:
+        num_to_send = feed_top_k([user.consumption for user in users])
+    ranking, engagement, num_ranked = recommender.rank(all_posts, num_to_send.max() if top_k else None, tolerance)
+    recommender.measure(step, all_posts, opinions, tolerance)
+    num_to_send = np.minimum(num_to_send, num_ranked[buckets])
+    ids = all_posts[ranking, ID_COL]
+    ranked_engagement = np.take_along_axis(engagement, ranking, axis=1)
+    for user, bucket, num in zip(users, buckets, num_to_send):
+        if top_k:
+            user.feed.clear()
+        user.extend_feed(ids[bucket, :num], ranked_engagement[bucket, :num])
+
+
+# One time step of the per-object simulation: everybody gets the chance to post, the posts are sent to their friends
+# and made available to the site, and then everyone gets their news and goes through their routine. Returns how many
+# people were online
+def run_step(graph, all_content, use_top_k=False, use_similar_news=False, instruments=NULL_INSTRUMENTS, step=0,
+             recommender=None):
+    """
+    @param graph: graph whose nodes hold the people
+    @type all_content: PostStore
+    @param use_top_k: see send_news
+    @param use_similar_news: recommends with send_similar_news_batch instead of send_news
+    @param instruments: Instruments that time the phases of the step (see instrumentation.py)
+    @param step: which time step this is (only used to decide whether instruments measures it)
+    @param recommender: BucketRecommender to recommend with instead of ranking every post for every user (see
+    send_news_bucketed). None recommends exactly
+    """
+    instruments.start_step(step)
+    if all_content.wants_to_forget():
+        all_content.forget_records(np.concatenate([np.zeros(0, dtype=np.int64)] + [
+            node_tuple[1]['Person'].used_post_ids() for node_tuple in graph.nodes(data=True)]))
+    """
+    This is the first time that we'll iterate through the graph. The first time, we're seeing who posted on their
+    message board. It's kind of inefficient, but I don't see a way around it if we always want to procure the
+    freshest news for the users. This loop iterates through every node in the graph and gives a tuple with info
+    about the node
+    """
+    for node_tuple in graph.nodes(data=True):
+        # Retrieving the associated person with each node
+        person = node_tuple[1]['Person']
+
+        # Seeing if that person decides to make a post at this timestep
+        with instruments.phase('post'):
+            post = person.make_post()
         """
-        basic idea:
-        We're going to check ALL posts, using
-        static method in Person class to calculate how engaging it will be, rank that, and then send it to the user's
-        feed
+        if post is of the proper type (not None) then this portion of the code will send the post to all of this
+        person's friends
         """
-        for post_array in array:
-            # Recreating the post from information stored about it
-            re_post = Post.from_array(post_array)
-            # Predicting how riveting the post will be, and storing that
-            predicted_engagement = Person.how_engaging(re_post, opinion)
-            output.append([predicted_engagement, re_post])
-    # Sorting the output by how engaging it is
-    output = sorted(output, key=lambda x: x[0], reverse=True)
-    # Putting each post, based on its predicted engagement, in the user's feed
-    for element in output:
-        person.add_to_feed(element[1])
+        if isinstance(post, Post):
+            # If the user decides not to make a post, they return None which is not appended. From here on
+            # the post is only referred to by the id that the store gives it
+            post_id = all_content.add_post(post, author=node_tuple[0])
+            instruments.count('posts_made')
+            """
+            node_tupe is a tuple that holds the node index, as well as its attributes. Have to index into it to
+            use it for an adjacency call, which returns an iterable of node indices
+            """
+            with instruments.phase('notify'):
+                for neigh_node in graph.adj[node_tuple[0]]:
+                    """
+                    Notifies all of their friends directly that they made a post
+                    graph.nodes[index] returns the attributes of the node, which is a dictionary which we can index
+                    into using the key ['Person'] to get the Person and call its methods
+                    """
+                    graph.nodes[neigh_node]['Person'].notify(post_id)
+            instruments.count('notifications_sent', len(graph.adj[node_tuple[0]]))
+
+    # Sorting the most novel user-generated content and making it available to the site
+    with instruments.phase('post'):
+        new_content = all_content.end_step()
+    instruments.gauge('content_window', len(all_content))
+    # print(f"new content:\n{np.around(new_content, 2)}")
+
+    num_online = 0
+
+    """
+    The second time that we iterate through the graph. This time, we'll actually be making predictions about
+    what people want to see in their inbox
+    """
+    if recommender is not None:
+        # Same as below, everyone's opinions are known before anyone reads
+        with instruments.phase('recommend'):
+            send_news_bucketed([node_tuple[1]['Person'] for node_tuple in graph.nodes(data=True)], all_content,
+                               recommender, top_k=use_top_k, tolerance=0.3 if use_similar_news else None, step=step)
+        instruments.count('posts_scored', recommender.num_buckets * len(all_content))
+    elif use_similar_news:
+        # Everyone's opinions are known before anyone reads, so the whole graph is recommended to at once
+        with instruments.phase('recommend'):
+            num_scored = send_similar_news_batch([node_tuple[1]['Person'] for node_tuple in graph.nodes(data=True)],
+                                                 all_content, top_k=use_top_k)
+        instruments.count('posts_scored', num_scored)
+    feed_length = 0
+    for node_tuple in graph.nodes(data=True):
+        person = node_tuple[1]['Person']
+        if person.get_online():
+            num_online += 1
+        # Adding news to their feed (factoring this out so that it's easier to modify later)
+        if recommender is None and not use_similar_news:
+            with instruments.phase('recommend'):
+                send_news(person, all_content, top_k=use_top_k)
+            instruments.count('posts_scored', len(all_content))
+        if instruments.active:
+            feed_length += len(person.feed)
+            unread = len(person.feed)
+        # User goes through their normal routine on the site
+        with instruments.phase('read'):
+            person.cycle(all_content)
+        if instruments.active:
+            # Posts taken out of the feed to be read, like the ones Population ranks out of its batches
+            instruments.count('posts_materialized', unread - len(person.feed))
+    instruments.gauge('online', num_online)
+    instruments.gauge('feed_length', feed_length)
+    instruments.end_step()
+    return num_online
 
 
 # class Company:
@@ -188,7 +312,49 @@ if __name__ == "__main__":
     at 100 time cycles, takes about 7 seconds
     at 1200 num_time_cycles, takes about 2 minutes to run algorithm
     can go up to 10000 (and maybe higher?), but takes a bit
+    Setting use_population to True runs the vectorized version in population.py instead, which is a lot faster
+    Setting use_top_k to True only puts the few most engaging posts in each feed (see send_news)
+    Setting use_similar_news to True only recommends posts close to each user's opinion (see send_similar_news_batch)
     """
+    use_population = False
+    use_top_k = False
+    use_similar_news = False
+    # Setting num_workers runs all of the Monte Carlo cycles in parallel with that many processes (no plots)
+    num_workers = None
+    # Setting trajectory_dir streams every step of the vectorized version to that directory (see trajectory.py)
+    trajectory_dir = None
+    # Setting profile_path writes a trace of where the time of every profile_every-th step went (see
+    # instrumentation.py). A .csv ending writes CSV, anything else JSON
+    profile_path = None
+    profile_every = 10
+    # Setting history_every keeps everyone's opinion, online state, engagement and read posts for every history_every-th
+    # step of the vectorized version in memory (see PopulationHistory in history.py). A run that carries on from a
+    # checkpoint only has the steps since then
+    history_every = None
+    # Setting checkpoint_path saves the whole simulation there every checkpoint_interval steps (see checkpoint.py). If
+    # there's already a checkpoint there, the run carries on from it instead of starting over
+    checkpoint_path = None
+    checkpoint_interval = 1000
+    # Extra retention settings for the content window on top of keeping the last num_stored_cycles steps, like
+    # {'post_budget': 500} or {'decay': ebbinghaus_weighting(), 'min_interest': 0.2} (see post_store.py)
+    content_window = {}
+    # Setting num_buckets recommends approximately, with everyone's opinion rounded into that many buckets (see
+    # bucket_recommender.py). How far off it is from the exact ranking gets printed at the end
+    num_buckets = None
+    # Setting bias_table_resolution looks the bias factor of how_engaging up in a precomputed table of that resolution
+    # instead of working it out every time. It only saves time on big batches of posts and the numba backend doesn't
+    # use it (see bias_table.py)
+    bias_table_resolution = None
+    # Setting backend to 'numba' reads and ranks everyone's posts in compiled loops in the vectorized version, if numba
+    # is installed (see kernels.py)
+    backend = 'numpy'
+    # The vectorized version throws posts out of the feeds once they're feed_horizon steps old, so that its memory
+    # doesn't grow with the number of steps. Person's Feed keeps every post until it's read, so None matches the
+    # per-object version exactly, at the cost of keeping num_users opinions around for every step so far
+    feed_horizon = 10
+    # Everybody's stats, their own random streams, the graphs and the vectorized version's draws all come from seed, so
+    # the same seed gives the same run. None picks a fresh one every time
+    seed = 0
     avg_cxns = 3
     num_users = 100
     num_time_cycles = 100
@@ -199,137 +365,148 @@ if __name__ == "__main__":
     # algorithm
     # users = gen_polar_rand_ppl(num_users, 0.25, 0.75)
     # users = gen_rand_ppl(num_users)
-    users = gen_biased_rand_ppl(num_users, 0.9)
+    rng = np.random.default_rng(seed)
+    users = gen_biased_rand_ppl(num_users, 0.9, rng)
+    if bias_table_resolution is not None:
+        use_bias_table(bias_table_resolution)
     initial_op = poll_opinions(users)
-    for mc_cycle in range(num_mc_cycles):
-        # Randomizing social connections
-        graph = link_ppl_rand_graph(users, 3)
+    if num_workers is not None:
+        # Every realization is run at once in a pool of processes, using the vectorized version (see mc_runner.py)
+        results = MCRunner.from_ppl_dict(users, avg_cxns, num_time_cycles, num_workers=num_workers, top_k=use_top_k,
+                                         similar_news=use_similar_news, seed=seed).run(num_mc_cycles)
+        print(f"average users on site was {results.average_online()}")
+        for opinions in results.final_opinions:
+            print(f"average opinion was {np.round(np.mean(opinions), 4)} with standard deviation "
+                  f"{np.round(np.std(opinions), 4)}")
+    else:
+        instruments = NULL_INSTRUMENTS if profile_path is None else Instruments(sample_every=profile_every)
+        recommender = None if num_buckets is None else BucketRecommender(num_buckets)
+        history = None if history_every is None else PopulationHistory(num_users, num_time_cycles, every=history_every)
+        checkpointer = None
+        resume = None
+        first_mc_cycle = 0
+        if checkpoint_path is not None:
+            checkpointer = Checkpointer(checkpoint_path, checkpoint_interval)
+            if os.path.exists(checkpoint_path):
+                resume = load_checkpoint(checkpoint_path)
+                first_mc_cycle = resume['extra']['mc_cycle']
+        for mc_cycle in range(first_mc_cycle, num_mc_cycles):
+            # Randomizing social connections
+            graph = link_ppl_rand_graph(users, 3, rng)
 
-        # Resetting users to their original state
-        for person in users.items():
-            # print(person)
-            person[1]['Person'].reset()
+            # Resetting users to their original state
+            for person in users.items():
+                # print(person)
+                person[1]['Person'].reset()
 
-        # draw_bias_graph(graph)
+            # draw_bias_graph(graph)
 
-        """
-        This is all the content that has been generated in the last couples cycles of the algorithm. I don't think we can
-        store all of the data, because I ran a test and 10,000^2 posts managed to use up all of my memory.
-        If we choose to remove duplicate posts from people's feeds, we can use a decorator on the node, and employ this
-        indexing system so that we don't have to keep track of every single post that they have seen in the past
-        """
-        num_stored_cycles = 3
-        store_idx = -1
-        all_content = [-1 for i in range(num_stored_cycles)]
-        # print(f"all content is\n{all_content}\n(should be empty)'")
-
-        # This will allow us to calculate the site's "revenue" over time
-        time_spent_online = []
-        # Keeps track of specific timestamps
-        start_time = time.time()
-        quarter_time = 0
-        half_time = 0
-        three_quarters_time = 0
-        # going through multiple time cycles
-        for i in range(num_time_cycles):
-            # Useful to have this printout
-            if i == num_time_cycles // 4:
-                quarter_time = time.time()
-                print(f"25% complete, took {quarter_time - start_time}s")
-                print(f"all content has length {len(all_content)}, sub-news have lengths {[len(all_content[i]) for i in range(num_stored_cycles)]}")
-            elif i == num_time_cycles // 2:
-                half_time = time.time()
-                print(f"50% complete, took {half_time - quarter_time}")
-                print(f"all content has length {len(all_content)}, sub-news have lengths {[len(all_content[i]) for i in range(num_stored_cycles)]}")
-            elif i == 3 * num_time_cycles // 4:
-                three_quarters_time = time.time()
-                print(f"75% complete, took {three_quarters_time - half_time}")
-                print(f"all content has length {len(all_content)}, sub-news have lengths {[len(all_content[i]) for i in range(num_stored_cycles)]}")
-            elif i == 19 * num_time_cycles // 20:
-                print(f"95% complete, took {time.time() - three_quarters_time}")
-                print(f"all content has length {len(all_content)}, sub-news have lengths {[len(all_content[i]) for i in range(num_stored_cycles)]}")
-            # This is the most novel user-generated content
-            new_content = np.ones([0, 3])
             """
-            This is the first time that we'll iterate through the graph. The first time, we're seeing who posted on their
-            message board. It's kind of inefficient, but I don't see a way around it if we always want to procure the
-            freshest news for the users. This loop iterates through every node in the graph and gives a tuple with info
-            about the node
+            This is all the content that has been generated in the last couples cycles of the algorithm. I don't think we can
+            store all of the data, because I ran a test and 10,000^2 posts managed to use up all of my memory.
+            If we choose to remove duplicate posts from people's feeds, we can use a decorator on the node, and employ this
+            indexing system so that we don't have to keep track of every single post that they have seen in the past
             """
-            for node_tuple in graph.nodes(data=True):
-                # Retrieving the associated person with each node
-                person = node_tuple[1]['Person']
-                name = node_tuple[1]['Name']
-
-                # Seeing if that person decides to make a post at this timestep
-                post = person.make_post()
-                """
-                if post is of the proper type (not None) then this portion of the code will send the post to all of this
-                person's friends
-                """
-                if isinstance(post, Post):
-                    # If the user decides not to make a post, they return None which is not appended
-                    new_content = add_available_post(new_content, post)
-                    """
-                    node_tupe is a tuple that holds the node index, as well as its attributes. Have to index into it to
-                    use it for an adjacency call, which returns an iterable of node indices
-                    """
-                    for neigh_node in graph.adj[node_tuple[0]]:
-                        """
-                        Notifies all of their friends directly that they made a post
-                        graph.nodes[index] returns the attributes of the node, which is a dictionary which we can index
-                        into using the key ['Person'] to get the Person and call its methods
-                        """
-                        graph.nodes[neigh_node]['Person'].notify(post)
-
-            # print(f"new content:\n{np.around(new_content, 2)}")
-            store_idx += 1
-            if store_idx >= num_stored_cycles:
-                store_idx = 0
-            all_content[store_idx] = new_content
-
-            num_online = 0
+            num_stored_cycles = 3
+            all_content = PostStore(num_stored_cycles, **content_window)
 
-            """
-            The second time that we iterate through the graph. This time, we'll actually be making predictions about
-            what people want to see in their inbox
-            """
+            # This will allow us to calculate the site's "revenue" over time
+            time_spent_online = []
+            first_step = 0
+            # Keeps track of specific timestamps
+            start_time = time.time()
+            quarter_time = 0
+            half_time = 0
+            three_quarters_time = 0
+            if use_population:
+                # Same algorithm, but every user is advanced at once using numpy arrays (see population.py)
+                population = Population.from_ppl_dict(users, rng=rng, top_k=use_top_k, similar_news=use_similar_news,
+                                                      instruments=instruments, recommender=recommender,
+                                                      backend=backend, feed_horizon=feed_horizon, history=history,
+                                                      content_window={'num_stored_cycles': num_stored_cycles,
+                                                                      **content_window})
+                population.link(graph)
+                if resume is not None:
+                    population.set_state(resume['population'])
+                    first_step = resume['extra']['step']
+                    time_spent_online = resume['extra']['time_spent_online']
+                    resume = None
+                writer = None
+                if trajectory_dir is not None:
+                    writer = TrajectoryWriter(os.path.join(trajectory_dir, f"mc_{mc_cycle}"), population.num_users)
+                for i in range(first_step, num_time_cycles):
+                    if checkpointer is not None and i > first_step:
+                        checkpointer.maybe_save(i, lambda: {'population': population.get_state(), 'extra': {
+                            'mc_cycle': mc_cycle, 'step': i, 'time_spent_online': list(time_spent_online)}})
+                    first_new_post = population.all_content.num_posts
+                    time_spent_online.append(population.step())
+                    if writer is not None:
+                        new_posts = np.arange(first_new_post, population.all_content.num_posts)
+                        writer.append(population.opinion, time_spent_online[-1],
+                                      population.all_content.get_records(new_posts))
+                if writer is not None:
+                    writer.close()
+                population.write_back(users)
+                if history is not None:
+                    print(f"history kept {history.num_samples} steps, average engagement per user was "
+                          f"{np.mean(history.engagement)}")
+            else:
+                if resume is not None:
+                    graph, all_content, extra = restore_object_sim(resume, users, all_content)
+                    first_step = extra['step']
+                    time_spent_online = extra['time_spent_online']
+                    # The graphs of the realizations still to come are drawn from rng
+                    rng.bit_generator.state = extra['rng']
+                    resume = None
+                # going through multiple time cycles
+                for i in range(first_step, num_time_cycles):
+                    if checkpointer is not None and i > first_step:
+                        checkpointer.maybe_save(i, lambda: object_sim_state(graph, all_content, {
+                            'mc_cycle': mc_cycle, 'step': i, 'time_spent_online': list(time_spent_online),
+                            'rng': rng.bit_generator.state}))
+                    # Useful to have this printout
+                    if i == num_time_cycles // 4:
+                        quarter_time = time.time()
+                        print(f"25% complete, took {quarter_time - start_time}s")
+                        print(f"all content has length {len(all_content)}, sub-news have lengths {all_content.cycle_lengths()}")
+                    elif i == num_time_cycles // 2:
+                        half_time = time.time()
+                        print(f"50% complete, took {half_time - quarter_time}")
+                        print(f"all content has length {len(all_content)}, sub-news have lengths {all_content.cycle_lengths()}")
+                    elif i == 3 * num_time_cycles // 4:
+                        three_quarters_time = time.time()
+                        print(f"75% complete, took {three_quarters_time - half_time}")
+                        print(f"all content has length {len(all_content)}, sub-news have lengths {all_content.cycle_lengths()}")
+                    elif i == 19 * num_time_cycles // 20:
+                        print(f"95% complete, took {time.time() - three_quarters_time}")
+                        print(f"all content has length {len(all_content)}, sub-news have lengths {all_content.cycle_lengths()}")
+                    time_spent_online.append(run_step(graph, all_content, use_top_k, use_similar_news, instruments, i,
+                                                      recommender))
+
+            print(f"average users on site was {sum(time_spent_online) / len(time_spent_online)}")
+            if recommender is not None:
+                print(f"approximate recommending with {num_buckets} buckets vs exact: {recommender.summary()}")
+            opinion_dist = poll_opinions(users)
+            np_new_opinions = np.array(opinion_dist)
+            np_old_opinions = np.array(initial_op)
+            print(f"For the original distribution, the the average opinion was {np.round(np.mean(np_old_opinions), 4)} with"
+                  f" standard deviation {np.round(np.std(np_old_opinions), 4)}.\nFor the distribution at the end of the "
+                  f"algorithm, the average is {np.round(np.mean(np_new_opinions), 4)} and the standard deviation is "
+                  f"{np.round(np.std(np_new_opinions), 4)}")
+            from plotting import show_run_summary
+            show_run_summary(time_spent_online, opinion_dist, initial_op, num_users)
+
+            print("Current bias graph")
+            draw_bias_graph(graph)
             for node_tuple in graph.nodes(data=True):
-                person = node_tuple[1]['Person']
-                if person.get_online():
-                    num_online += 1
-                # Adding news to their feed (factoring this out so that it's easier to modify later)
-                send_news(person, all_content)
-                # User goes through their normal routine on the site
-                person.cycle()
-
-            time_spent_online.append(num_online)
-
-        print(f"average users on site was {sum(time_spent_online) / len(time_spent_online)}")
-        fig, (ax1, ax2, ax3) = plt.subplots(1, 3)
-        opinion_dist = poll_opinions(users)
-        np_new_opinions = np.array(opinion_dist)
-        np_old_opinions = np.array(initial_op)
-        print(f"For the original distribution, the the average opinion was {np.round(np.mean(np_old_opinions), 4)} with"
-              f" standard deviation {np.round(np.std(np_old_opinions), 4)}.\nFor the distribution at the end of the "
-              f"algorithm, the average is {np.round(np.mean(np_new_opinions), 4)} and the standard deviation is "
-              f"{np.round(np.std(np_new_opinions), 4)}")
-        # Plots the last few hundred steps of the number of people online
-        num_steps_to_plot = 300
-        if len(time_spent_online) < num_steps_to_plot:
-            lin_space = np.arange(len(time_spent_online))
-            ax1.plot(lin_space, time_spent_online)
-        else:
-            lin_space = np.arange(num_steps_to_plot)
-            ax1.plot(lin_space, time_spent_online[-num_steps_to_plot:])
-        n_bins = min(int(num_users / 5), 30)
-        ax2.hist(opinion_dist, density=True, bins=n_bins, range=[0, 1])
-        ax3.hist(initial_op, density=True, bins=n_bins, range=[0, 1])
-        plt.show()
-
-        print("Current bias graph")
-        draw_bias_graph(graph)
-        for node_tuple in graph.nodes(data=True):
-            person = node_tuple[1]['Person'].reset()
-        print("bias graph at beginning of cycle")
-        draw_bias_graph(graph)
+                person = node_tuple[1]['Person'].reset()
+            print("bias graph at beginning of cycle")
+            draw_bias_graph(graph)
+        if checkpointer is not None:
+            checkpointer.close()
+        if profile_path is not None:
+            if profile_path.endswith('.csv'):
+                instruments.to_csv(profile_path)
+            else:
+                instruments.to_json(profile_path)
+            print(f"time spent in each phase: {instruments.summary()}")
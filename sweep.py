@@ -0,0 +1,159 @@
+import os
+import json
+import hashlib
+import itertools
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from mc_runner import MCRunner
+from graph_funcs import gen_rand_stats, gen_polar_rand_stats, gen_biased_rand_stats
+
+"""
+This file runs parameter sweeps, instead of having to hand-edit the constants in the __main__ block of social_media.py
+for every run. A sweep takes a grid of parameters, runs every point of the grid in a pool of worker processes, and saves
+each point to a ResultStore as soon as it's done. Every point gets its own .npz file named after a hash of its
+parameters, so if a sweep gets interrupted, running it again just skips the points that already have a file.
+
+The parameters that a point understands are:
+ - num_users, avg_cxns, num_time_cycles, num_mc_cycles
+ - distribution: 'rand' (gen_rand_stats), 'biased' (gen_biased_rand_stats, uses bias) or 'polar' (gen_polar_rand_stats,
+   uses lower_bias and upper_bias)
+ - tolerance: if not None, send_similar_news is used with this tolerance instead of send_news
+ - top_k: whether feeds only keep the few most engaging posts
+"""
+
+DEFAULT_PARAMS = {'num_users': 100, 'avg_cxns': 3, 'num_time_cycles': 100, 'num_mc_cycles': 1,
+                  'distribution': 'biased', 'bias': 0.9, 'lower_bias': 0.25, 'upper_bias': 0.75, 'tolerance': None,
+                  'top_k': False}
+
+
+# Short, stable name for a set of parameters. The same parameters always give the same hash, whatever order they're in
+def param_hash(params):
+    text = json.dumps(params, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+# Every combination of the values in grid, as a list of parameter dictionaries (filled out with DEFAULT_PARAMS)
+def expand_grid(grid):
+    """
+    @param grid: dictionary from parameter name to the list of values to try
+    """
+    keys = sorted(grid)
+    points = []
+    for values in itertools.product(*[grid[key] for key in keys]):
+        params = dict(DEFAULT_PARAMS)
+        params.update(zip(keys, values))
+        points.append(params)
+    return points
+
+
+class ResultStore:
+    """
+    Append-only directory of results, one .npz file per parameter point. Files are written to a temporary name first and
+    then renamed, which is atomic, so a reader (or another sweep writing to the same directory) never sees half of a
+    file, and a sweep that gets killed halfway through writing leaves nothing behind
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, params):
+        return os.path.join(self.directory, f"{param_hash(params)}.npz")
+
+    def has(self, params):
+        return os.path.exists(self._path(params))
+
+    # Saves the arrays for a point. If the point was already saved, it's left alone
+    def save(self, params, **arrays):
+        if self.has(params):
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                np.savez(file, params=json.dumps(params, sort_keys=True), **arrays)
+            os.replace(tmp_path, self._path(params))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    # Returns the parameters and the dictionary of arrays saved for a point
+    def load(self, params):
+        return ResultStore._read(self._path(params))
+
+    @staticmethod
+    def _read(path):
+        with np.load(path) as data:
+            arrays = {key: data[key] for key in data.files if key != 'params'}
+            return json.loads(str(data['params'])), arrays
+
+    # Goes through every finished point, giving back (params, arrays)
+    def __iter__(self):
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.npz'):
+                yield ResultStore._read(os.path.join(self.directory, name))
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.directory) if name.endswith('.npz'))
+
+
+# Makes the stats of the people for a point of the sweep
+def _gen_stats(params, rng):
+    if params['distribution'] == 'rand':
+        return gen_rand_stats(params['num_users'], rng)
+    elif params['distribution'] == 'polar':
+        return gen_polar_rand_stats(params['num_users'], params['lower_bias'], params['upper_bias'], rng)
+    elif params['distribution'] == 'biased':
+        return gen_biased_rand_stats(params['num_users'], params['bias'], rng)
+    raise ValueError(f"unknown distribution {params['distribution']}")
+
+
+# Runs every Monte Carlo realization of one point. Has to be at the top level of the module so it can be pickled
+def _run_point(args):
+    params, seed_seq = args
+    people_seed, mc_seed = seed_seq.generate_state(2)
+    stats = _gen_stats(params, np.random.default_rng(people_seed))
+    kwargs = {'top_k': params['top_k']}
+    if params['tolerance'] is not None:
+        kwargs.update(similar_news=True, tolerance=params['tolerance'])
+    runner = MCRunner(*stats, params['avg_cxns'], params['num_time_cycles'], num_workers=1, seed=int(mc_seed), **kwargs)
+    results = runner.run(params['num_mc_cycles'])
+    return params, {'initial_opinions': results.initial_opinions, 'final_opinions': results.final_opinions,
+                    'time_spent_online': results.time_spent_online}
+
+
+class Sweep:
+    def __init__(self, grid, store_dir, num_workers=None, seed=0):
+        """
+        @param grid: dictionary from parameter name to the list of values to try (see the top of this file)
+        @param store_dir: directory that results are saved in (and looked for, when resuming)
+        @param num_workers: how many processes to run points in. None uses every core, 1 runs them in this process
+        @param seed: every point's random stream is worked out from this seed and the point's parameters, so a point
+        gives the same results whether it's run in the first go or after resuming
+        """
+        self.points = expand_grid(grid)
+        self.store = ResultStore(store_dir)
+        self.num_workers = num_workers
+        self.seed = seed
+
+    def _seed_for(self, params):
+        return np.random.SeedSequence([self.seed, int(param_hash(params), 16)])
+
+    # The points that don't have results yet
+    def pending(self):
+        return [params for params in self.points if not self.store.has(params)]
+
+    # Runs every point that isn't done yet, saving each one as soon as it finishes. Returns how many points were run
+    def run(self):
+        tasks = [(params, self._seed_for(params)) for params in self.pending()]
+        if self.num_workers == 1:
+            for task in tasks:
+                params, arrays = _run_point(task)
+                self.store.save(params, **arrays)
+        else:
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                futures = [executor.submit(_run_point, task) for task in tasks]
+                # Only this process writes to the store, in whatever order the points finish
+                for future in as_completed(futures):
+                    params, arrays = future.result()
+                    self.store.save(params, **arrays)
+        return len(tasks)
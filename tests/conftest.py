@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live at the top of the repository, next to this directory
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+import person
+from person import Person, how_engaging_vec, how_engaging_batch, use_bias_table, bias_factor_exact, _skewed_means
+
+
+@pytest.fixture
+def table():
+    yield use_bias_table(1024)
+    use_bias_table(None)
+
+
+@pytest.mark.parametrize('leaning, opinion', [(0.005, 0.5), (0.5, 0.5), (0.995, 0.3), (0.4, 0.001), (0.0, 1.0)])
+def test_scalar_inputs(table, leaning, opinion):
+    bias = table.lookup(leaning, _skewed_means(opinion))
+    assert np.ndim(bias) == 0
+    assert abs(bias - bias_factor_exact(leaning, _skewed_means(opinion))) <= 0.0172
+    assert abs(Person.how_engaging_stripped(leaning, 1.0, opinion) - how_engaging_vec(leaning, 1.0, opinion)) <= 0.0172
+
+
+def test_edge_inputs_are_exact(table):
+    leanings = np.array([0.0, 0.005, 0.5, 0.995, 1.0])
+    opinions = np.array([0.5, 0.5, 0.0001, 0.5, 0.9999])
+    on_edge = np.array([True, True, False, True, True])
+    exact = how_engaging_vec(leanings, 1.0, opinions)
+    assert np.allclose(table.lookup(leanings, _skewed_means(opinions))[on_edge], exact[on_edge])
+    assert np.allclose([Person.how_engaging_stripped(leaning, 1.0, opinion)
+                        for leaning, opinion in zip(leanings[on_edge], opinions[on_edge])], exact[on_edge])
+    assert np.allclose(how_engaging_batch(leanings, np.ones(5), opinions),
+                       how_engaging_vec(leanings[None, :], 1.0, opinions[:, None]), atol=0.0172)
+
+
+def test_documented_max_error(table):
+    max_error, mean_error = table.max_error(10 ** 5)
+    assert max_error <= 0.0172
+    assert mean_error < 1e-4
+
+
+def test_exact_path_is_default():
+    assert person.get_bias_table() is None
+    assert Person.how_engaging_stripped(0.3, 0.7, 0.4) == pytest.approx(how_engaging_vec(0.3, 0.7, 0.4), abs=1e-12)
@@ -0,0 +1,23 @@
+import networkx as nx
+import numpy as np
+from checkpoint import object_sim_state, restore_object_sim
+from graph_funcs import gen_biased_rand_ppl
+from post_store import PostStore
+
+
+def test_restore_keeps_neighbour_order():
+    np.random.seed(0)
+    users = gen_biased_rand_ppl(40, 0.9)
+    rng = np.random.default_rng(0)
+    graph = nx.Graph()
+    graph.add_nodes_from(range(40))
+    edges = rng.integers(0, 40, [150, 2])
+    graph.add_edges_from(edges[edges[:, 0] != edges[:, 1]].tolist())
+    # Taking an edge out and putting it back moves it to the end of both neighbour lists
+    u, v = next(iter(graph.edges))
+    graph.remove_edge(u, v)
+    graph.add_edge(u, v)
+    nx.set_node_attributes(graph, users)
+    restored, _, _ = restore_object_sim(object_sim_state(graph, PostStore()), users)
+    assert all(list(restored.adj[node]) == list(graph.adj[node]) for node in range(40))
+    assert restored.number_of_edges() == graph.number_of_edges()
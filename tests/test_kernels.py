@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from kernels import get_kernels, rank_posts_numpy
+from test_population import _population
+
+pytest.importorskip('numba')
+
+
+@pytest.mark.parametrize('tolerance', [None, 0.3])
+def test_numba_ranking_matches_numpy(tolerance):
+    rng = np.random.default_rng(0)
+    leanings, interests, window_leanings = rng.random([3, 500])
+    # A few tied posts, which have to stay in the order they're in
+    interests[100:110] = interests[100]
+    leanings[100:110] = leanings[100]
+    opinions = rng.random(50)
+    for k in [1, 20, 500]:
+        numba_ranking = get_kernels('numba').rank_posts(leanings, interests, window_leanings, opinions, k, tolerance)
+        assert np.array_equal(numba_ranking, rank_posts_numpy(leanings, interests, window_leanings, opinions, k,
+                                                             tolerance))
+
+
+@pytest.mark.parametrize('similar_news', [False, True])
+def test_numba_population_matches_numpy(similar_news):
+    numpy_pop = _population(similar_news=similar_news)
+    numba_pop = _population(similar_news=similar_news, backend='numba')
+    for _ in range(20):
+        assert numpy_pop.step() == numba_pop.step()
+    assert np.allclose(numpy_pop.opinion, numba_pop.opinion)
@@ -0,0 +1,14 @@
+import numpy as np
+from person import Person
+from post_store import PostStore
+
+
+def test_running_out_of_posts_makes_up_no_name(capsys):
+    person = Person(5, 0.5, 0.5, rng=np.random.default_rng(0))
+    person.cycle(PostStore())
+    assert "given a user enough posts" in capsys.readouterr().out
+    assert person._name is None
+    person = Person(5, 0.5, 0.5, rng=np.random.default_rng(0))
+    person.name = 'Ada'
+    person.cycle(PostStore())
+    assert "given Ada enough posts" in capsys.readouterr().out
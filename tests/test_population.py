@@ -0,0 +1,103 @@
+import contextlib
+import io
+import networkx as nx
+import numpy as np
+import pytest
+from graph_funcs import gen_biased_rand_ppl, gen_biased_rand_stats, gen_connected_csr
+from history import PopulationHistory
+from instrumentation import Instruments
+from population import Population
+from post_store import PostStore
+from social_media import run_step
+
+
+def _population(num_users=300, seed=0, **kwargs):
+    rng = np.random.default_rng(seed)
+    population = Population(*gen_biased_rand_stats(num_users, 0.9, rng), rng=rng, **kwargs)
+    population.link(gen_connected_csr(num_users, 3, rng))
+    return population
+
+
+# How many posts each user has left in their feed, worked out from the batches
+def _posts_left(population):
+    left = -population.feed_offset.copy()
+    for batch, lens in population.batch_lens.items():
+        left += np.where(population.feed_batch <= batch, lens, 0)
+    return left
+
+
+def test_feed_horizon_bounds_batches():
+    population = _population(feed_horizon=5)
+    for _ in range(40):
+        population.step()
+        assert len(population.batches) <= 5
+        assert population.feed_batch.min() >= population.next_batch - 5
+        assert np.array_equal(_posts_left(population), population.feed_len)
+
+
+def test_no_horizon_keeps_unread_batches():
+    population = _population()
+    for _ in range(20):
+        population.step()
+    assert len(population.batches) > 5
+    assert np.array_equal(_posts_left(population), population.feed_len)
+
+
+def test_history_is_timed_apart_from_reading():
+    instruments = Instruments()
+    population = _population(history=PopulationHistory(300, 10), instruments=instruments)
+    for _ in range(10):
+        population.step()
+    for row in instruments.rows:
+        assert 'time_history' in row
+        phases = sum(value for key, value in row.items() if key.startswith('time_'))
+        assert phases <= row['total_time']
+
+
+def test_history_grows_past_num_time_cycles():
+    population = _population(history=PopulationHistory(300, 3))
+    for _ in range(10):
+        population.step()
+    assert np.array_equal(population.history.steps, np.arange(10))
+    assert np.array_equal(population.history.opinion[-1], population.opinion)
+    assert len(population.history.reads) == 10
+
+
+# Mean number of people online, and the mean and standard deviation of the final opinions, averaged over a few seeded
+# runs of 60 users for 40 steps. run builds the simulation from the people and graph of a seed and returns how many
+# people were online at every step and everyone's final opinion
+def _average_stats(run, num_seeds=6, num_users=60, num_steps=40):
+    stats = []
+    for seed in range(num_seeds):
+        np.random.seed(seed)
+        users = gen_biased_rand_ppl(num_users, 0.9)
+        graph = nx.connected_watts_strogatz_graph(num_users, 4, 0.1, seed=seed)
+        online, opinions = run(users, graph, seed, num_steps)
+        stats.append([np.mean(online), np.mean(opinions), np.std(opinions)])
+    return np.mean(stats, axis=0)
+
+
+def _run_objects(users, graph, seed, num_steps):
+    nx.set_node_attributes(graph, users)
+    all_content = PostStore(3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        online = [run_step(graph, all_content, step=i) for i in range(num_steps)]
+    return online, [users[i]['Person'].get_opinion() for i in range(len(users))]
+
+
+@pytest.fixture(scope='module')
+def object_stats():
+    return _average_stats(_run_objects)
+
+
+@pytest.mark.parametrize('feed_horizon', [None, 10])
+def test_same_statistics_as_objects(object_stats, feed_horizon):
+    def run_population(users, graph, seed, num_steps):
+        population = Population.from_ppl_dict(users, rng=np.random.default_rng(seed), feed_horizon=feed_horizon)
+        population.link(graph)
+        return [population.step() for _ in range(num_steps)], population.opinion
+
+    online, opinion_mean, opinion_std = _average_stats(run_population)
+    assert abs(online - object_stats[0]) < 0.05 * 60
+    assert abs(opinion_mean - object_stats[1]) < 0.02
+    assert abs(opinion_std - object_stats[2]) < 0.02
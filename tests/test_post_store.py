@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from person import ebbinghaus_weighting
+from post_store import PostStore, FEED_INTEREST_COL, INTEREST_COL
+
+
+# Fills a store with steps of posts from a polarized population: column 1 (the author's leaning) is around 0.25 or 0.75,
+# column 0 (the interest value readers see) is uniform. Returns the fraction of posts made with a left leaning
+def _fill_polarized(store, num_steps=30, posts_per_step=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    num_left = 0
+    for _ in range(num_steps):
+        sides = rng.random(posts_per_step) < 0.42
+        leanings = np.clip(np.where(sides, 0.25, 0.75) + rng.normal(0, 0.05, posts_per_step), 0, 1)
+        num_left += np.count_nonzero(leanings < 0.5)
+        store.add_rows(np.column_stack([rng.random(posts_per_step), leanings, np.zeros(posts_per_step)]))
+        store.end_step()
+    return num_left / (num_steps * posts_per_step)
+
+
+@pytest.mark.parametrize('retention', [{'num_stored_cycles': 30, 'post_budget': 300},
+                                       {'num_stored_cycles': 30, 'decay': ebbinghaus_weighting(), 'min_interest': 0.4}])
+def test_retention_keeps_leanings_unbiased(retention):
+    store = PostStore(**retention)
+    made_left = _fill_polarized(store)
+    window = store.get_view()
+    assert 0 < len(window) < 30 * 2000
+    kept_left = np.mean(window[:, INTEREST_COL] < 0.5)
+    assert abs(kept_left - made_left) < 0.1
+    # What's dropped is decided by the interest readers see
+    assert window[:, FEED_INTEREST_COL].mean() > 0.5
+
+
+def test_merged_view_matches_cycles():
+    store = PostStore(num_stored_cycles=5, post_budget=5000)
+    _fill_polarized(store, num_steps=10, posts_per_step=1000)
+    view = store.get_view()
+    assert np.all(np.diff(view[:, 0]) >= 0)
+    assert np.array_equal(np.sort(view[:, 2]), np.sort(np.concatenate(store.get_content())[:, 2]))
+    restored = PostStore(num_stored_cycles=5, post_budget=5000)
+    restored.set_state(store.get_state())
+    assert np.array_equal(restored.get_view(), view)
+
+
+def test_forget_records_keeps_window_and_used_ids():
+    store = PostStore(2)
+    _fill_polarized(store, num_steps=5, posts_per_step=100)
+    # A post made during the step that's still going on
+    store.add_rows([[0.5, 0.5, 0]])
+    first_kept = store.num_posts - 201
+    expected = store.get_records(np.r_[[3, 150], first_kept:store.num_posts])
+    store.forget_records([150, 3])
+    assert store.num_records == 2 + 201
+    assert np.array_equal(store.get_records(expected['id']), expected)
+    assert store.get_records(150)['id'] == 150
+    # New records can still be looked up once some are gone
+    new_rows = store.add_rows(np.full([3, 3], 0.5))
+    assert np.array_equal(store.get_records(new_rows[:, 2])['id'], new_rows[:, 2])
+    # Saving and loading keeps the ids the same
+    store.end_step()
+    loaded = PostStore(2)
+    loaded.set_state(store.get_state())
+    assert np.array_equal(loaded.get_records(expected['id']), expected)
+    assert loaded.add_rows([[0.5, 0.5, 0]])[0, 2] == store.num_posts
+
+
+def test_forgetting_bounds_records():
+    store = PostStore(3, post_budget=150)
+    for _ in range(50):
+        if store.wants_to_forget():
+            store.forget_records([])
+        _fill_polarized(store, num_steps=1, posts_per_step=100)
+    assert store.num_posts == 5000
+    assert store.num_records <= 2 * 1024
+    window_ids = store.get_view()[:, 2].astype(np.int64)
+    assert np.array_equal(store.get_records(window_ids)['id'], window_ids)
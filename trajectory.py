@@ -0,0 +1,162 @@
+import os
+import json
+import numpy as np
+from post_store import POST_DTYPE
+
+"""
+This file streams a run of the simulation to disk as it goes, for runs that are too long (or have too many users) to keep
+their whole trajectory in memory. Everything is split into chunks of chunk_steps time steps, each one its own .npy file:
+ - opinion_<chunk>.npy: everybody's opinion at the end of each step, shape (chunk_steps, num_users)
+ - online_<chunk>.npy: how many people were online during each step
+ - post_counts_<chunk>.npy: how many posts were made during each step
+ - posts.bin: the records (POST_DTYPE) of every post made, one step after the other
+meta.json says how many steps have been written. It's only updated once the data for those steps is on disk, so a run
+that gets killed halfway leaves a readable trajectory of everything up to the last flush.
+
+TrajectoryReader memory-maps the chunks, so slicing a time range or a few users only reads those parts of the files.
+"""
+
+META_FILE = 'meta.json'
+POSTS_FILE = 'posts.bin'
+
+
+def _chunk_path(directory, name, chunk):
+    return os.path.join(directory, f"{name}_{chunk:05d}.npy")
+
+
+class TrajectoryWriter:
+    def __init__(self, directory, num_users, chunk_steps=256):
+        """
+        @param directory: where the files go. It's made if it doesn't exist, and anything written there before is
+        overwritten
+        @param num_users: length of the opinion vectors
+        @param chunk_steps: how many time steps go in each chunk file
+        """
+        self.directory = directory
+        self.num_users = num_users
+        self.chunk_steps = chunk_steps
+        os.makedirs(directory, exist_ok=True)
+        self.num_steps = 0
+        self._posts_file = open(os.path.join(directory, POSTS_FILE), 'wb')
+        self._opinion = None
+        self._online = None
+        self._post_counts = None
+        self._write_meta()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Opens the files of the chunk that step goes in
+    def _open_chunk(self, chunk):
+        open_memmap = np.lib.format.open_memmap
+        self._opinion = open_memmap(_chunk_path(self.directory, 'opinion', chunk), mode='w+', dtype=np.float64,
+                                    shape=(self.chunk_steps, self.num_users))
+        self._online = open_memmap(_chunk_path(self.directory, 'online', chunk), mode='w+', dtype=np.int64,
+                                   shape=(self.chunk_steps,))
+        self._post_counts = open_memmap(_chunk_path(self.directory, 'post_counts', chunk), mode='w+', dtype=np.int64,
+                                        shape=(self.chunk_steps,))
+
+    # Adds one time step to the end of the trajectory
+    def append(self, opinion, num_online, posts=None):
+        """
+        @param opinion: everybody's opinion at the end of the step
+        @param num_online: how many people were online during the step
+        @param posts: POST_DTYPE records of the posts made during the step (see PostStore.records)
+        """
+        row = self.num_steps % self.chunk_steps
+        if row == 0:
+            self._open_chunk(self.num_steps // self.chunk_steps)
+        self._opinion[row] = opinion
+        self._online[row] = num_online
+        if posts is None:
+            posts = np.zeros(0, dtype=POST_DTYPE)
+        self._post_counts[row] = len(posts)
+        self._posts_file.write(np.ascontiguousarray(posts, dtype=POST_DTYPE).tobytes())
+        self.num_steps += 1
+        if row == self.chunk_steps - 1:
+            self.flush()
+
+    # Makes sure everything appended so far is on disk, and lets readers see it
+    def flush(self):
+        if self._opinion is not None:
+            self._opinion.flush()
+            self._online.flush()
+            self._post_counts.flush()
+        self._posts_file.flush()
+        os.fsync(self._posts_file.fileno())
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = {'num_users': self.num_users, 'chunk_steps': self.chunk_steps, 'num_steps': self.num_steps}
+        tmp_path = os.path.join(self.directory, META_FILE + '.tmp')
+        with open(tmp_path, 'w') as file:
+            json.dump(meta, file)
+        os.replace(tmp_path, os.path.join(self.directory, META_FILE))
+
+    def close(self):
+        if self._posts_file.closed:
+            return
+        self.flush()
+        self._posts_file.close()
+        self._opinion = None
+        self._online = None
+        self._post_counts = None
+
+
+class TrajectoryReader:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE)) as file:
+            meta = json.load(file)
+        self.num_users = meta['num_users']
+        self.chunk_steps = meta['chunk_steps']
+        self.num_steps = meta['num_steps']
+        self._chunks = {}
+
+    def __len__(self):
+        return self.num_steps
+
+    # Memory-maps a chunk file (only once per file)
+    def _chunk(self, name, chunk):
+        key = (name, chunk)
+        if key not in self._chunks:
+            self._chunks[key] = np.load(_chunk_path(self.directory, name, chunk), mmap_mode='r')
+        return self._chunks[key]
+
+    # Gathers rows start to stop of a chunked array, only touching the chunks that hold them
+    def _read(self, name, start, stop, columns=None):
+        start, stop, _ = slice(start, stop).indices(self.num_steps)
+        parts = []
+        for chunk in range(start // self.chunk_steps, -(-stop // self.chunk_steps)):
+            first = chunk * self.chunk_steps
+            rows = self._chunk(name, chunk)[max(start, first) - first:min(stop, first + self.chunk_steps) - first]
+            parts.append(rows if columns is None else rows[:, columns])
+        if len(parts) == 0:
+            shape = (0,) if name != 'opinion' else (0, self.num_users if columns is None else len(columns))
+            return np.zeros(shape)
+        return np.concatenate(parts)
+
+    # Opinions at the end of steps start to stop, of every user or only of users (array of user indices)
+    def opinions(self, start=0, stop=None, users=None):
+        columns = None if users is None else np.asarray(users)
+        return self._read('opinion', start, stop, columns)
+
+    # How many people were online during steps start to stop
+    def num_online(self, start=0, stop=None):
+        return self._read('online', start, stop)
+
+    # Records of every post made during steps start to stop
+    def posts(self, start=0, stop=None):
+        start, stop, _ = slice(start, stop).indices(self.num_steps)
+        # Only the counts before stop are needed to find where the posts of the range are in posts.bin
+        counts = self._read('post_counts', 0, stop).astype(np.int64)
+        first = int(counts[:start].sum())
+        num_posts = int(counts[start:].sum())
+        if num_posts == 0:
+            return np.zeros(0, dtype=POST_DTYPE)
+        posts = np.memmap(os.path.join(self.directory, POSTS_FILE), dtype=POST_DTYPE, mode='r',
+                          offset=first * POST_DTYPE.itemsize, shape=(num_posts,))
+        return np.array(posts)